@@ -88,10 +88,12 @@ struct UpdateFamilyMissionRequest: Codable {
 struct FamilyMemberRequest: Codable {
     let name: String
     let deviceToken: String?
+    let apnsEnvironment: String?
     
     enum CodingKeys: String, CodingKey {
         case name
         case deviceToken
+        case apnsEnvironment
     }
 }
 
@@ -310,7 +312,11 @@ class FamilyGoalAPI {
         // SettingsManagerからデバイストークンを取得
         let deviceToken = SettingsManager.shared.deviceToken.isEmpty ? nil : SettingsManager.shared.deviceToken
         
-        let request = FamilyMemberRequest(name: name, deviceToken: deviceToken)
+        let request = FamilyMemberRequest(
+            name: name,
+            deviceToken: deviceToken,
+            apnsEnvironment: deviceToken == nil ? nil : SettingsManager.shared.apnsEnvironment
+        )
         
         // デバッグ情報を出力
         print("🔧 ファミリー参加リクエスト:")
@@ -406,6 +412,7 @@ class FamilyGoalAPI {
         
         if let deviceToken = deviceToken {
             requestData["deviceToken"] = deviceToken
+            requestData["apnsEnvironment"] = SettingsManager.shared.apnsEnvironment
         }
         
         // デバッグ情報を出力
@@ -45,6 +45,15 @@ class SettingsManager: ObservableObject {
         return !deviceToken.isEmpty
     }
     
+    // デバイストークンを発行したAPNsの環境（開発ビルドは sandbox、TestFlight / App Store は production）
+    var apnsEnvironment: String {
+        #if DEBUG
+        return "sandbox"
+        #else
+        return "production"
+        #endif
+    }
+    
     func clearDeviceToken() {
         deviceToken = ""
         userDefaults.removeObject(forKey: deviceTokenKey)
@@ -0,0 +1,129 @@
+"""
+ローカルで動かす APNs のスタブ（h2c: TLS なしの HTTP/2）
+
+- /3/device/<token> への POST に 200 を返す
+- dead_prefix で始まるトークンには 410 Unregistered を返す（無効トークンの削除の確認用）
+- latency_ms で応答を遅らせる（同じ接続の他のストリームは待たせない）
+- HTTP/2 のプロトコル違反を受け取った場合は APNs と同じく GOAWAY を送って接続を閉じる（protocol_errors に記録）
+
+push-notification の APNsClient を base_url=server.base_url, http1=False で作成して向ける。
+"""
+import json
+import socket
+import threading
+import time
+
+import h2.config
+import h2.connection
+import h2.errors
+import h2.events
+import h2.exceptions
+
+
+class FakeAPNsServer:
+    def __init__(self, latency_ms=0.0, dead_prefix='dead'):
+        self.latency_ms = latency_ms
+        self.dead_prefix = dead_prefix
+        self.connections = 0
+        self.streams = 0
+        self.rejected = 0
+        self.protocol_errors = 0
+        self._lock = threading.Lock()
+        self._sock = socket.socket()
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(128)
+        self.port = self._sock.getsockname()[1]
+        self.base_url = f'http://127.0.0.1:{self.port}/3/device/'
+        self._closed = False
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def close(self):
+        self._closed = True
+        self._sock.close()
+
+    def stats(self):
+        return {'connections': self.connections, 'streams': self.streams, 'rejected': self.rejected,
+                'protocol_errors': self.protocol_errors}
+
+    def reset_stats(self):
+        with self._lock:
+            self.connections = self.streams = self.rejected = self.protocol_errors = 0
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                self.connections += 1
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client):
+        conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+        conn_lock = threading.Lock()
+        paths = {}
+
+        def flush():
+            data = conn.data_to_send()
+            if data:
+                try:
+                    client.sendall(data)
+                except OSError:
+                    pass
+
+        def respond(stream_id):
+            token = paths.pop(stream_id, '').rsplit('/', 1)[-1]
+            with conn_lock:
+                if conn.state_machine.state == h2.connection.ConnectionState.CLOSED:
+                    return
+                if token.startswith(self.dead_prefix):
+                    body = json.dumps({'reason': 'Unregistered', 'timestamp': int(time.time() * 1000)}).encode()
+                    conn.send_headers(stream_id, [(':status', '410'), ('apns-id', f'fake-{stream_id}')])
+                    conn.send_data(stream_id, body, end_stream=True)
+                    with self._lock:
+                        self.rejected += 1
+                else:
+                    conn.send_headers(stream_id, [(':status', '200'), ('apns-id', f'fake-{stream_id}')],
+                                      end_stream=True)
+                flush()
+
+        with conn_lock:
+            conn.initiate_connection()
+            flush()
+        while True:
+            try:
+                data = client.recv(65535)
+            except OSError:
+                return
+            if not data:
+                client.close()
+                return
+            ended = []
+            with conn_lock:
+                try:
+                    events = conn.receive_data(data)
+                except h2.exceptions.ProtocolError:
+                    with self._lock:
+                        self.protocol_errors += 1
+                    conn.close_connection(error_code=h2.errors.ErrorCodes.PROTOCOL_ERROR)
+                    flush()
+                    client.close()
+                    return
+                for event in events:
+                    if isinstance(event, h2.events.RequestReceived):
+                        paths[event.stream_id] = dict(event.headers).get(b':path', b'').decode()
+                    elif isinstance(event, h2.events.DataReceived):
+                        conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded):
+                        ended.append(event.stream_id)
+                flush()
+            for stream_id in ended:
+                with self._lock:
+                    self.streams += 1
+                if self.latency_ms > 0:
+                    threading.Timer(self.latency_ms / 1000, respond, args=(stream_id,)).start()
+                else:
+                    respond(stream_id)
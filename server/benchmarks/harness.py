@@ -0,0 +1,94 @@
+"""
+ベンチマーク共通の部品
+- サービスの main.py の読み込み（現在のコード、または git のリビジョン）
+- Flask のリクエストオブジェクトを作ってハンドラーを呼ぶ
+- レイテンシの集計
+"""
+import importlib.util
+import math
+import os
+import subprocess
+import sys
+import types
+from unittest import mock
+
+import flask
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+_app = flask.Flask('benchmarks')
+
+
+def load_service(service, revision=None):
+    """
+    サービスの main.py を読み込む（revision 指定時は git のその時点のコード）
+    古いリビジョンは import 時に firestore.Client() を作るため、その間だけインメモリの Firestore に差し替える
+    （認証情報のない環境でも読み込めるようにする。計測時のストレージは use_store で入れ替える）
+    """
+    name = f'bench_{service.replace("-", "_")}_{revision or "current"}'
+    path = os.path.join(SERVER_DIR, service, 'main.py')
+    if revision is None:
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    source = subprocess.run(
+        ['git', 'show', f'{revision}:./{service}/main.py'],
+        cwd=SERVER_DIR, check=True, capture_output=True, text=True
+    ).stdout
+    module = types.ModuleType(name)
+    module.__file__ = path
+    from google.cloud import firestore
+    from storage import MemoryFirestore
+    with mock.patch.object(firestore, 'Client', MemoryFirestore):
+        exec(compile(source, f'{revision}:{service}/main.py', 'exec'), module.__dict__)
+    return module
+
+
+def use_store(module, store):
+    """
+    サービスの Firestore クライアントを store に差し替える
+    現在のコードは get_db() が返す _db、古いリビジョンは import 時に作ったモジュール変数 db を使う
+    """
+    module._db = store
+    if hasattr(module, 'db'):
+        module.db = store
+
+
+def call_handler(handler, method='GET', query=None, body=None, headers=None, path='/'):
+    """
+    functions_framework と同じく flask.request を渡してハンドラーを呼ぶ
+    戻り値: (ステータス, レスポンスのバイト数, レスポンス本体)
+    """
+    with _app.test_request_context(path, method=method, query_string=query or {}, json=body, headers=headers or {}):
+        response = handler(flask.request)
+    if isinstance(response, tuple):
+        payload = response[0]
+        status = response[1] if len(response) > 1 else 200
+    else:
+        payload = response.get_data()
+        status = response.status_code
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    return status, len(payload), payload
+
+
+def percentile(sorted_values, fraction):
+    """ソート済みの値のパーセンタイル（最近傍法）"""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def latency_summary(samples_ms):
+    values = sorted(samples_ms)
+    return {
+        'p50_ms': round(percentile(values, 0.50), 3) if values else None,
+        'p95_ms': round(percentile(values, 0.95), 3) if values else None,
+        'p99_ms': round(percentile(values, 0.99), 3) if values else None,
+        'max_ms': round(values[-1], 3) if values else None,
+        'mean_ms': round(sum(values) / len(values), 3) if values else None,
+    }
@@ -0,0 +1,149 @@
+"""
+一覧GETのレスポンスサイズとエンコード時間を計測するベンチマーク
+
+インメモリの Firestore にメンバー・目標・ミッションを用意し、各ハンドラーの一覧GETを
+エンコーダー（json / orjson）、fields= の有無、圧縮（gzip / br）、NDJSON のストリーミングを変えて実行する。
+「before」は変更前と同じ json.dumps(全フィールド, ensure_ascii=False) の結果。
+
+使い方（server/ から実行）:
+    python benchmarks/list_payloads.py
+    python benchmarks/list_payloads.py --docs 1000 --repeat 50
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import flask
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from harness import load_service  # noqa: E402
+from storage import MemoryFirestore  # noqa: E402
+from common import responses  # noqa: E402
+
+# (サービス, ハンドラー名, コレクション, IDのキー, 親のクエリパラメータ, 一覧画面で使うフィールド)
+SERVICES = [
+    ('management-family', 'family_members_handler', 'family-management/fam1/members',
+     'memberId', {'familyId': 'fam1'}, 'name'),
+    ('update-user-mission', 'user_goals_handler', 'user-goals/user1/goals',
+     'goalId', {'userId': 'user1'}, 'title,isCompleted'),
+    ('update-family-mission', 'family_missions_handler', 'family-management/fam1/missions',
+     'doc_id', {'familyId': 'fam1'}, 'mission,isCleared'),
+]
+
+
+def seed(store, service, collection_path, count):
+    """サービスごとに本番に近い形のドキュメントを count 件作成する"""
+    rng = random.Random(0)
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(count):
+        created = started + timedelta(minutes=i)
+        if service == 'management-family':
+            data = {'name': f'メンバー{i}', 'deviceToken': '%064x' % rng.getrandbits(256)}
+        elif service == 'update-user-mission':
+            data = {
+                'title': f'毎日{i}分ストレッチする',
+                'detail': '朝起きたらすぐに行う。できなかった日は夜に行う。' * 2,
+                'isCompleted': rng.random() < 0.5,
+                'createdAt': created.isoformat(),
+                'updatedAt': created,
+            }
+        else:
+            data = {
+                'mission': f'お皿を洗う（{i}回目）',
+                'isCleared': rng.random() < 0.5,
+                'createdAt': created.isoformat(),
+                'updatedAt': created,
+                'clearedOn': None,
+            }
+        store.seed(f'{collection_path}/doc{i:05d}', data)
+
+
+def timed(func, repeat):
+    """func を repeat 回実行し、(最後の結果, 中央値ミリ秒) を返す"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=500, help='1コレクションあたりのドキュメント数')
+    parser.add_argument('--repeat', type=int, default=20, help='各ケースの実行回数（中央値を表示）')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    app = flask.Flask(__name__)
+
+    print(f'{"service":<24}{"variant":<34}{"bytes":>10}{"encode ms":>12}{"handler ms":>12}')
+    print('-' * 92)
+    for service, handler_name, collection_path, id_key, parent, list_fields in SERVICES:
+        module = load_service(service)
+        store = MemoryFirestore()
+        seed(store, service, collection_path, args.docs)
+        module._db = store
+        handler = getattr(module, handler_name)
+        json_default = responses.json_default
+
+        # 変更前: 全フィールドを json.dumps
+        before = []
+        for path, data in store.dump(collection_path + '/').items():
+            before.append({**data, id_key: path.rsplit('/', 1)[-1]})
+        body, encode_ms = timed(lambda: json.dumps(before, ensure_ascii=False, default=json_default).encode('utf-8'),
+                                args.repeat)
+        print(f'{service:<24}{"before (json, all fields)":<34}{len(body):>10}{encode_ms:>12.2f}{"-":>12}')
+
+        # ハンドラー内の JSON エンコードだけの時間を測る（エンコードは common/responses.py）
+        orjson, dumps_json = responses.orjson, responses.dumps_json
+        encode_samples = []
+
+        def timed_dumps(value):
+            started = time.perf_counter()
+            body = dumps_json(value)
+            encode_samples.append((time.perf_counter() - started) * 1000)
+            return body
+
+        responses.dumps_json = timed_dumps
+
+        variants = [
+            ('json', None, {}, False),
+            ('orjson', None, {}, True),
+            (f'orjson fields={list_fields}', list_fields, {}, True),
+            ('orjson fields + gzip', list_fields, {'Accept-Encoding': 'gzip'}, True),
+        ]
+        if responses.brotli is not None:
+            variants.append(('orjson fields + br', list_fields, {'Accept-Encoding': 'br'}, True))
+        variants.append(('orjson fields ndjson (streamed)', list_fields, {'Accept': 'application/x-ndjson'}, True))
+        for label, fields, headers, use_orjson in variants:
+            if use_orjson and orjson is None:
+                continue
+            responses.orjson = orjson if use_orjson else None
+            query = {**parent, **({'fields': fields} if fields else {})}
+
+            def call():
+                with app.test_request_context('/', method='GET', query_string=query, headers=headers):
+                    response = handler(flask.request)
+                if not isinstance(response[0], (bytes, str)):
+                    # NDJSON はジェネレーターで返るため、送信し終わるまでを計測する
+                    response = (b''.join(response[0]),) + tuple(response[1:])
+                return response
+
+            encode_samples.clear()
+            response, handler_ms = timed(call, args.repeat)
+            assert response[1] == 200, response
+            encode_ms = statistics.median(encode_samples)
+            print(f'{service:<24}{label:<34}{len(response[0]):>10}{encode_ms:>12.2f}{handler_ms:>12.2f}')
+        responses.orjson, responses.dumps_json = orjson, dumps_json
+
+
+if __name__ == '__main__':
+    sys.exit(main())
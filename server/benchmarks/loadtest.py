@@ -0,0 +1,419 @@
+"""
+4つのサービスの負荷試験（再現可能なシナリオ）
+
+各サービスの main.py を読み込み、functions_framework と同じ Flask のリクエストオブジェクトで
+ハンドラーを並列に呼び出す。ストレージはインメモリの Firestore（storage.MemoryFirestore、RPC 数を記録）
+または Firestore エミュレーター（FIRESTORE_EMULATOR_HOST）を使い、プッシュ通知はローカルの
+APNs スタブ（benchmarks/fake_apns.py）に送る。
+
+シナリオ:
+    members_large_family   大家族のメンバー一覧GETと更新
+    goals_long_history     長い目標履歴のページングGET・差分同期・作成・更新
+    missions_family        ミッションのサマリー・差分同期・達成の切り替え・作成
+    push_broadcast_burst   多数の家族への目標達成通知の集中（無効トークンを含む）
+    family_dashboard       家族画面のダッシュボード（メンバーとミッションを並行して読む）
+
+結果は JSON（--output、既定は標準出力）で、各シナリオの p50/p95/p99 レイテンシ、スループット、
+1リクエストあたりの Firestore RPC 数、APNs への送信数、ピークメモリを出す。
+
+使い方（server/ から実行）:
+    python benchmarks/loadtest.py
+    python benchmarks/loadtest.py --scenario push_broadcast_burst --requests 500 --concurrency 32
+    python benchmarks/loadtest.py --latency-ms 5 --apns-latency-ms 20 --output results.json
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python benchmarks/loadtest.py --backend emulator
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_apns import FakeAPNsServer  # noqa: E402
+from harness import SERVER_DIR, call_handler, latency_summary, load_service  # noqa: E402
+from storage import MemoryFirestore, create_async_client  # noqa: E402
+
+
+def seed_documents(db, documents):
+    """{パス: データ} を書き込む（インメモリは直接、エミュレーターはバッチで）"""
+    if hasattr(db, 'seed'):
+        for path, data in documents.items():
+            db.seed(path, data)
+        return
+    items = list(documents.items())
+    for start in range(0, len(items), 500):
+        batch = db.batch()
+        for path, data in items[start:start + 500]:
+            batch.set(db.document(path), data)
+        batch.commit()
+
+
+def device_token(rng, dead_ratio=0.0):
+    token = '%064x' % rng.getrandbits(256)
+    # dead で始まるトークンは APNs スタブが 410 Unregistered を返す
+    return 'dead' + token[4:] if rng.random() < dead_ratio else token
+
+
+def run_id(args):
+    """エミュレーターで前回の実行とパスが重ならないようにする接頭辞"""
+    return '' if args.backend == 'memory' else f'lt{int(time.time())}-'
+
+
+# ---- シナリオ ----
+# setup(module, db, args, rng) で初期データを作り、リクエストを返す関数 make(i) を返す
+# make(i) は call_handler に渡す (method, query, body, headers)
+
+def setup_members_large_family(module, db, args, rng):
+    family_id = f'{run_id(args)}family-large'
+    members = args.family_size
+    seed_documents(db, {
+        f'family-management/{family_id}/members/member{i:04d}': {
+            'name': f'メンバー{i}', 'deviceToken': device_token(rng)
+        } for i in range(members)
+    })
+
+    def make(i):
+        if i % 10 == 9:
+            member_id = f'member{i % members:04d}'
+            return ('PUT', {'familyId': family_id, 'memberId': member_id}, {'name': f'メンバー{i}（更新）'}, {})
+        return ('GET', {'familyId': family_id}, None, {})
+    return make
+
+
+def setup_goals_long_history(module, db, args, rng):
+    user_id = f'{run_id(args)}user-history'
+    goals = args.history
+    started = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    documents = {}
+    for i in range(goals):
+        created = started + timedelta(hours=i)
+        documents[f'user-goals/{user_id}/goals/goal{i:06d}'] = {
+            'title': f'毎日{i % 60}分ストレッチする',
+            'detail': '朝起きたらすぐに行う。できなかった日は夜に行う。',
+            'isCompleted': rng.random() < 0.7,
+            'createdAt': created.isoformat(),
+            'updatedAt': created,
+        }
+    seed_documents(db, documents)
+
+    def make(i):
+        kind = i % 10
+        if kind < 4:
+            return ('GET', {'userId': user_id, 'limit': '50', 'fields': 'title,isCompleted'}, None, {})
+        if kind < 6:
+            # 履歴の途中のページ（カーソルは 1ページ目の nextCursor と同じ形式）
+            n = rng.randrange(goals)
+            cursor = module.encode_cursor(documents[f'user-goals/{user_id}/goals/goal{n:06d}'], f'goal{n:06d}')
+            return ('GET', {'userId': user_id, 'limit': '50', 'startAfter': cursor}, None, {})
+        if kind < 8:
+            return ('GET', {'userId': user_id, 'since': '', 'fields': 'title,isCompleted'}, None, {})
+        if kind == 8:
+            return ('POST', {}, {'userId': user_id, 'title': f'新しい目標{i}',
+                                 'createdAt': datetime.now(timezone.utc).isoformat()}, {})
+        goal_id = f'goal{rng.randrange(goals):06d}'
+        return ('PUT', {}, {'userId': user_id, 'goalId': goal_id, 'title': f'更新{i}', 'isCompleted': True}, {})
+    return make
+
+
+def setup_missions_family(module, db, args, rng):
+    family_id = f'{run_id(args)}family-missions'
+    missions = args.missions
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    seed_documents(db, {
+        f'family-management/{family_id}/missions/mission{i:05d}': {
+            'mission': f'お皿を洗う（{i}回目）',
+            'isCleared': False,
+            'createdAt': (started + timedelta(minutes=i)).isoformat(),
+            'updatedAt': started + timedelta(minutes=i),
+            'clearedOn': None,
+        } for i in range(missions)
+    })
+    # 集計ドキュメントを作っておく（通常運用時の状態）
+    module.rebuild_mission_summary(db, f'family-management/{family_id}/missions')
+
+    def make(i):
+        kind = i % 10
+        if kind < 4:
+            return ('GET', {'familyId': family_id, 'summary': '1'}, None, {})
+        if kind < 6:
+            return ('GET', {'familyId': family_id, 'since': '', 'fields': 'mission,isCleared'}, None, {})
+        if kind < 9:
+            doc_id = f'mission{rng.randrange(missions):05d}'
+            return ('PUT', {}, {'familyId': family_id, 'doc_id': doc_id, 'mission': 'お皿を洗う',
+                                'isCleared': kind != 8}, {})
+        return ('POST', {}, {'familyId': family_id, 'mission': f'洗濯物をたたむ{i}', 'isCleared': False,
+                             'createdAt': datetime.now(timezone.utc).isoformat()}, {})
+    return make
+
+
+def setup_push_broadcast_burst(module, db, args, rng):
+    prefix = run_id(args)
+    families = args.families
+    size = args.broadcast_family_size
+    documents = {}
+    for f in range(families):
+        for m in range(size):
+            documents[f'family-management/{prefix}family{f:04d}/members/member{m:03d}'] = {
+                'name': f'メンバー{m}', 'deviceToken': device_token(rng, args.dead_token_ratio)
+            }
+    seed_documents(db, documents)
+
+    def make(i):
+        # 同じ家族に通知が集中するよう、家族の選び方を偏らせる
+        family = min(int(rng.expovariate(1 / max(families / 4, 1))), families - 1)
+        return ('POST', {}, {
+            'familyId': f'{prefix}family{family:04d}',
+            'memberId': f'member{rng.randrange(size):03d}',
+            'memberName': 'たろう',
+            'goalTitle': f'目標{i}'
+        }, {})
+    return make
+
+
+def setup_family_dashboard(module, db, args, rng):
+    family_id = f'{run_id(args)}family-dashboard'
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    documents = {
+        f'family-management/{family_id}/members/member{i:03d}': {
+            'name': f'メンバー{i}', 'deviceToken': device_token(rng)
+        } for i in range(args.broadcast_family_size)
+    }
+    documents.update({
+        f'family-management/{family_id}/missions/mission{i:05d}': {
+            'mission': f'お皿を洗う（{i}回目）',
+            'isCleared': i % 3 == 0,
+            'createdAt': (started + timedelta(minutes=i)).isoformat(),
+            'updatedAt': started + timedelta(minutes=i),
+            'clearedOn': None,
+        } for i in range(args.dashboard_missions)
+    })
+    seed_documents(db, documents)
+
+    def make(i):
+        return ('GET', {'familyId': family_id}, None, {})
+    return make
+
+
+SCENARIOS = {
+    'members_large_family': ('management-family', 'family_members_handler', setup_members_large_family),
+    'goals_long_history': ('update-user-mission', 'user_goals_handler', setup_goals_long_history),
+    'missions_family': ('update-family-mission', 'family_missions_handler', setup_missions_family),
+    'push_broadcast_burst': ('push-notification', 'send_family_goal_notification', setup_push_broadcast_burst),
+    'family_dashboard': ('management-family', 'family_dashboard_handler', setup_family_dashboard),
+}
+
+
+# ---- 実行 ----
+
+def create_db(args):
+    if args.backend == 'memory':
+        return MemoryFirestore(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, seed=args.seed)
+    if not os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        raise SystemExit('--backend emulator には FIRESTORE_EMULATOR_HOST の指定が必要です')
+    from google.cloud import firestore
+    return firestore.Client(project=os.environ.get('GOOGLE_CLOUD_PROJECT', 'loadtest'))
+
+
+def configure_push(module, apns, key_path):
+    """プッシュ通知サービスを APNs スタブに向ける"""
+    module.BUNDLE_ID = 'com.example.loadtest'
+    module.PRIVATE_KEY_PATH, module.TEAM_ID, module.KEY_ID = key_path, 'LOADTEST00', 'LOADTEST00'
+    module.token_provider = module.APNsTokenProvider(key_path, module.TEAM_ID, module.KEY_ID, metrics=module.metrics)
+    module.apns_client = module.APNsClient(base_url=apns.base_url, http1=False, http2=True)
+    module.member_token_cache.invalidate()
+
+
+def write_test_key():
+    """JWT 署名用の EC P-256 鍵を一時ファイルに作る（スタブは署名を検証しない）"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    key = ec.generate_private_key(ec.SECP256R1())
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption())
+    handle, path = tempfile.mkstemp(suffix='.p8')
+    with os.fdopen(handle, 'wb') as f:
+        f.write(pem)
+    return path
+
+
+def drive(handler, make, requests, concurrency, on_response=None):
+    """
+    make(i) のリクエストを concurrency 並列で requests 件実行し、(レイテンシ, ステータス, 経過秒) を返す
+    on_response を指定すると各レスポンスの本体を渡す
+    """
+    latencies = [0.0] * requests
+    statuses = [None] * requests
+
+    def one(i):
+        method, query, body, headers = make(i)
+        started = time.perf_counter()
+        try:
+            status, _, payload = call_handler(handler, method, query, body, headers)
+            if on_response:
+                on_response(payload)
+        except Exception as e:
+            status = type(e).__name__
+        latencies[i] = (time.perf_counter() - started) * 1000
+        statuses[i] = status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    return latencies, statuses, time.perf_counter() - started
+
+
+def run_scenario(name, args, apns, key_path):
+    service, handler_name, setup = SCENARIOS[name]
+    module = load_service(service)
+    handler = getattr(module, handler_name)
+
+    def prepare():
+        db = create_db(args)
+        module._db = db
+        if hasattr(module, '_async_db'):
+            module._async_db = create_async_client(db)
+        if service == 'push-notification':
+            configure_push(module, apns, key_path)
+        make = setup(module, db, args, random.Random(args.seed))
+        if hasattr(db, 'reset_stats'):
+            db.reset_stats()
+        apns.reset_stats()
+        return db, make
+
+    # ウォームアップ（接続の確立やキャッシュの読み込みを計測から外す）
+    db, make = prepare()
+    drive(handler, make, min(args.warmup, args.requests), args.concurrency)
+    if hasattr(db, 'reset_stats'):
+        db.reset_stats()
+    apns.reset_stats()
+
+    # プッシュ通知はレスポンスの送信結果（成功・失敗件数）も集計する
+    sends = Counter()
+    sends_lock = threading.Lock()
+
+    def count_sends(payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        with sends_lock:
+            sends['sent'] += data.get('sent_count', 0)
+            sends['failed'] += data.get('failed_count', 0)
+            sends['pruned'] += data.get('pruned_count', 0)
+
+    on_response = count_sends if service == 'push-notification' else None
+    latencies, statuses, elapsed = drive(handler, make, args.requests, args.concurrency, on_response)
+    rpcs = dict(db.rpcs) if hasattr(db, 'rpcs') else None
+    apns_stats = apns.stats()
+
+    # ピークメモリは tracemalloc の負荷がレイテンシに影響しないよう別に計測する
+    _, make = prepare()
+    tracemalloc.start()
+    drive(handler, make, min(args.requests, args.memory_requests), args.concurrency)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    status_counts = Counter(str(s) for s in statuses)
+    errors = sum(count for status, count in status_counts.items() if not status.startswith(('2', '3')))
+    result = {
+        'scenario': name,
+        'service': service,
+        'handler': handler_name,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(args.requests / elapsed, 1) if elapsed else None,
+        'latency': latency_summary(latencies),
+        'status': dict(status_counts),
+        'errors': errors,
+        'firestore_rpcs_per_request': (
+            {kind: round(count / args.requests, 2) for kind, count in sorted(rpcs.items())} if rpcs is not None else None
+        ),
+        'firestore_rpcs_total': sum(rpcs.values()) if rpcs is not None else None,
+        'peak_traced_memory_mb': round(peak / 1024 / 1024, 2),
+    }
+    if service == 'push-notification':
+        result['apns'] = dict(apns_stats, streams_per_request=round(apns_stats['streams'] / args.requests, 2))
+        result['notifications'] = dict(sends)
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR,
+                              check=True, capture_output=True, text=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='実行するシナリオ（複数指定可、既定はすべて）')
+    parser.add_argument('--backend', choices=('memory', 'emulator'), default='memory')
+    parser.add_argument('--requests', type=int, default=1000, help='シナリオごとのリクエスト数')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--memory-requests', type=int, default=200, help='ピークメモリの計測に使うリクエスト数')
+    parser.add_argument('--latency-ms', type=float, default=0, help='インメモリの Firestore の 1 RPC あたりの遅延')
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--apns-latency-ms', type=float, default=0, help='APNs スタブの応答の遅延')
+    parser.add_argument('--family-size', type=int, default=200, help='members_large_family のメンバー数')
+    parser.add_argument('--history', type=int, default=5000, help='goals_long_history の目標数')
+    parser.add_argument('--missions', type=int, default=1000, help='missions_family のミッション数')
+    parser.add_argument('--families', type=int, default=100, help='push_broadcast_burst の家族数')
+    parser.add_argument('--broadcast-family-size', type=int, default=8, help='push_broadcast_burst・family_dashboard の家族の人数')
+    parser.add_argument('--dashboard-missions', type=int, default=50, help='family_dashboard のミッション数')
+    parser.add_argument('--dead-token-ratio', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='結果の JSON の出力先（既定は標準出力）')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    apns = FakeAPNsServer(latency_ms=args.apns_latency_ms)
+    key_path = write_test_key()
+    results = []
+    try:
+        for name in args.scenario or SCENARIOS:
+            result = run_scenario(name, args, apns, key_path)
+            results.append(result)
+            latency = result['latency']
+            rpcs = result['firestore_rpcs_total']
+            print(f'{name:<24} p50 {latency["p50_ms"]:>8.2f}ms  p95 {latency["p95_ms"]:>8.2f}ms  '
+                  f'p99 {latency["p99_ms"]:>8.2f}ms  {result["throughput_rps"]:>8.1f} req/s  '
+                  f'{"-" if rpcs is None else round(rpcs / args.requests, 2)} RPC/req  errors {result["errors"]}',
+                  file=sys.stderr)
+    finally:
+        apns.close()
+        os.remove(key_path)
+
+    report = {
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {k: v for k, v in vars(args).items() if k not in ('output', 'scenario')},
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'threads': threading.active_count(),
+        'scenarios': results,
+    }
+    body = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(body + '\n')
+    else:
+        print(body)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
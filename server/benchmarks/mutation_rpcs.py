@@ -0,0 +1,89 @@
+"""
+PUT / DELETE 1回あたりの Firestore RPC 数を計測するベンチマーク
+
+各サービスの main.py を読み込み、RPC を数えるインメモリの Firestore（storage.MemoryFirestore）を差し込んで
+既存ドキュメント・存在しないドキュメントに対する更新と削除を実行する。
+
+使い方（server/ から実行）:
+    python benchmarks/mutation_rpcs.py                    # 現在のコード
+    python benchmarks/mutation_rpcs.py --baseline <rev>   # git のリビジョンと比較
+    python benchmarks/mutation_rpcs.py --rtt-ms 25        # 1 RPC あたりの往復時間から待ち時間を見積もる
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sys
+
+import flask
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from harness import load_service, use_store  # noqa: E402
+from storage import MemoryFirestore  # noqa: E402
+
+
+# (サービス, ハンドラー名, コレクション, ID のクエリパラメータ, 親のクエリパラメータ, PUT のボディ)
+SERVICES = [
+    ('management-family', 'family_members_handler', 'family-management/fam1/members',
+     'memberId', {'familyId': 'fam1'}, {'name': 'たろう'}),
+    ('update-user-mission', 'user_goals_handler', 'user-goals/user1/goals',
+     'goalId', {'userId': 'user1'}, {'title': '早起き'}),
+    ('update-family-mission', 'family_missions_handler', 'family-management/fam1/missions',
+     'doc_id', {'familyId': 'fam1'}, {'mission': '皿洗い', 'isCleared': True}),
+]
+
+
+def run_service(module, handler_name, collection_path, id_key, parent, put_body):
+    """既存／存在しないドキュメントへの PUT・DELETE を実行し、(シナリオ, ステータス, RPC数) を返す"""
+    app = flask.Flask(__name__)
+    handler = getattr(module, handler_name)
+    rows = []
+    for method, target in (('PUT', 'existing'), ('PUT', 'missing'), ('DELETE', 'existing'), ('DELETE', 'missing')):
+        store = MemoryFirestore()
+        store.seed(f'{collection_path}/doc1', {'createdAt': '2024-01-01T00:00:00Z'})
+        if hasattr(module, 'mission_summary_ref'):
+            # 集計ドキュメントがある状態（通常運用時）で計測する
+            store.seed(module.mission_summary_ref(store, collection_path).path, {'total': 1, 'cleared': 0})
+        use_store(module, store)
+        doc_id = 'doc1' if target == 'existing' else 'missing'
+        # family-mission の PUT は doc_id をボディから読む
+        body = {**parent, id_key: doc_id, **put_body} if method == 'PUT' else None
+        # 古いリビジョンは print でデバッグ出力するため、表を読みやすくするよう捨てる
+        with app.test_request_context('/', method=method, query_string={**parent, id_key: doc_id}, json=body), \
+                contextlib.redirect_stdout(io.StringIO()):
+            response = handler(flask.request)
+        rows.append((f'{method} {target}', response[1], sum(store.rpcs.values()), dict(store.rpcs)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--baseline', help='比較する git リビジョン（例: HEAD~1）')
+    parser.add_argument('--rtt-ms', type=float, default=0, help='1 RPC あたりの往復時間（見積もり用）')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    variants = [('current', None)]
+    if args.baseline:
+        variants.insert(0, (args.baseline, args.baseline))
+
+    header = f'{"service":<24}{"scenario":<18}' + ''.join(f'{label:>22}' for label, _ in variants)
+    print(header)
+    print('-' * len(header))
+    for service, handler_name, collection_path, id_key, parent, put_body in SERVICES:
+        results = [run_service(load_service(service, revision), handler_name, collection_path, id_key, parent, put_body)
+                   for _, revision in variants]
+        for i, (scenario, *_rest) in enumerate(results[0]):
+            cells = []
+            for rows in results:
+                _, status, rpcs, _ = rows[i]
+                cell = f'{rpcs} RPC ({status})'
+                if args.rtt_ms:
+                    cell += f' ~{rpcs * args.rtt_ms:.0f}ms'
+                cells.append(f'{cell:>22}')
+            print(f'{service:<24}{scenario:<18}' + ''.join(cells))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+PROFILE_DIR に保存されたプロファイルをまとめる
+
+- .prof（PROFILE_MODE=cprofile）: pstats で合算し、累積時間の上位を表示する
+- .folded（PROFILE_MODE=sample）: 同じスタックの回数を合算した collapsed 形式を出力する
+  （flamegraph.pl や speedscope にそのまま渡せる）
+
+使い方（server/ から実行）:
+    python benchmarks/profile_report.py /tmp/profiles
+    python benchmarks/profile_report.py /tmp/profiles --function user_goals_handler --top 40
+    python benchmarks/profile_report.py /tmp/profiles --folded-output merged.folded
+    PROFILE_SAMPLE_RATE=20 PROFILE_MODE=sample python benchmarks/loadtest.py --scenario push_broadcast_burst
+"""
+import argparse
+import glob
+import os
+import pstats
+import sys
+
+
+def profile_files(directory, suffix, function=None):
+    pattern = f'*-{function}-*.{suffix}' if function else f'*.{suffix}'
+    return sorted(glob.glob(os.path.join(directory, pattern)))
+
+
+def merge_folded(paths):
+    """collapsed 形式のファイルを読み、スタックごとの回数を合算する"""
+    stacks = {}
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    stacks[stack] = stacks.get(stack, 0) + int(count)
+    return stacks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', nargs='?', default=os.environ.get('PROFILE_DIR', '/tmp/profiles'))
+    parser.add_argument('--function', help='エントリーポイント名で絞り込む（例: send_family_goal_notification）')
+    parser.add_argument('--top', type=int, default=25, help='表示する関数の数')
+    parser.add_argument('--sort', default='cumulative', help='pstats の並び順（cumulative / tottime など）')
+    parser.add_argument('--folded-output', help='合算した collapsed 形式の出力先（既定は標準出力）')
+    args = parser.parse_args()
+
+    prof_paths = profile_files(args.directory, 'prof', args.function)
+    folded_paths = profile_files(args.directory, 'folded', args.function)
+    if not prof_paths and not folded_paths:
+        print(f'{args.directory} にプロファイルがありません', file=sys.stderr)
+        return 1
+
+    if prof_paths:
+        print(f'# {len(prof_paths)} 件の cProfile を合算', file=sys.stderr)
+        stats = pstats.Stats(*prof_paths, stream=sys.stderr)
+        stats.strip_dirs().sort_stats(args.sort).print_stats(args.top)
+
+    if folded_paths:
+        stacks = merge_folded(folded_paths)
+        samples = sum(stacks.values())
+        print(f'# {len(folded_paths)} 件のサンプル（{samples} スタック）を合算', file=sys.stderr)
+        body = ''.join(f'{stack} {count}\n' for stack, count in sorted(stacks.items()))
+        if args.folded_output:
+            with open(args.folded_output, 'w', encoding='utf-8') as f:
+                f.write(body)
+        else:
+            sys.stdout.write(body)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,16 @@
+# common
+#
+# 4つのサービスで共通の処理（各サービスの main.py から import する）
+#   observability: JSON のリクエストログ、メトリクス、Firestore の呼び出し回数の記録
+#   profiling: リクエストのプロファイリング（PROFILE_SAMPLE_RATE / PROFILE_TOKEN で有効にする）
+#   responses: 一覧のJSON / NDJSON レスポンス、fields= の絞り込み、ETag、Firestore の書き込みエラーの変換
+#   idempotency: POST の Idempotency-Key（キーのドキュメントが正、インスタンス内のキャッシュは読み取りの省略用）
+#   sync: 差分同期（GET ?since=）の同期トークンと墓標（tombstone）
+#   event_loop: 同期のハンドラーから非同期クライアントを使うための、インスタンス共通のイベントループ
+#
+# server/ から動かす場合（server/main.py、benchmarks/、tests/）はそのまま import できる。
+# サービスを単独でデプロイする場合は、デプロイの前にこのディレクトリをサービスのディレクトリにコピーする:
+#     python -m common.vendor                      # 全サービス（server/ から実行）
+#     python -m common.vendor push-notification    # 指定したサービスのみ
+# コピーは .gitignore で除外している（元は常に server/common）。
+# コピーせずにデプロイした場合は、各サービスの main.py が import 時にこの手順を示す ImportError で止まる。
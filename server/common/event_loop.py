@@ -0,0 +1,41 @@
+# event_loop.py
+#
+# リクエストのスレッド（同期のハンドラー）からコルーチンを実行するための、インスタンスで1つのイベントループ
+# 非同期クライアント（Firestore の AsyncClient、APNs の httpx.AsyncClient）の接続は作成したイベントループに
+# 結び付くため、ループを専用スレッドで動かし続けて使い回す。server/main.py でまとめて動かす場合も全サービスで1つ。
+# 注意: asyncio の import はコールドスタートを短縮するため、最初に使うときまで遅らせる
+
+import threading
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    """
+    インスタンス共通のイベントループ（最初に使うときに専用スレッドで動かし始める）
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                import asyncio
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='common-async', daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run_async(coro, timeout=None):
+    """
+    コルーチンをインスタンス共通のイベントループで実行し、結果を待つ（timeout 秒を超えたら TimeoutError）
+    """
+    import asyncio
+    from concurrent import futures
+
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return future.result(timeout)
+    except futures.TimeoutError:
+        future.cancel()
+        raise TimeoutError(f'timed out after {timeout}s')
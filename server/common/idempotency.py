@@ -0,0 +1,147 @@
+# idempotency.py
+#
+# POST の Idempotency-Key（3つのCRUDサービスで共通）
+# Idempotency-Key ヘッダーがあれば、作成と同じコミットでキーのドキュメント（最初のレスポンスを保存）も create する。
+# 通信が不安定なときのクライアントの再送には保存したレスポンスを返し、2回目の書き込みはしない。
+# - キーのドキュメント（{親}/idempotency-keys/{ハッシュ}）が正。再送が別のインスタンスに届いても、
+#   キーの create が AlreadyExists になってコミット全体が失敗するため、二重に作成されることはない
+# - インスタンス内のキャッシュは、同じインスタンスへの再送で Firestore を読まないための最適化にすぎない
+# - キーは IDEMPOTENCY_KEY_TTL_SECONDS（既定 24 時間）保持する。それより後の再送は新しい作成として扱う
+# 注意: expiresAt を対象に Firestore の TTL ポリシー（コレクショングループ idempotency-keys）を設定して削除する
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from .observability import add_log_fields
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_SECONDS', 24 * 60 * 60))
+
+# 同じインスタンスへの再送は Firestore を読まずに返す
+IDEMPOTENCY_CACHE_SECONDS = float(os.environ.get('IDEMPOTENCY_CACHE_SECONDS', 600))
+IDEMPOTENCY_CACHE_MAX_KEYS = int(os.environ.get('IDEMPOTENCY_CACHE_MAX_KEYS', 10000))
+
+
+class IdempotencyCache:
+    """
+    最近の冪等キーと保存したレスポンス（期限付き、上限を超えたら古いものから捨てる）
+    インスタンスごとの読み取りの省略用で、重複作成の防止はキーのドキュメントの create に任せる
+    """
+    def __init__(self, ttl_seconds, max_keys, clock=time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (コレクション, キー) -> (期限, 保存したレスポンス)
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] <= self._clock():
+                del self._entries[key]
+                return None
+            return item[1]
+
+    def put(self, key, entry):
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl_seconds, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+
+idempotency_cache = IdempotencyCache(IDEMPOTENCY_CACHE_SECONDS, IDEMPOTENCY_CACHE_MAX_KEYS)
+
+
+def idempotency_key(request):
+    """
+    Idempotency-Key ヘッダーの値（ない場合は None、不正な場合は ValueError）
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key is None:
+        return None
+    if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise ValueError(f'{IDEMPOTENCY_HEADER} must be 1-{MAX_IDEMPOTENCY_KEY_LENGTH} characters')
+    return key
+
+
+def idempotency_ref(db, collection_path, key):
+    """
+    キーのドキュメント（同じ親の別のコレクションと区別するため、コレクション名も含めてハッシュする）
+    例: family-management/{familyId}/members -> family-management/{familyId}/idempotency-keys/{ハッシュ}
+    """
+    parent_path, name = collection_path.rsplit('/', 1)
+    digest = hashlib.sha256(f'{name}\n{key}'.encode('utf-8')).hexdigest()
+    return db.document(f'{parent_path}/idempotency-keys/{digest}')
+
+
+def request_fingerprint(data):
+    """
+    同じキーで別の内容が送られていないかを確かめるための、リクエストボディのハッシュ
+    """
+    canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def replay_response(entry, fingerprint):
+    """
+    保存したレスポンスを返す（同じキーで内容が違うリクエストは 422）
+    """
+    if entry.get('fingerprint') != fingerprint:
+        return (f'{IDEMPOTENCY_HEADER} was already used for a different request', 422)
+    add_log_fields(idempotent_replay=True)
+    return (json.dumps(entry['response']), 200, {'Content-Type': 'application/json', 'Idempotent-Replayed': 'true'})
+
+
+def cached_replay(collection_path, key, fingerprint):
+    """
+    インスタンス内に同じキーのレスポンスがあれば返す（なければ None）
+    """
+    entry = idempotency_cache.get((collection_path, key)) if key else None
+    return replay_response(entry, fingerprint) if entry is not None else None
+
+
+def write_idempotent(db, collection_path, key, fingerprint, response, write):
+    """
+    Idempotency-Key 付きの作成を書き込む（戻り値は再送へのレスポンス、新しく作成した場合は None）
+    write(record) は作成と同じ書き込みで record（キーのドキュメントの (参照, データ)、キーがなければ None）を
+    create する。同じキーが既にある場合は、コミット全体を AlreadyExists で失敗させる（何も書き込まれない）か、
+    保存済みの内容を返す。
+    """
+    from google.api_core import exceptions
+    from google.cloud import firestore
+
+    if key is None:
+        write(None)
+        return None
+
+    key_ref = idempotency_ref(db, collection_path, key)
+    record = {
+        'fingerprint': fingerprint,
+        'response': response,
+        'createdAt': firestore.SERVER_TIMESTAMP,
+        'expiresAt': datetime.now(timezone.utc) + timedelta(seconds=IDEMPOTENCY_KEY_TTL_SECONDS)
+    }
+    try:
+        existing = write((key_ref, record))
+    except exceptions.AlreadyExists:
+        snapshot = key_ref.get()
+        if not snapshot.exists:
+            raise
+        existing = snapshot.to_dict()
+
+    if existing is not None:
+        idempotency_cache.put((collection_path, key), existing)
+        return replay_response(existing, fingerprint)
+    idempotency_cache.put((collection_path, key), {'fingerprint': fingerprint, 'response': response})
+    return None
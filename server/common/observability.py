@@ -0,0 +1,341 @@
+# observability.py
+#
+# 4つのサービスで共通のログ・メトリクス・Firestore の呼び出し回数の記録
+# - サービスごとに Telemetry を1つ作り、logger / metrics / log_request などを main.py のモジュール変数に置く
+# - 処理中のリクエストの情報（サマリーログの項目、Firestore の呼び出し回数）はスレッドごとに1つ持ち、
+#   どのサービスのリクエストかは Telemetry で区別する（server/main.py で1つのプロセスにまとめた場合も同じ）
+
+import bisect
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# ログ設定（LOG_LEVEL で出力レベルを指定、既定は INFO。DEBUG で詳細ログを出力）
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+# ---- メトリクス ----
+# リクエストのレイテンシと Firestore の呼び出し回数などをインスタンス内で集計する（値はインスタンスの起動からの累積）
+# METRICS_DUMP_SECONDS 秒ごとに 'metrics' ログとして1行のJSONで出力する（0で無効）
+# server/main.py でまとめて動かす場合は /metrics で Prometheus のテキスト形式でも読める
+METRICS_DUMP_SECONDS = float(os.environ.get('METRICS_DUMP_SECONDS', 60))
+
+# ヒストグラムのバケットの上限（ミリ秒 / 件数）
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+# 数える Firestore の RPC（GAPIC クライアントのメソッド名）
+FIRESTORE_RPCS = ('batch_get_documents', 'run_query', 'run_aggregation_query', 'list_documents',
+                  'commit', 'batch_write', 'begin_transaction', 'rollback')
+
+
+class JsonLogFormatter(logging.Formatter):
+    """
+    Cloud Loggingが構造化ログとして読み取れる1行のJSONで出力する
+    """
+    def format(self, record):
+        entry = {'severity': record.levelname, 'message': record.getMessage()}
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def get_logger(name):
+    """
+    標準出力に1行のJSONで出力するロガー
+    """
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonLogFormatter())
+        logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    return logger
+
+
+def bucket_quantile(buckets, counts, q):
+    """
+    ヒストグラムの q 分位点をバケットの上限で返す（最後のバケットを超える場合は None）
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    cumulative = 0
+    for upper, count in zip(buckets, counts):
+        cumulative += count
+        if cumulative >= q * total:
+            return upper
+    return None
+
+
+class Metrics:
+    """
+    カウンターとヒストグラム（ラベルはキーワード引数で指定する）
+    """
+    def __init__(self, service, logger=None):
+        self.service = service
+        self.started_at = time.time()
+        self._logger = logger or get_logger(service)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._last_dump = time.monotonic()
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS_MS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # 最後の要素は最大のバケットを超えた件数
+                histogram = self._histograms[key] = {'buckets': buckets, 'counts': [0] * (len(buckets) + 1), 'sum': 0}
+            histogram['counts'][bisect.bisect_left(buckets, value)] += 1
+            histogram['sum'] += value
+
+    def snapshot(self):
+        """
+        JSONで出力できる形の現在値（ヒストグラムにはバケットから推定した p50/p95/p99 も付ける）
+        """
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = []
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                buckets, counts = histogram['buckets'], list(histogram['counts'])
+                histograms.append({
+                    'name': name,
+                    'labels': dict(labels),
+                    'buckets': list(buckets),
+                    'counts': counts,
+                    'count': sum(counts),
+                    'sum': round(histogram['sum'], 3),
+                    'p50': bucket_quantile(buckets, counts, 0.50),
+                    'p95': bucket_quantile(buckets, counts, 0.95),
+                    'p99': bucket_quantile(buckets, counts, 0.99)
+                })
+        return {
+            'service': self.service,
+            'uptime_s': round(time.time() - self.started_at, 1),
+            'counters': counters,
+            'histograms': histograms
+        }
+
+    def maybe_dump(self):
+        """
+        前回の出力から METRICS_DUMP_SECONDS 秒以上経っていれば 'metrics' ログを出力する
+        （Cloud Functions はリクエストの外では CPU が割り当てられないため、スレッドではなくリクエストの終わりに出す）
+        """
+        if METRICS_DUMP_SECONDS <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_dump < METRICS_DUMP_SECONDS:
+                return
+            self._last_dump = now
+        self._logger.info('metrics', extra={'fields': self.snapshot()})
+
+
+# 処理中のリクエスト（telemetry / function / fields / firestore）
+_request_log = threading.local()
+
+
+def add_log_fields(**fields):
+    """
+    処理中のリクエストのサマリーログに項目を追加する
+    """
+    current = getattr(_request_log, 'fields', None)
+    if current is not None:
+        current.update(fields)
+
+
+def capture_request():
+    """
+    処理中のリクエストのサービスと関数名（ハンドラーが返った後の処理を同じリクエストとして記録するため）
+    """
+    return (getattr(_request_log, 'telemetry', None), getattr(_request_log, 'function', None))
+
+
+def resume_request(state):
+    """
+    capture_request() の状態を別のタイミング（ストリーミングの送信中など）で再開する
+    Firestore の呼び出し回数は新しく数え直す（サマリーログは出力済みのため）
+    """
+    _request_log.telemetry, _request_log.function = state
+    _request_log.firestore = {'firestore_rpcs': 0, 'firestore_reads': 0, 'firestore_writes': 0}
+
+
+def end_request():
+    _request_log.telemetry = _request_log.function = _request_log.fields = _request_log.firestore = None
+
+
+def current_logger():
+    """
+    処理中のリクエストのサービスのロガー（リクエストの外では 'common' のロガー）
+    """
+    telemetry = getattr(_request_log, 'telemetry', None)
+    return telemetry.logger if telemetry is not None else get_logger('common')
+
+
+def record_firestore(rpc=None, reads=0, writes=0, background=False):
+    """
+    Firestore の呼び出しを処理中のリクエストに記録する（リクエストの処理中でなければ False）
+    background=True の場合はリクエストの外（ワーカースレッドなど）の呼び出しとして記録する
+    """
+    counts = getattr(_request_log, 'firestore', None)
+    telemetry = getattr(_request_log, 'telemetry', None)
+    if counts is None or telemetry is None:
+        if not background:
+            return False
+        telemetry = _background_telemetry
+        if telemetry is None:
+            return False
+        counts = None
+    function = 'background'
+    if counts is not None:
+        function = _request_log.function
+        counts['firestore_rpcs'] += 1 if rpc else 0
+        counts['firestore_reads'] += reads
+        counts['firestore_writes'] += writes
+    metrics = telemetry.metrics
+    if rpc:
+        metrics.inc('firestore_rpcs_total', function=function, rpc=rpc)
+    if reads:
+        metrics.inc('firestore_documents_read_total', reads, function=function)
+    if writes:
+        metrics.inc('firestore_documents_written_total', writes, function=function)
+    return True
+
+
+# リクエストの外の呼び出しを記録するサービス（最初に instrument_firestore を呼んだサービス）
+_background_telemetry = None
+
+
+def instrument_firestore(db, telemetry=None):
+    """
+    Firestore クライアントの RPC を数えるよう、GAPIC クライアントのメソッドを包む
+    - 読み取りは受け取ったドキュメント数、書き込みはコミットされた書き込み数で数える
+    - 1つのクライアントを複数のサービスで共有する場合（server/main.py）は、リクエストを処理中のサービスに記録する
+    - GAPIC を持たないクライアント（インメモリのストレージなど）や、包み済みのクライアントでは何もしない
+    """
+    global _background_telemetry
+    if _background_telemetry is None:
+        _background_telemetry = telemetry
+    api = getattr(db, '_firestore_api', None)
+    if api is None or getattr(api, '_metrics_instrumented', False):
+        return
+    api._metrics_instrumented = True
+
+    def record(rpc=None, reads=0, writes=0):
+        if not record_firestore(rpc, reads, writes):
+            record_firestore(rpc, reads, writes, background=True)
+
+    def count_documents(responses, field):
+        for response in responses:
+            if response._pb.HasField(field):
+                record(reads=1)
+            yield response
+
+    def wrap(name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if name in ('commit', 'batch_write'):
+                response = method(*args, **kwargs)
+                record(name, writes=len(response.write_results))
+                return response
+            record(name)
+            response = method(*args, **kwargs)
+            if name == 'run_query':
+                return count_documents(response, 'document')
+            if name == 'batch_get_documents':
+                return count_documents(response, 'found')
+            return response
+        return wrapper
+
+    for name in FIRESTORE_RPCS:
+        method = getattr(api, name, None)
+        if method is not None:
+            setattr(api, name, wrap(name, method))
+
+
+class Telemetry:
+    """
+    サービスごとのロガー・メトリクス・起動時間の記録と、エントリーポイントのリクエストログ
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.logger = get_logger(service)
+        self.metrics = Metrics(service, self.logger)
+        # 起動時間の計測（import にかかった時間と、初回利用時に作成したクライアントの初期化時間）
+        self.startup_report = {'service': service}
+        self._cold_start = True
+        # エントリーポイントを呼び出す関数（既定は profiling.py の設定に従って計測する）
+        from . import profiling
+        self.runner = lambda func, request: profiling.run_profiled(func, request, self)
+
+    def record_init_timing(self, name, started):
+        self.startup_report[name] = round((time.perf_counter() - started) * 1000, 1)
+        self.logger.debug("⏱️ 初期化: %s=%sms", name, self.startup_report[name])
+
+    def instrument_firestore(self, db):
+        instrument_firestore(db, self)
+
+    def log_request(self, func):
+        """
+        エントリーポイントをラップし、リクエストごとに1行のJSONサマリーを INFO で出力する
+        """
+        @functools.wraps(func)
+        def wrapper(request):
+            started = time.perf_counter()
+            _request_log.telemetry = self
+            _request_log.fields = fields = {}
+            _request_log.function = func.__name__
+            _request_log.firestore = firestore_counts = {'firestore_rpcs': 0, 'firestore_reads': 0, 'firestore_writes': 0}
+            status = 500
+            try:
+                response = self.runner(func, request)
+                if isinstance(response, tuple):
+                    status = response[1] if len(response) > 1 else 200
+                else:
+                    status = getattr(response, 'status_code', 200)
+                return response
+            finally:
+                end_request()
+                duration_ms = (time.perf_counter() - started) * 1000
+                summary = {
+                    'function': func.__name__,
+                    'method': request.method,
+                    'status': status,
+                    'duration_ms': round(duration_ms, 1),
+                    **firestore_counts
+                }
+                if self._cold_start:
+                    # インスタンスの最初のリクエストには起動時間を添える
+                    self._cold_start = False
+                    summary['cold_start'] = True
+                    summary['startup'] = dict(self.startup_report)
+                summary.update(fields)
+                self.logger.info('request', extra={'fields': summary})
+
+                labels = {'function': func.__name__, 'method': request.method}
+                self.metrics.inc('requests_total', status=status, **labels)
+                self.metrics.observe('request_duration_ms', duration_ms, **labels)
+                self.metrics.observe('firestore_reads_per_request', firestore_counts['firestore_reads'],
+                                     COUNT_BUCKETS, **labels)
+                self.metrics.observe('firestore_writes_per_request', firestore_counts['firestore_writes'],
+                                     COUNT_BUCKETS, **labels)
+                self.metrics.maybe_dump()
+        return wrapper
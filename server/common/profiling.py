@@ -0,0 +1,140 @@
+# profiling.py
+#
+# リクエストごとのプロファイリング（既定は無効、common/observability.py の Telemetry.log_request から呼ぶ）
+
+import cProfile
+import hmac
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from .observability import add_log_fields
+
+# PROFILE_SAMPLE_RATE=N で N 件に1件のリクエストを計測する（0 で無効）。
+# PROFILE_TOKEN を設定すると、同じ値の X-Debug-Profile ヘッダーを付けたリクエストも計測する。
+# PROFILE_MODE=cprofile は pstats 形式（.prof）、sample は PROFILE_INTERVAL_MS ごとにスタックを記録した
+# collapsed 形式（.folded、flamegraph.pl や speedscope で読める）で PROFILE_DIR に保存する。
+# どちらもリクエストを処理したスレッドだけが対象（ファンアウトのワーカースレッドは含まない）。
+PROFILE_SAMPLE_RATE = int(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_HEADER = 'X-Debug-Profile'
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'cprofile')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/profiles')
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000
+# /tmp はメモリ上にあるため、保存するファイル数に上限を設ける（超えたら古いものから削除する。0 で保存しない）
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+
+_profile_counter = itertools.count(1)
+_profile_sequence = itertools.count(1)
+_profile_lock = threading.Lock()
+_profile_paths = deque()  # このインスタンスで保存したプロファイル（古い順）
+
+
+def should_profile(request):
+    """
+    このリクエストを計測するかどうか（デバッグヘッダー、または N 件に1件）
+    """
+    token = request.headers.get(PROFILE_HEADER)
+    if PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and next(_profile_counter) % PROFILE_SAMPLE_RATE == 0
+
+
+class StackSampler:
+    """
+    対象スレッドのスタックを一定間隔で記録する（Firestore や APNs の待ち時間も含めた経過時間の内訳）
+    """
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({os.path.basename(code.co_filename)})')
+                frame = frame.f_back
+            if names:
+                stack = ';'.join(reversed(names))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.items())
+
+
+def save_profile(service, function, started, suffix, write, logger):
+    """
+    プロファイルを PROFILE_DIR に保存し、リクエストのログにパスを残す
+    このインスタンスで保存したファイルが PROFILE_MAX_FILES を超えたら、古いものから削除する
+    """
+    if PROFILE_MAX_FILES <= 0:
+        add_log_fields(profile_skipped='max_files')
+        return
+    path = os.path.join(PROFILE_DIR, f'{service}-{function}-{int(started * 1000)}-{os.getpid()}-'
+                                     f'{next(_profile_sequence)}.{suffix}')
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        write(path)
+    except OSError as e:
+        logger.warning("⚠️ プロファイルの保存に失敗: %s", e)
+        return
+    with _profile_lock:
+        _profile_paths.append(path)
+        expired = [_profile_paths.popleft() for _ in range(len(_profile_paths) - PROFILE_MAX_FILES)]
+    for old_path in expired:
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass
+    add_log_fields(profile=path)
+
+
+def run_profiled(func, request, telemetry):
+    """
+    計測対象のリクエストならプロファイルを取りながら func を実行する（無効時は func を呼ぶだけ）
+    """
+    if not (PROFILE_SAMPLE_RATE or PROFILE_TOKEN) or not should_profile(request):
+        return func(request)
+
+    started = time.time()
+    if PROFILE_MODE == 'sample':
+        sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_SECONDS)
+        sampler.start()
+        try:
+            return func(request)
+        finally:
+            sampler.stop()
+            body = sampler.collapsed()
+
+            def write(path):
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(body)
+            save_profile(telemetry.service, func.__name__, started, 'folded', write, telemetry.logger)
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 別のプロファイラーが動作中（Python 3.12 以降はプロセス全体で同時に1つだけ）
+        add_log_fields(profile_skipped='busy')
+        return func(request)
+    try:
+        return func(request)
+    finally:
+        profiler.disable()
+        save_profile(telemetry.service, func.__name__, started, 'prof', profiler.dump_stats, telemetry.logger)
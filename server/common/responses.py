@@ -0,0 +1,209 @@
+# responses.py
+#
+# 3つのCRUDサービスで共通のレスポンスと Firestore の書き込みの処理
+# - 一覧のJSON（orjson があれば使う、gzip / br 圧縮）と NDJSON のストリーミング、fields= によるフィールドの絞り込み
+# - コレクションのバージョン（collection-meta）による ETag
+# - Firestore の書き込みエラーから HTTP レスポンスへの変換
+
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from . import observability
+from .observability import add_log_fields
+
+# 任意の依存: orjson があればJSONのエンコードに、brotli があれば br 圧縮に使う
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def json_default(value):
+    """
+    json.dumps で扱えない値（Firestoreのタイムスタンプなど）をシリアライズする
+    """
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def parse_fields(request, allowed):
+    """
+    fields= で指定された返すフィールドのリスト（未指定は None、不明なフィールドは ValueError）
+    """
+    raw = request.args.get('fields')
+    if raw is None:
+        return None
+    fields = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f'unknown fields: {", ".join(unknown)}')
+    return fields
+
+
+def select_fields(query, fields, id_key, required=()):
+    """
+    返すフィールドだけを Firestore から読むよう select() を付ける（fields が None なら全フィールド）
+    並び替えやカーソルに使うフィールド（required）は返さない場合も読む
+    """
+    if fields is None:
+        return query
+    field_paths = sorted({field for field in fields if field != id_key} | set(required))
+    # 空の select() は全フィールドを返すため、IDだけ必要な場合は __name__ を指定する
+    return query.select(field_paths or ['__name__'])
+
+
+def project_fields(doc_dict, fields, id_key):
+    """
+    fields で指定されたフィールドとIDだけを残す
+    """
+    if fields is None:
+        return doc_dict
+    projected = {field: doc_dict[field] for field in fields if field in doc_dict}
+    projected[id_key] = doc_dict[id_key]
+    return projected
+
+
+def dumps_json(value):
+    """
+    JSON を bytes で返す（orjson があれば使い、なければ標準の json を使う）
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=json_default)
+    return json.dumps(value, ensure_ascii=False, default=json_default).encode('utf-8')
+
+
+# これより小さいレスポンスは圧縮しない（圧縮にかかる時間に見合わないため）
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+
+def json_response(request, value, headers=None):
+    """
+    一覧のJSONレスポンスを作成する
+    Accept-Encoding に応じて br（brotli がある場合）または gzip で圧縮する
+    """
+    body = dumps_json(value)
+    response_headers = {'Content-Type': 'application/json', 'Vary': 'Accept, Accept-Encoding', **(headers or {})}
+    if len(body) >= COMPRESS_MIN_BYTES:
+        encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli is not None else ['gzip'])
+        if encoding == 'br':
+            body = brotli.compress(body, quality=4)
+        elif encoding == 'gzip':
+            body = gzip.compress(body, compresslevel=5)
+        if encoding:
+            response_headers['Content-Encoding'] = encoding
+            add_log_fields(content_encoding=encoding)
+    add_log_fields(response_bytes=len(body))
+    return (body, 200, response_headers)
+
+
+# 1行に1ドキュメントのJSONを返すストリーミング形式（Accept で指定された場合だけ使う）
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+def wants_ndjson(request):
+    """
+    Accept で NDJSON が優先されているか（指定がなければ従来どおり JSON の配列を返す）
+    """
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def ndjson_response(docs, id_key, fields=None, headers=None):
+    """
+    Firestore の stream() から1件ずつ読みながら、1行1ドキュメントで送る
+    一覧をリストにまとめないため、コレクションの大きさによらずメモリ使用量は一定
+    （1行ずつ送るため圧縮はしない）
+    """
+    request_state = observability.capture_request()
+
+    def generate():
+        # 送信はハンドラーが返った後に行われるため、Firestore の読み取りをこのリクエストの関数として記録する
+        observability.resume_request(request_state)
+        count = 0
+        try:
+            for doc in docs:
+                doc_dict = doc.to_dict()
+                doc_dict[id_key] = doc.id
+                yield dumps_json(project_fields(doc_dict, fields, id_key)) + b'\n'
+                count += 1
+        except Exception as e:
+            # ヘッダーは送信済みのため、ステータスは変えられない（クライアントには途中で切れたように見える）
+            observability.current_logger().exception("❌ NDJSONの送信中にエラー（%d件送信済み）: %s", count, e)
+        finally:
+            observability.end_request()
+
+    add_log_fields(streamed=True)
+    response_headers = {'Content-Type': NDJSON_MIMETYPE, 'Vary': 'Accept, Accept-Encoding', **(headers or {})}
+    return (generate(), 200, response_headers)
+
+
+def collection_meta_ref(db, collection_path):
+    """
+    コレクションのバージョンを保持するメタデータドキュメント
+    例: family-management/{familyId}/members -> family-management/{familyId}/collection-meta/members
+    """
+    parent_path, name = collection_path.rsplit('/', 1)
+    return db.document(f'{parent_path}/collection-meta/{name}')
+
+
+def bump_collection_version(batch, db, collection_path):
+    """
+    書き込みと同じバッチでコレクションのバージョンを1つ進める
+    """
+    from google.cloud import firestore
+    batch.set(collection_meta_ref(db, collection_path), {'version': firestore.Increment(1)}, merge=True)
+
+
+def collection_etag(db, collection_path, request):
+    """
+    メタデータドキュメント1件だけを読んで ETag を作成（コレクションは読まない）
+    クエリパラメータやレスポンス形式（JSON / NDJSON）が違えばレスポンスも違うため、それも ETag に含める
+    """
+    snapshot = collection_meta_ref(db, collection_path).get()
+    version = (snapshot.to_dict() or {}).get('version', 0) if snapshot.exists else 0
+    variant = hashlib.sha1(request.query_string + (b'|ndjson' if wants_ndjson(request) else b'')).hexdigest()[:12]
+    return f'{version}-{variant}'
+
+
+def firestore_error_response(e, not_found_message):
+    """
+    Firestoreの書き込みエラーをHTTPレスポンスに変換する（対応しない例外は None）
+    - 存在前提条件（update / exists=True）の失敗は 404
+    - 作成済みのドキュメントの create は 409
+    - 更新時刻の前提条件（last_update_time）の失敗は、読んだ後に別のリクエストが書き込んだ競合として 409
+    - 一時的なエラーは 503 を返してクライアントに再試行させる
+    """
+    from google.api_core import exceptions
+
+    if isinstance(e, exceptions.NotFound):
+        return (not_found_message, 404)
+    if isinstance(e, exceptions.AlreadyExists):
+        return ('Already exists', 409)
+    if isinstance(e, exceptions.FailedPrecondition):
+        return ('Conflict', 409)
+    if isinstance(e, (exceptions.Aborted, exceptions.DeadlineExceeded,
+                      exceptions.ServiceUnavailable, exceptions.TooManyRequests)):
+        return (json.dumps({'error': 'Firestore is temporarily unavailable'}), 503,
+                {'Content-Type': 'application/json', 'Retry-After': '1'})
+    return None
+
+
+def commit_write(batch, not_found_message):
+    """
+    バッチを1回のRPCでコミットする（成功時は None、既知のエラーはHTTPレスポンスを返す）
+    存在確認の読み込みはせず、書き込みの前提条件に任せる
+    """
+    try:
+        batch.commit()
+    except Exception as e:
+        response = firestore_error_response(e, not_found_message)
+        if response is None:
+            raise
+        observability.current_logger().info("書き込みの前提条件エラー: %s", e)
+        return response
+    return None
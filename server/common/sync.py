@@ -0,0 +1,95 @@
+# sync.py
+#
+# 目標・家族ミッションの差分同期（GET ?since=<syncToken>）
+# - 同期トークンは不透明な文字列で、中身は返したドキュメントの最新の更新時刻（マイクロ秒単位のUNIX時刻）
+# - 削除は墓標（tombstone）ドキュメントで伝える。TOMBSTONE_RETENTION_DAYS より古い since は全件の再取得にする
+# 注意: expireAt を対象に Firestore の TTL ポリシーを設定して墓標を削除する
+
+import base64
+import os
+from datetime import datetime, timedelta, timezone
+
+from .responses import project_fields, select_fields
+
+# 差分同期で削除を伝えるための墓標（tombstone）を保持する日数
+# これより古い since を指定された場合はクライアントに全件の再取得を求める
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 30))
+
+_SYNC_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_sync_token(timestamp):
+    """
+    同期トークン（不透明な文字列）を作成。中身はマイクロ秒単位のUNIX時刻
+    """
+    micros = (timestamp - _SYNC_EPOCH) // timedelta(microseconds=1)
+    return base64.urlsafe_b64encode(str(micros).encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_sync_token(token):
+    """
+    同期トークンを時刻に戻す（不正な場合は ValueError）
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        micros = int(base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii'))
+        return _SYNC_EPOCH + timedelta(microseconds=micros)
+    except Exception:
+        raise ValueError('since is invalid')
+
+
+def tombstone_data():
+    """
+    削除を記録する墓標ドキュメントの内容（expireAt は Firestore の TTL ポリシー用）
+    """
+    from google.cloud import firestore
+    return {
+        'deletedAt': firestore.SERVER_TIMESTAMP,
+        'expireAt': datetime.now(timezone.utc) + timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    }
+
+
+def query_changes(db, collection_path, tombstone_collection_path, since_token, id_key, fields=None):
+    """
+    since 以降に作成・更新・削除されたドキュメントだけを返す（ID は各ドキュメントの id_key に入れる）
+    since が空の場合は全件を返す（初回同期）
+    """
+    since = decode_sync_token(since_token) if since_token else None
+    latest = since or _SYNC_EPOCH
+
+    reset = False
+    if since is not None and since < datetime.now(timezone.utc) - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+        # 墓標が残っていない可能性があるため全件を返す
+        since = None
+        reset = True
+
+    query = db.collection(collection_path)
+    if since is not None:
+        query = query.where('updatedAt', '>', since)
+
+    changed = []
+    for doc in select_fields(query, fields, id_key, required=('updatedAt',)).stream():
+        doc_dict = doc.to_dict()
+        doc_dict[id_key] = doc.id
+        changed.append(project_fields(doc_dict, fields, id_key))
+        updated_at = doc_dict.get('updatedAt')
+        if isinstance(updated_at, datetime) and updated_at > latest:
+            latest = updated_at
+
+    deleted = []
+    if since is not None:
+        tombstones = db.collection(tombstone_collection_path).where('deletedAt', '>', since)
+        for doc in tombstones.stream():
+            deleted.append(doc.id)
+            deleted_at = doc.to_dict().get('deletedAt')
+            if isinstance(deleted_at, datetime) and deleted_at > latest:
+                latest = deleted_at
+
+    # 返したドキュメントの最新の更新時刻を次回の since にする
+    # （Firestoreは強整合のため、これ以前にコミットされた変更はすべて今回の結果に含まれる）
+    return {
+        'changed': changed,
+        'deleted': deleted,
+        'syncToken': encode_sync_token(latest),
+        'reset': reset or not since_token
+    }
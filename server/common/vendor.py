@@ -0,0 +1,43 @@
+"""
+server/common を各サービスのディレクトリにコピーする（単独でデプロイする前に実行する）
+
+使い方（server/ から実行）:
+    python -m common.vendor
+    python -m common.vendor management-family update-user-mission
+    python -m common.vendor --clean    # コピーを削除する
+"""
+import argparse
+import os
+import shutil
+import sys
+
+COMMON_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(COMMON_DIR)
+SERVICES = ('management-family', 'update-user-mission', 'update-family-mission', 'push-notification')
+
+
+def vendor(service, clean=False):
+    target = os.path.join(SERVER_DIR, service, 'common')
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    if clean:
+        return None
+    shutil.copytree(COMMON_DIR, target, ignore=shutil.ignore_patterns('__pycache__', 'vendor.py'))
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('services', nargs='*', help=f'対象のサービス（{" / ".join(SERVICES)}、既定はすべて）')
+    parser.add_argument('--clean', action='store_true', help='コピーを削除する')
+    args = parser.parse_args()
+    unknown = [service for service in args.services if service not in SERVICES]
+    if unknown:
+        parser.error(f'unknown services: {", ".join(unknown)}')
+    for service in args.services or SERVICES:
+        target = vendor(service, args.clean)
+        print(f'{service}: {"削除" if target is None else target}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
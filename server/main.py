@@ -0,0 +1,179 @@
+# main.py
+#
+# 4つのサービスを1つにまとめて動かすためのエントリーポイント（任意）
+# 各サービスの main.py はそのまま単独でもデプロイできる。まとめる場合は server/ をソースにして
+# api_router をエントリーポイントに指定する。
+#
+#   /management-family                                 -> family_members_handler
+#   /update-user-mission                               -> user_goals_handler
+#   /update-family-mission                             -> family_missions_handler
+#   /family-dashboard                                  -> family_dashboard_handler（management-family）
+#   /push-notification/send_apns_push                  -> send_apns_push
+#   /push-notification/send_family_goal_notification   -> send_family_goal_notification
+#   /push-notification/send_family_goal_notifications_batch
+#   /push-notification/drain_notification_outbox
+#   /metrics                                           -> 全サービスのメトリクス（Prometheus のテキスト形式）
+#
+# Firestoreクライアント（gRPCチャネル）は全サービスで1つを共有する。
+# STORAGE_BACKEND=memory の場合は Firestore の代わりにインメモリのストレージを使う（負荷試験・ローカル実行用）。
+
+import time
+_import_started = time.perf_counter()
+
+import functions_framework
+import importlib.util
+import json
+import os
+import sys
+import threading
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+from common.observability import get_logger  # noqa: E402
+
+# ログ設定（LOG_LEVEL で出力レベルを指定、既定は INFO）
+logger = get_logger('api-router')
+
+# まとめて動かすサービス（ディレクトリ名）
+SERVICES = ('management-family', 'update-user-mission', 'update-family-mission', 'push-notification')
+
+def load_service(service):
+    """
+    サービスのディレクトリにある main.py をモジュールとして読み込む
+    （ディレクトリ名にハイフンがあるため import 文では読み込めない）
+    """
+    name = f'{service.replace("-", "_")}_main'
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SERVER_DIR, service, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+services = {service: load_service(service) for service in SERVICES}
+
+# パス -> ハンドラー（各サービスの既存のエントリーポイントをそのまま呼ぶ）
+ROUTES = {
+    '/management-family': services['management-family'].family_members_handler,
+    '/update-user-mission': services['update-user-mission'].user_goals_handler,
+    '/update-family-mission': services['update-family-mission'].family_missions_handler,
+    '/family-dashboard': services['management-family'].family_dashboard_handler,
+}
+for _name in ('send_apns_push', 'send_family_goal_notification',
+              'send_family_goal_notifications_batch', 'drain_notification_outbox'):
+    ROUTES[f'/push-notification/{_name}'] = getattr(services['push-notification'], _name)
+
+# 全サービスで共有するFirestoreクライアント（最初に使うときに作成する）
+_db = None
+_db_lock = threading.Lock()
+
+def get_db():
+    """
+    共有のストレージ（Firestoreクライアント）を作成し、各サービスの get_db() が同じものを返すように差し込む
+    """
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                started = time.perf_counter()
+                # STORAGE_BACKEND=memory でインメモリのストレージを使う（storage/ を参照）
+                from storage import create_async_client, create_client
+                db = create_client()
+                for module in services.values():
+                    module._db = db
+                    if hasattr(module, '_async_db'):
+                        # 非同期クライアント（ダッシュボード用）も同じデータを読むものにする
+                        module._async_db = create_async_client(db)
+                    # Firestore の呼び出しは、リクエストを処理中のサービスのメトリクスに記録される
+                    module.instrument_firestore(db)
+                _db = db
+                logger.info('firestore client created', extra={'fields': {
+                    'backend': type(db).__name__,
+                    'firestore_client_ms': round((time.perf_counter() - started) * 1000, 1)
+                }})
+    return _db
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+def render_prometheus(snapshots):
+    """
+    各サービスの Metrics.snapshot() を Prometheus のテキスト形式にまとめる（service ラベルを付ける）
+    """
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        service = {'service': snapshot['service']}
+        for counter in snapshot['counters']:
+            counters.setdefault(counter['name'], []).append(({**service, **counter['labels']}, counter['value']))
+        for histogram in snapshot['histograms']:
+            histograms.setdefault(histogram['name'], []).append(({**service, **histogram['labels']}, histogram))
+
+    lines = []
+    for name, series in sorted(counters.items()):
+        lines.append(f'# TYPE {name} counter')
+        lines.extend(f'{name}{format_labels(labels)} {value}' for labels, value in series)
+    for name, series in sorted(histograms.items()):
+        lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in series:
+            cumulative = 0
+            for upper, count in zip(histogram['buckets'] + ['+Inf'], histogram['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels({**labels, "le": upper})} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {histogram["sum"]}')
+            lines.append(f'{name}_count{format_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+def metrics_handler(request):
+    """
+    インスタンス内の全サービスのメトリクス（起動からの累積）
+    """
+    body = render_prometheus(module.metrics.snapshot() for module in services.values())
+    return (body, 200, {'Content-Type': PROMETHEUS_CONTENT_TYPE, 'Cache-Control': 'no-store'})
+
+ROUTES['/metrics'] = metrics_handler
+
+def member_change_family_id(request):
+    """
+    メンバーを変更したリクエストの familyId（management-family と同じ取得方法）
+    """
+    family_id = request.args.get('familyId')
+    if not family_id:
+        family_id = (request.get_json(silent=True) or {}).get('familyId')
+    return family_id
+
+@functions_framework.http
+def api_router(request):
+    path = request.path.rstrip('/') or '/'
+    handler = ROUTES.get(path)
+    if handler is None:
+        return (json.dumps({'error': 'Not Found', 'routes': sorted(ROUTES)}), 404, {'Content-Type': 'application/json'})
+
+    if handler is metrics_handler:
+        return handler(request)
+
+    get_db()
+    response = handler(request)
+
+    # 同じインスタンス内のプッシュ通知サービスが持つメンバーのキャッシュを、変更直後に無効化する
+    if path == '/management-family' and request.method in ('POST', 'PUT', 'DELETE'):
+        status = response[1] if isinstance(response, tuple) and len(response) > 1 else 200
+        family_id = member_change_family_id(request)
+        if status == 200 and family_id:
+            services['push-notification'].invalidate_family_member_tokens(family_id)
+    return response
+
+# import 完了までの時間を記録
+logger.info('startup', extra={'fields': {
+    'service': 'api-router',
+    'services': list(SERVICES),
+    'import_ms': round((time.perf_counter() - _import_started) * 1000, 1)
+}})
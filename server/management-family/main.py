@@ -1,14 +1,100 @@
 # main.py
 
+import time
+_import_started = time.perf_counter()
+
 import functions_framework
-from google.cloud import firestore
 import json
+import os
+import sys
+import threading
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# 共通モジュール（server/common）。単独でデプロイする場合は python -m common.vendor でコピーしておく
+try:
+    import common  # noqa: F401
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        import common  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            "common パッケージが見つかりません。このサービスを単独でデプロイする場合は、"
+            "server/ で python -m common.vendor management-family を実行してからデプロイしてください"
+        ) from e
+from common import observability
+from common.observability import add_log_fields, record_firestore
+from common.responses import (
+    parse_fields, select_fields, project_fields, json_response, wants_ndjson, ndjson_response,
+    bump_collection_version, collection_etag, firestore_error_response, commit_write
+)
+from common.event_loop import run_async
+from common.idempotency import cached_replay, idempotency_key, request_fingerprint, write_idempotent
+
+# ログ・メトリクス・起動時間の計測（common/observability.py）
+SERVICE_NAME = 'management-family'
+telemetry = observability.Telemetry(SERVICE_NAME)
+logger = telemetry.logger
+metrics = telemetry.metrics
+startup_report = telemetry.startup_report
+record_init_timing = telemetry.record_init_timing
+instrument_firestore = telemetry.instrument_firestore
+log_request = telemetry.log_request
+
+# Firestoreクライアント（最初に使うときに作成し、インスタンス内で使い回す）
+# google.cloud.firestore の import も初回利用時まで遅らせてコールドスタートを短縮する
+_db = None
+_db_lock = threading.Lock()
+
+def get_db():
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                started = time.perf_counter()
+                from google.cloud import firestore
+                db = firestore.Client()
+                instrument_firestore(db)
+                _db = db
+                record_init_timing('firestore_client_ms', started)
+    return _db
+
+# 一覧で返すメンバーのフィールド（deviceToken は含めない）
+MEMBER_FIELDS = ('name',)
+
+# deviceToken を登録したアプリの APNs の環境（push-notification が無効なトークンを判断するのに使う）
+APNS_ENVIRONMENTS = ('sandbox', 'production')
+
+def device_token_fields(data, creating=False):
+    """
+    deviceToken / apnsEnvironment の書き込み内容（どちらもなければ空、不正な値は ValueError）
+    更新でトークンを登録し直した場合は、以前のトークンの環境と BadDeviceToken の回数を消す
+    """
+    from google.cloud import firestore
 
-db = firestore.Client()
+    fields = {}
+    device_token = data.get('deviceToken')
+    apns_environment = data.get('apnsEnvironment')
+    if device_token is not None:
+        if not isinstance(device_token, str):
+            raise ValueError('deviceToken must be a string')
+        fields['deviceToken'] = device_token
+        if not creating:
+            fields['apnsEnvironment'] = firestore.DELETE_FIELD
+            fields['badTokenStrikes'] = firestore.DELETE_FIELD
+    if apns_environment is not None:
+        if apns_environment not in APNS_ENVIRONMENTS:
+            raise ValueError(f'apnsEnvironment must be one of {", ".join(APNS_ENVIRONMENTS)}')
+        fields['apnsEnvironment'] = apns_environment
+    return fields
 
 @functions_framework.http
+@log_request
 def family_members_handler(request):
     try:
+        db = get_db()
+
         # familyId, memberId の取得（クエリ or JSONボディ）
         family_id = request.args.get('familyId')
         member_id = request.args.get('memberId')
@@ -21,15 +107,25 @@ def family_members_handler(request):
         if not family_id:
             return ('familyId must be provided', 400)
 
+        add_log_fields(family_id=family_id)
         collection_path = f'family-management/{family_id}/members'
 
+        # GETは条件付きリクエストに対応（変更がなければコレクションを読まずに304を返す）
+        cache_headers = {}
+        if request.method == 'GET':
+            etag = collection_etag(db, collection_path, request)
+            # 圧縮やエンコーダーでバイト列が変わるため弱い ETag にする
+            cache_headers = {'ETag': f'W/"{etag}"', 'Cache-Control': 'no-cache'}
+            if request.if_none_match.contains_weak(etag):
+                add_log_fields(not_modified=True)
+                return ('', 304, cache_headers)
+
         if request.method == 'POST':
             data = request.get_json(silent=True)
             if not data:
                 return ('No JSON payload provided', 400)
 
             name = data.get('name')
-            device_token = data.get('deviceToken')  # deviceTokenパラメータを取得
 
             if not isinstance(name, str):
                 return ('name must be a string', 400)
@@ -39,17 +135,40 @@ def family_members_handler(request):
                 'name': name
             }
             
-            # deviceTokenが提供されている場合は追加
-            if device_token is not None:
-                if not isinstance(device_token, str):
-                    return ('deviceToken must be a string', 400)
-                create_data['deviceToken'] = device_token
+            # deviceToken / apnsEnvironment が提供されている場合は追加
+            try:
+                create_data.update(device_token_fields(data, creating=True))
+            except ValueError as e:
+                return (str(e), 400)
 
-            doc_ref = db.collection(collection_path).add(create_data)
+            try:
+                key = idempotency_key(request)
+            except ValueError as e:
+                return (str(e), 400)
+            fingerprint = request_fingerprint(data)
+            replay = cached_replay(collection_path, key, fingerprint)
+            if replay:
+                return replay
+
+            doc_ref = db.collection(collection_path).document()
             response = {
                 'result': 'created',
-                'memberId': doc_ref[1].id
+                'memberId': doc_ref.id
             }
+
+            def write(record):
+                batch = db.batch()
+                batch.set(doc_ref, create_data)
+                if record:
+                    # 同じキーが既にあればバッチ全体が AlreadyExists で失敗する
+                    batch.create(*record)
+                bump_collection_version(batch, db, collection_path)
+                batch.commit()
+
+            replay = write_idempotent(db, collection_path, key, fingerprint, response, write)
+            if replay:
+                return replay
+            add_log_fields(member_id=doc_ref.id)
             return (json.dumps(response), 200, {'Content-Type': 'application/json'})
 
         elif request.method == 'PUT':
@@ -57,19 +176,13 @@ def family_members_handler(request):
             if not data:
                 return ('No JSON payload provided', 400)
 
-            # デバッグ情報を出力
-            print(f"🔧 PUT リクエスト デバッグ情報:")
-            print(f"  - family_id: {family_id}")
-            print(f"  - member_id (from args): {member_id}")
-            print(f"  - data: {data}")
-            
             member_id = member_id or data.get('memberId')
             name = data.get('name')
             device_token = data.get('deviceToken')  # deviceTokenパラメータを取得
             
-            print(f"  - member_id (final): {member_id}")
-            print(f"  - name: {name}")
-            print(f"  - device_token: {device_token}")
+            # デバッグ情報を出力（デバイストークンは有無のみ）
+            logger.debug("🔧 PUT リクエスト: family_id=%s, member_id=%s, name=%s, device_token=%s",
+                         family_id, member_id, name, 'あり' if device_token else 'なし')
 
             if not isinstance(member_id, str):
                 return ('memberId must be provided as a string for update', 400)
@@ -77,25 +190,29 @@ def family_members_handler(request):
                 return ('name must be a string', 400)
 
             doc_ref = db.collection(collection_path).document(member_id)
-            if not doc_ref.get().exists:
-                return ('Member not found', 404)
 
             # 更新データを準備
             update_data = {
                 'name': name
             }
             
-            # deviceTokenが提供されている場合は追加
-            if device_token is not None:
-                if not isinstance(device_token, str):
-                    return ('deviceToken must be a string', 400)
-                update_data['deviceToken'] = device_token
+            # deviceToken / apnsEnvironment が提供されている場合は追加
+            try:
+                update_data.update(device_token_fields(data))
+            except ValueError as e:
+                return (str(e), 400)
 
-            doc_ref.update(update_data)
+            batch = db.batch()
+            batch.update(doc_ref, update_data)
+            bump_collection_version(batch, db, collection_path)
+            error = commit_write(batch, 'Member not found')
+            if error:
+                return error
             response = {
                 'result': 'updated',
                 'memberId': member_id
             }
+            add_log_fields(member_id=member_id)
             return (json.dumps(response), 200, {'Content-Type': 'application/json'})
 
         elif request.method == 'DELETE':
@@ -103,27 +220,144 @@ def family_members_handler(request):
             if not isinstance(member_id, str):
                 return ('memberId must be provided as a string for delete', 400)
             doc_ref = db.collection(collection_path).document(member_id)
-            if not doc_ref.get().exists:
-                return ('Member not found', 404)
-            doc_ref.delete()
+            batch = db.batch()
+            batch.delete(doc_ref, option=db.write_option(exists=True))
+            bump_collection_version(batch, db, collection_path)
+            error = commit_write(batch, 'Member not found')
+            if error:
+                return error
             response = {
                 'result': 'deleted',
                 'memberId': member_id
             }
+            add_log_fields(member_id=member_id)
             return (json.dumps(response), 200, {'Content-Type': 'application/json'})
 
         elif request.method == 'GET':
-            docs = db.collection(collection_path).stream()
+            try:
+                fields = parse_fields(request, MEMBER_FIELDS + ('memberId',))
+            except ValueError as e:
+                return (str(e), 400)
+            # deviceToken は他のメンバーに返さないため、Firestore からも読まない
+            query = select_fields(db.collection(collection_path), fields or list(MEMBER_FIELDS), 'memberId')
+            if wants_ndjson(request):
+                return ndjson_response(query.stream(), 'memberId', fields, cache_headers)
             result = []
-            for doc in docs:
+            for doc in query.stream():
                 doc_dict = doc.to_dict()
                 doc_dict['memberId'] = doc.id
-                result.append(doc_dict)
-            return (json.dumps(result, ensure_ascii=False), 200, {'Content-Type': 'application/json'})
+                result.append(project_fields(doc_dict, fields, 'memberId'))
+            add_log_fields(count=len(result))
+            return json_response(request, result, cache_headers)
 
         else:
             return ('Method Not Allowed', 405)
 
     except Exception as e:
+        logger.exception("❌ 関数実行エラー: %s", e)
+        return (json.dumps({'error': str(e)}), 500, {'Content-Type': 'application/json'})
+
+# ---- 家族画面のダッシュボード ----
+# 家族画面を開いたときのメンバー一覧とミッション一覧（と達成状況）を1回のリクエストで返す。
+# 2つのコレクションは Firestore の非同期クライアントで並行して読むため、待ち時間は遅い方の1回分になる。
+# 非同期クライアントの gRPC チャネルは作成したイベントループに結び付くため、インスタンス共通のイベントループ
+# （common/event_loop.py）にコルーチンを渡し、リクエストのスレッドで結果を待つ。
+DASHBOARD_TIMEOUT_SECONDS = float(os.environ.get('DASHBOARD_TIMEOUT_SECONDS', 10))
+# 進捗の「今日」を判定するタイムゾーン（update-family-mission と同じ）
+MISSION_SUMMARY_TIMEZONE = os.environ.get('MISSION_SUMMARY_TIMEZONE', 'Asia/Tokyo')
+# ダッシュボードで返すミッションのフィールド（clearedOn は集計にだけ使う）
+DASHBOARD_MISSION_FIELDS = ('mission', 'isCleared', 'createdAt')
+
+_async_db = None
+_async_lock = threading.Lock()
+
+def get_async_db():
+    """
+    非同期の Firestore クライアント（server/main.py から動かす場合は共有のストレージと同じデータを読むものが入る）
+    """
+    global _async_db
+    if _async_db is None:
+        with _async_lock:
+            if _async_db is None:
+                started = time.perf_counter()
+                from google.cloud import firestore
+                _async_db = firestore.AsyncClient()
+                record_init_timing('firestore_async_client_ms', started)
+    return _async_db
+
+async def read_family_dashboard(db, family_id):
+    """
+    メンバーとミッションを並行して読む（deviceToken は Firestore からも読まない）
+    """
+    import asyncio
+
+    family_path = f'family-management/{family_id}'
+    members_query = db.collection(f'{family_path}/members').select(list(MEMBER_FIELDS))
+    missions_query = db.collection(f'{family_path}/missions').select(list(DASHBOARD_MISSION_FIELDS) + ['clearedOn'])
+    return await asyncio.gather(members_query.get(), missions_query.get())
+
+def build_family_dashboard(family_id, member_docs, mission_docs, today):
+    """
+    画面に必要なフィールドだけの、まとめたレスポンス
+    ID のキーは各サービスの一覧GETと同じ（memberId / doc_id）
+    """
+    members = []
+    for doc in member_docs:
+        member = doc.to_dict() or {}
+        members.append({'memberId': doc.id, **{field: member.get(field) for field in MEMBER_FIELDS}})
+
+    missions = []
+    stats = {'members': len(members), 'missions': 0, 'cleared': 0, 'clearedToday': 0, 'today': today}
+    for doc in mission_docs:
+        mission = doc.to_dict() or {}
+        missions.append({'doc_id': doc.id, **{field: mission.get(field) for field in DASHBOARD_MISSION_FIELDS}})
+        stats['missions'] += 1
+        if mission.get('isCleared'):
+            stats['cleared'] += 1
+            if mission.get('clearedOn') == today:
+                stats['clearedToday'] += 1
+    # ミッション一覧の GET と同じく作成日時の新しい順
+    missions.sort(key=lambda x: x.get('createdAt') or '', reverse=True)
+    stats['remaining'] = stats['missions'] - stats['cleared']
+    return {'familyId': family_id, 'members': members, 'missions': missions, 'stats': stats}
+
+@functions_framework.http
+@log_request
+def family_dashboard_handler(request):
+    try:
+        if request.method != 'GET':
+            return ('Method Not Allowed', 405)
+
+        family_id = request.args.get('familyId')
+        if not family_id:
+            return ('familyId must be provided', 400)
+        add_log_fields(family_id=family_id)
+
+        try:
+            member_docs, mission_docs = run_async(read_family_dashboard(get_async_db(), family_id),
+                                                  DASHBOARD_TIMEOUT_SECONDS)
+        except TimeoutError:
+            logger.warning("⚠️ ダッシュボードの読み込みがタイムアウト: family_id=%s", family_id)
+            return (json.dumps({'error': 'Firestore is temporarily unavailable'}), 503,
+                    {'Content-Type': 'application/json', 'Retry-After': '1'})
+        except Exception as e:
+            response = firestore_error_response(e, 'Family not found')
+            if response is None:
+                raise
+            return response
+        # 非同期クライアントの読み取りはイベントループのスレッドで行われるため、ここでまとめて記録する
+        record_firestore('run_query', reads=len(member_docs))
+        record_firestore('run_query', reads=len(mission_docs))
+
+        today = datetime.now(ZoneInfo(MISSION_SUMMARY_TIMEZONE)).date().isoformat()
+        dashboard = build_family_dashboard(family_id, member_docs, mission_docs, today)
+        add_log_fields(members=len(dashboard['members']), missions=len(dashboard['missions']))
+        return json_response(request, dashboard, {'Cache-Control': 'no-cache'})
+
+    except Exception as e:
+        logger.exception("❌ 関数実行エラー: %s", e)
         return (json.dumps({'error': str(e)}), 500, {'Content-Type': 'application/json'})
 
+# import 完了までの時間を記録
+startup_report['import_ms'] = round((time.perf_counter() - _import_started) * 1000, 1)
+logger.info('startup', extra={'fields': dict(startup_report)})
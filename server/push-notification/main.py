@@ -1,16 +1,45 @@
-import json
-import jwt
 import time
-import httpx
-from datetime import datetime, timedelta
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import ec
-from cryptography.hazmat.backends import default_backend
+_import_started = time.perf_counter()
+
+import json
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import functions_framework
-from google.cloud import firestore
 
 import os
 
+# 注意: jwt / cryptography / httpx / google.cloud.firestore は読み込みが重いため、
+# 実際に使う処理の中で import する（コールドスタート短縮のため）
+
+# 共通モジュール（server/common）。単独でデプロイする場合は python -m common.vendor でコピーしておく
+try:
+    import common  # noqa: F401
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        import common  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            "common パッケージが見つかりません。このサービスを単独でデプロイする場合は、"
+            "server/ で python -m common.vendor push-notification を実行してからデプロイしてください"
+        ) from e
+from common import observability
+from common.event_loop import run_async
+from common.observability import COUNT_BUCKETS, add_log_fields
+
+# ログ・メトリクス・起動時間の計測（common/observability.py）
+SERVICE_NAME = 'push-notification'
+telemetry = observability.Telemetry(SERVICE_NAME)
+logger = telemetry.logger
+metrics = telemetry.metrics
+startup_report = telemetry.startup_report
+record_init_timing = telemetry.record_init_timing
+instrument_firestore = telemetry.instrument_firestore
+log_request = telemetry.log_request
+
 # APNs設定（環境変数から取得）
 TEAM_ID = os.environ.get('TEAM_ID') # Apple Developer Team ID
 KEY_ID = os.environ.get('KEY_ID')     # APNs認証キーのID
@@ -19,141 +48,638 @@ BUNDLE_ID = os.environ.get('BUNDLE_ID')  # アプリのBundle ID
 # デバイストークン（固定値 - 勉強用）
 DEVICE_TOKEN = os.environ.get('DEVICE_TOKEN') 
 
-# Firestoreクライアント
-db = firestore.Client()
+# Firestoreクライアント（最初に使うときに作成し、インスタンス内で使い回す）
+_db = None
+_db_lock = threading.Lock()
 
-APNS_URL = "https://api.sandbox.push.apple.com/3/device/"
+def get_db():
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                started = time.perf_counter()
+                from google.cloud import firestore
+                db = firestore.Client()
+                instrument_firestore(db)
+                _db = db
+                record_init_timing('firestore_client_ms', started)
+    return _db
+
+APNS_URL = os.environ.get('APNS_URL', "https://api.sandbox.push.apple.com/3/device/")
+# 送信先の APNs の環境（sandbox / production）。APNS_URL から判断し、APNS_ENVIRONMENT で明示もできる
+APNS_ENVIRONMENT = os.environ.get('APNS_ENVIRONMENT') or ('sandbox' if 'sandbox' in APNS_URL else 'production')
 
 # プライベートキーファイルパス
 PRIVATE_KEY_PATH = os.environ.get('PRIVATE_KEY_PATH')
 
+# ファミリー通知の同時送信数と全体の締め切り（秒）
+FANOUT_CONCURRENCY = int(os.environ.get('APNS_FANOUT_CONCURRENCY', 16))
+FANOUT_DEADLINE_SECONDS = float(os.environ.get('APNS_FANOUT_DEADLINE_SECONDS', 20.0))
+
+# 無効なデバイストークンを自動で削除するか
+PRUNE_DEAD_TOKENS = os.environ.get('PRUNE_DEAD_TOKENS', 'true').lower() == 'true'
+
+# Firestoreのバッチ書き込み1回あたりの上限
+FIRESTORE_BATCH_LIMIT = 500
+
+# 一括通知で受け付ける最大件数
+MAX_BATCH_NOTIFICATIONS = int(os.environ.get('MAX_BATCH_NOTIFICATIONS', 500))
+
+# 同じ達成者の目標達成通知をまとめるウィンドウ（秒、0で無効）
+# まとめた通知はアウトボックスに積まれ、次の通知の受付時か drain_notification_outbox で送信される
+COALESCE_WINDOW_SECONDS = float(os.environ.get('COALESCE_WINDOW_SECONDS', 0))
+
+# 通知の送信モード（sync: リクエスト内で送信, outbox: キューに積んで後で送信）
+NOTIFICATION_MODE = os.environ.get('NOTIFICATION_MODE', 'sync')
+
+# アウトボックス設定
+OUTBOX_BACKEND = os.environ.get('OUTBOX_BACKEND', 'firestore')  # firestore または local
+OUTBOX_COLLECTION = os.environ.get('OUTBOX_COLLECTION', 'notification-outbox')
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+OUTBOX_BACKOFF_BASE_SECONDS = float(os.environ.get('OUTBOX_BACKOFF_BASE_SECONDS', 30.0))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.environ.get('OUTBOX_BACKOFF_MAX_SECONDS', 3600.0))
+OUTBOX_LEASE_SECONDS = float(os.environ.get('OUTBOX_LEASE_SECONDS', 120.0))
+OUTBOX_DRAIN_TIME_BUDGET_SECONDS = float(os.environ.get('OUTBOX_DRAIN_TIME_BUDGET_SECONDS', 240.0))
+
+def members_from_docs(family_id, docs):
+    """
+    メンバードキュメントからデバイストークンを持つメンバーの一覧を作成
+    """
+    members = []
+    for doc in docs:
+        doc_data = doc.to_dict()
+        member_id = doc.id
+        
+        if 'deviceToken' in doc_data and doc_data['deviceToken']:
+            members.append({
+                'familyId': family_id,
+                'memberId': member_id,
+                'name': doc_data.get('name', 'Unknown'),
+                'deviceToken': doc_data['deviceToken'],
+                # トークンを登録したアプリの環境（sandbox / production、わからない場合は None）
+                'apnsEnvironment': doc_data.get('apnsEnvironment'),
+                'badTokenStrikes': doc_data.get('badTokenStrikes', 0),
+                'updateTime': doc.update_time
+            })
+        else:
+            logger.debug("    ❌ デバイストークンなし: %s (%s)", doc_data.get('name', 'Unknown'), member_id)
+    
+    return members
+
+def fetch_family_member_tokens(family_id):
+    """
+    Firestoreからファミリーメンバー全員のデバイストークンを読み込む（キャッシュを使わない）
+    """
+    collection_path = f'family-management/{family_id}/members'
+    logger.debug("🔧 Firestoreコレクションパス: %s", collection_path)
+    return members_from_docs(family_id, get_db().collection(collection_path).stream())
+
+def fetch_family_members_version(family_id):
+    """
+    management-family がメンバーの追加・更新・削除のたびに進めるバージョン（collection-meta/members）を読む
+    """
+    snapshot = get_db().document(f'family-management/{family_id}/collection-meta/members').get()
+    return (snapshot.to_dict() or {}).get('version', 0) if snapshot.exists else 0
+
+class MemberTokenCache:
+    """
+    ファミリーごとのメンバー・デバイストークンのキャッシュ（TTL + LRU）
+    - max_families を超えたら最も古く使われたファミリーから追い出す
+    - 読み込んだときのメンバーのバージョン（management-family が変更のたびに進める）を一緒に持ち、
+      最後の確認から version_check_seconds 秒が過ぎていれば、キャッシュを返す前にバージョンのドキュメント
+      1件だけを読んで、変わっていれば読み込み直す（別のインスタンスでの変更はこの間隔で反映される。
+      それまではキャッシュから返し、Firestore を読まない。0 にすると毎回確認する）
+    - watch=True の場合は Firestore の on_snapshot で変更を受け取り、常に最新に保つ
+      （監視中のファミリーはTTLで期限切れにならず、バージョンも確認しない）
+    - 明示的に無効化する場合は invalidate(family_id) を呼ぶ
+    """
+
+    def __init__(self, ttl_seconds=300, max_families=1000, watch=False, loader=None, version_loader=None,
+                 version_check_seconds=30, clock=time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_families = max_families
+        self.watch = watch
+        self.version_check_seconds = version_check_seconds
+        self._loader = loader or fetch_family_member_tokens
+        self._version_loader = version_loader or fetch_family_members_version
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # family_id -> (members, loaded_at, version, checked_at)
+        self._watches = {}  # family_id -> on_snapshot の Watch
+        # 計測用カウンター（すべて _lock の中で更新する）
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.watch_updates = 0
+
+    @property
+    def enabled(self):
+        return self.ttl_seconds > 0 and self.max_families > 0
+
+    def get(self, family_id):
+        """
+        キャッシュ済みのメンバー一覧を返す（なければ、またはバージョンが変わっていればFirestoreから読み込む）
+        """
+        if not self.enabled:
+            return self._loader(family_id)
+
+        version = None
+        with self._lock:
+            entry = self._entries.get(family_id)
+            now = self._clock()
+            watching = self._watches.get(family_id) is not None
+            if entry is not None and (watching or now - entry[1] < self.ttl_seconds):
+                if watching or now - entry[3] < self.version_check_seconds:
+                    self._entries.move_to_end(family_id)
+                    self.hits += 1
+                    return list(entry[0])
+            else:
+                entry = None
+
+        if entry is not None:
+            version = self._version_loader(family_id)
+            with self._lock:
+                current = self._entries.get(family_id)
+                if current is not None and current[2] == version:
+                    self._entries[family_id] = (current[0], current[1], version, self._clock())
+                    self._entries.move_to_end(family_id)
+                    self.hits += 1
+                    return list(current[0])
+                self.stale += 1
+
+        with self._lock:
+            self.misses += 1
+        # バージョンを先に読む（読み込みの途中で変更された場合は古いバージョンで保存され、次回読み込み直す）
+        if version is None:
+            version = self._version_loader(family_id)
+        members = self._loader(family_id)
+        self._store(family_id, members, version)
+        if self.watch:
+            self._start_watch(family_id)
+        return list(members)
+
+    def _store(self, family_id, members, version):
+        evicted = []
+        with self._lock:
+            now = self._clock()
+            self._entries[family_id] = (members, now, version, now)
+            self._entries.move_to_end(family_id)
+            while len(self._entries) > self.max_families:
+                evicted_id, _ = self._entries.popitem(last=False)
+                evicted.append(self._watches.pop(evicted_id, None))
+                self.evictions += 1
+        for watch in evicted:
+            if watch is not None:
+                watch.unsubscribe()
+
+    def _start_watch(self, family_id):
+        with self._lock:
+            if family_id in self._watches or family_id not in self._entries:
+                return
+            # 先に場所を確保して二重登録を防ぐ
+            self._watches[family_id] = None
+
+        def on_snapshot(docs, changes, read_time):
+            members = members_from_docs(family_id, docs)
+            with self._lock:
+                self.watch_updates += 1
+                entry = self._entries.get(family_id)
+                if entry is not None:
+                    now = self._clock()
+                    self._entries[family_id] = (members, now, entry[2], now)
+
+        try:
+            watch = get_db().collection(f'family-management/{family_id}/members').on_snapshot(on_snapshot)
+        except Exception as e:
+            logger.warning("⚠️ メンバー監視の開始に失敗: %s: %s", family_id, e)
+            with self._lock:
+                self._watches.pop(family_id, None)
+            return
+
+        with self._lock:
+            if family_id in self._watches:
+                self._watches[family_id] = watch
+                return
+        # 登録中に追い出された場合は監視を止める
+        watch.unsubscribe()
+
+    def invalidate(self, family_id=None):
+        """
+        指定ファミリー（省略時は全ファミリー）のキャッシュを破棄する
+        """
+        with self._lock:
+            family_ids = [family_id] if family_id is not None else list(self._entries)
+            watches = []
+            for fid in family_ids:
+                self._entries.pop(fid, None)
+                watches.append(self._watches.pop(fid, None))
+        for watch in watches:
+            if watch is not None:
+                watch.unsubscribe()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'evictions': self.evictions,
+                'watch_updates': self.watch_updates,
+                'families': len(self._entries),
+                'watching': len(self._watches)
+            }
+
+# メンバーのデバイストークンキャッシュ（インスタンス内で共有）
+member_token_cache = MemberTokenCache(
+    ttl_seconds=float(os.environ.get('MEMBER_CACHE_TTL_SECONDS', 300)),
+    max_families=int(os.environ.get('MEMBER_CACHE_MAX_FAMILIES', 1000)),
+    watch=os.environ.get('MEMBER_CACHE_WATCH', 'false').lower() == 'true',
+    # 同じインスタンスでの変更は invalidate で即時に反映される。別インスタンスでの変更はこの秒数まで遅れて反映される
+    # （0 にするとキャッシュを返すたびにバージョンのドキュメントを1件読んで確認する）
+    version_check_seconds=float(os.environ.get('MEMBER_CACHE_VERSION_CHECK_SECONDS', 30))
+)
+
+def load_family_member_tokens(family_id):
+    """
+    ファミリーメンバー全員のデバイストークンを取得（達成者の除外はしない）
+    """
+    return member_token_cache.get(family_id)
+
+def invalidate_family_member_tokens(family_id=None):
+    """
+    メンバーの追加・更新・削除を知ったときに呼び出すキャッシュ無効化フック
+    """
+    member_token_cache.invalidate(family_id)
+
 def get_family_member_device_tokens(family_id, exclude_member_id=None):
     """
     ファミリーメンバーのデバイストークンを取得（自分以外）
     """
     try:
-        collection_path = f'family-management/{family_id}/members'
-        print(f"🔧 Firestoreコレクションパス: {collection_path}")
-        docs = db.collection(collection_path).stream()
-        
         device_tokens = []
-        for doc in docs:
-            doc_data = doc.to_dict()
-            member_id = doc.id
-            
-            print(f"  - メンバー確認: {member_id} (除外対象: {exclude_member_id})")
+        for member in load_family_member_tokens(family_id):
+            member_id = member['memberId']
+            logger.debug("  - メンバー確認: %s (除外対象: %s)", member_id, exclude_member_id)
             
             # 自分以外のメンバーのデバイストークンを取得
             if exclude_member_id is None or member_id != exclude_member_id:
-                if 'deviceToken' in doc_data and doc_data['deviceToken']:
-                    device_tokens.append({
-                        'memberId': member_id,
-                        'name': doc_data.get('name', 'Unknown'),
-                        'deviceToken': doc_data['deviceToken']
-                    })
-                    print(f"    ✅ 追加: {doc_data.get('name', 'Unknown')} ({member_id})")
-                else:
-                    print(f"    ❌ デバイストークンなし: {doc_data.get('name', 'Unknown')} ({member_id})")
+                device_tokens.append(member)
+                logger.debug("    ✅ 追加: %s (%s)", member['name'], member_id)
             else:
-                print(f"    ⏭️ 除外: {doc_data.get('name', 'Unknown')} ({member_id}) - 達成者")
+                logger.debug("    ⏭️ 除外: %s (%s) - 達成者", member['name'], member_id)
         
-        print(f"🔧 ファミリーメンバーのデバイストークン取得:")
-        print(f"  - family_id: {family_id}")
-        print(f"  - exclude_member_id: {exclude_member_id}")
-        print(f"  - found_tokens: {len(device_tokens)}")
+        logger.debug("🔧 ファミリーメンバーのデバイストークン取得: family_id=%s, exclude_member_id=%s, found_tokens=%s",
+                     family_id, exclude_member_id, len(device_tokens))
         
         return device_tokens
     
     except Exception as e:
-        print(f"❌ デバイストークン取得エラー: {e}")
+        logger.error("❌ デバイストークン取得エラー: %s", e)
         return []
 
-def create_jwt_token():
+class APNsTokenProvider:
     """
-    APNs用のJWTトークンを作成
+    APNs用プロバイダートークン（JWT）をキャッシュして払い出す
+    - プライベートキーはインスタンスごとに一度だけ読み込み・デコードする
+    - 署名済みトークンは refresh_seconds の間使い回す（APNsは20〜60分を推奨）
+    - 複数スレッドから同時に要求されても再署名は一度だけ行う
+    - 払い出し（キャッシュから / 再署名）は metrics の apns_provider_tokens_total に数える
     """
-    try:
-        print(f"🔧 JWTトークン作成開始:")
-        print(f"  - PRIVATE_KEY_PATH: {PRIVATE_KEY_PATH}")
-        print(f"  - TEAM_ID: {TEAM_ID}")
-        print(f"  - KEY_ID: {KEY_ID}")
-        
-        # 環境変数の確認
-        if not PRIVATE_KEY_PATH:
-            print("❌ PRIVATE_KEY_PATHが設定されていません")
-            return None
-        if not TEAM_ID:
-            print("❌ TEAM_IDが設定されていません")
-            return None
-        if not KEY_ID:
-            print("❌ KEY_IDが設定されていません")
-            return None
-        
+
+    MIN_REFRESH_SECONDS = 20 * 60
+    MAX_REFRESH_SECONDS = 60 * 60
+
+    def __init__(self, key_path, team_id, key_id, refresh_seconds=50 * 60, clock=time.time, metrics=None):
+        self.key_path = key_path
+        self.team_id = team_id
+        self.key_id = key_id
+        # APNsが許容する範囲に丸める
+        self.refresh_seconds = min(max(int(refresh_seconds), self.MIN_REFRESH_SECONDS), self.MAX_REFRESH_SECONDS)
+        self._clock = clock
+        self._metrics = metrics
+        self._lock = threading.Lock()  # 鍵の読み込みと再署名
+        self._key = None
+        # (署名済みトークン, 発行時刻)。1回の代入で入れ替え、トークンと発行時刻の組み合わせがずれないようにする
+        self._cached = None
+        # 計測用カウンター（すべて _counter_lock の中で更新する）
+        self._counter_lock = threading.Lock()
+        self.hits = 0
+        self.refreshes = 0
+        self.key_loads = 0
+
+    def _load_key(self):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.backends import default_backend
+
         # プライベートキーを読み込み
-        with open(PRIVATE_KEY_PATH, 'r') as key_file:
+        with open(self.key_path, 'r') as key_file:
             private_key = key_file.read()
-            print(f"  - プライベートキー読み込み成功: {len(private_key)}文字")
-        
+            logger.debug("  - プライベートキー読み込み成功: %s文字", len(private_key))
+
         # プライベートキーをデコード
         key = serialization.load_pem_private_key(
             private_key.encode('utf-8'),
             password=None,
             backend=default_backend()
         )
-        print("  - プライベートキーデコード成功")
-        
-        # JWTペイロードを作成
-        current_time = int(time.time())
-        payload = {
-            'iss': TEAM_ID,
-            'iat': current_time
-        }
-        print(f"  - JWTペイロード作成: {payload}")
-        
-        # JWTトークンを生成
-        token = jwt.encode(
-            payload,
-            key,
-            algorithm='ES256',
-            headers={
-                'kid': KEY_ID,
-                'alg': 'ES256'
+        with self._counter_lock:
+            self.key_loads += 1
+        logger.debug("  - プライベートキーデコード成功")
+        return key
+
+    def _fresh_token(self, now):
+        cached = self._cached
+        if cached is not None and now - cached[1] < self.refresh_seconds:
+            return cached[0]
+        return None
+
+    def _record(self, result):
+        """
+        トークンの払い出しを数える（result: hit / refresh）
+        """
+        with self._counter_lock:
+            if result == 'hit':
+                self.hits += 1
+            else:
+                self.refreshes += 1
+        if self._metrics is not None:
+            self._metrics.inc('apns_provider_tokens_total', result=result)
+
+    def get_token(self):
+        """
+        有効なJWTトークンを返す（期限切れの場合のみ再署名）
+        """
+        token = self._fresh_token(self._clock())
+        if token is not None:
+            self._record('hit')
+            return token
+
+        with self._lock:
+            # ロック待ちの間に他のスレッドが更新していれば、それを使う
+            now = self._clock()
+            token = self._fresh_token(now)
+            if token is not None:
+                self._record('hit')
+                return token
+
+            logger.debug("🔧 JWTトークン作成開始: PRIVATE_KEY_PATH=%s, TEAM_ID=%s, KEY_ID=%s",
+                         self.key_path, self.team_id, self.key_id)
+
+            if self._key is None:
+                started = time.perf_counter()
+                self._key = self._load_key()
+                record_init_timing('apns_key_load_ms', started)
+
+            # JWTペイロードを作成
+            issued_at = int(now)
+            payload = {
+                'iss': self.team_id,
+                'iat': issued_at
             }
-        )
-        
-        print(f"  - JWTトークン生成成功: {len(token)}文字")
-        return token
-    
+            logger.debug("  - JWTペイロード作成: %s", payload)
+
+            # JWTトークンを生成
+            import jwt
+            token = jwt.encode(
+                payload,
+                self._key,
+                algorithm='ES256',
+                headers={
+                    'kid': self.key_id,
+                    'alg': 'ES256'
+                }
+            )
+            logger.debug("  - JWTトークン生成成功: %s文字", len(token))
+
+            self._cached = (token, issued_at)
+            self._record('refresh')
+            return token
+
+    def invalidate(self):
+        """
+        キャッシュ済みトークンを破棄する（APNsが ExpiredProviderToken を返した場合など）
+        """
+        with self._lock:
+            self._cached = None
+
+    def stats(self):
+        cached = self._cached
+        with self._counter_lock:
+            return {
+                'hits': self.hits,
+                'refreshes': self.refreshes,
+                'key_loads': self.key_loads,
+                'refresh_seconds': self.refresh_seconds,
+                'token_age_seconds': int(self._clock() - cached[1]) if cached is not None else None
+            }
+
+# JWTトークンプロバイダー（インスタンス内で共有）
+token_provider = APNsTokenProvider(
+    PRIVATE_KEY_PATH,
+    TEAM_ID,
+    KEY_ID,
+    refresh_seconds=int(os.environ.get('APNS_TOKEN_REFRESH_SECONDS', 50 * 60)),
+    metrics=metrics
+)
+
+def create_jwt_token():
+    """
+    APNs用のJWTトークンを取得（キャッシュ済みのものを優先して使う）
+    """
+    try:
+        # 環境変数の確認
+        if not PRIVATE_KEY_PATH:
+            logger.error("❌ PRIVATE_KEY_PATHが設定されていません")
+            return None
+        if not TEAM_ID:
+            logger.error("❌ TEAM_IDが設定されていません")
+            return None
+        if not KEY_ID:
+            logger.error("❌ KEY_IDが設定されていません")
+            return None
+
+        return token_provider.get_token()
+
     except FileNotFoundError as e:
-        print(f"❌ プライベートキーファイルが見つかりません: {e}")
+        logger.error("❌ プライベートキーファイルが見つかりません: %s", e)
         return None
     except Exception as e:
-        print(f"❌ JWTトークン作成エラー: {e}")
-        print(f"  - エラータイプ: {type(e).__name__}")
-        import traceback
-        print(f"  - スタックトレース: {traceback.format_exc()}")
+        logger.exception("❌ JWTトークン作成エラー（%s）: %s", type(e).__name__, e)
         return None
 
-def send_push_notification(device_token, title, body, badge=None, sound="default"):
+class APNsClient:
+    """
+    APNs向けの常駐HTTP/2クライアント
+    - 最初の送信時に httpx.AsyncClient を作成し、以降はインスタンス内で使い回す
+    - 送信は run_async のイベントループ上で行い、1本のHTTP/2接続上で複数のストリームを多重化する
+    - 接続を確立できなかった場合（ConnectError / ConnectTimeout）だけ1回再送する
+      GOAWAY で処理されなかったストリームは httpcore が新しい接続で送り直す
+    - 送信後の読み書きエラーは APNs に届いた可能性があるため再送しない（重複通知を防ぐ）
+    - テストでは base_url / transport を差し替えてローカルのスタブサーバーに向けられる
+    """
+
+    def __init__(self, base_url=None, http1=True, http2=True, timeout=30.0, connect_timeout=10.0,
+                 max_connections=10, max_keepalive_connections=5, keepalive_expiry=None,
+                 transport=None, verify=True):
+        self.base_url = base_url or APNS_URL
+        self.http1 = http1
+        self.http2 = http2
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.transport = transport
+        self.verify = verify
+        self._client = None
+        # 計測用カウンター（イベントループのスレッドだけが更新する）
+        self.requests = 0
+        self.connects = 0
+        self.retries = 0
+
+    @staticmethod
+    def retryable_errors():
+        """
+        リクエストを送る前に失敗したことが確実なエラー（再送しても重複しない）
+        """
+        import httpx
+        return (
+            httpx.ConnectError,
+            httpx.ConnectTimeout,
+        )
+
+    def _create_client(self):
+        import httpx
+        # 注意: APNsはHTTP/2のみをサポートするため、http2=Trueが必要
+        # ローカルのh2cスタブに向ける場合は http1=False（prior knowledge）を指定する
+        return httpx.AsyncClient(
+            http1=self.http1,
+            http2=self.http2,
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            transport=self.transport,
+            verify=self.verify
+        )
+
+    def get_client(self):
+        """
+        共有クライアントを返す（未作成なら作成）
+        イベントループのスレッドからだけ呼ばれるため、ロックは不要
+        """
+        if self._client is None:
+            started = time.perf_counter()
+            self._client = self._create_client()
+            record_init_timing('apns_client_ms', started)
+            self.connects += 1
+            logger.debug("🔧 APNsクライアント作成: %s (http2=%s)", self.base_url, self.http2)
+        return self._client
+
+    async def post(self, device_token, headers, payload):
+        """
+        デバイストークン宛てに通知を送信する（接続を確立できなかった場合だけ1回再送）
+        PoolTimeout はそのまま送出する（他の送信が使っている共有クライアントは作り直さない）
+        """
+        url = f"{self.base_url}{device_token}"
+        retryable_errors = self.retryable_errors()
+        client = self.get_client()
+        for attempt in range(2):
+            try:
+                self.requests += 1
+                return await client.post(url, headers=headers, json=payload)
+            except retryable_errors as e:
+                if attempt == 1:
+                    raise
+                logger.warning("⚠️ APNs接続エラー（%s）: %s - 再送します", type(e).__name__, e)
+                self.retries += 1
+
+    async def _close(self):
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+    def close(self):
+        if self._client is not None:
+            run_async(self._close())
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'connects': self.connects,
+            'retries': self.retries,
+            'connected': self._client is not None
+        }
+
+# APNsクライアント（インスタンス内で共有）
+apns_client = APNsClient(
+    timeout=float(os.environ.get('APNS_TIMEOUT', 30.0)),
+    connect_timeout=float(os.environ.get('APNS_CONNECT_TIMEOUT', 10.0)),
+    max_connections=int(os.environ.get('APNS_MAX_CONNECTIONS', 10)),
+    max_keepalive_connections=int(os.environ.get('APNS_MAX_KEEPALIVE_CONNECTIONS', 5))
+)
+
+def parse_apns_reason(response):
+    """
+    APNsのエラーレスポンスから reason（BadDeviceToken など）を取り出す
+    """
+    try:
+        return response.json().get('reason')
+    except Exception:
+        return None
+
+def send_error_result(error):
+    """
+    送信時の例外を送信結果に変換する
+    - unsent: APNs に届いていないことが確実（再送してよい）
+    - delivery_unknown: リクエストを書き込んだ後に失敗した（届いた可能性があるため再送しない）
+    """
+    import httpx
+    if isinstance(error, httpx.PoolTimeout):
+        # 接続プールの空き待ちで時間切れ（リクエストは送っていない）
+        return {"success": False, "error": f"APNs接続プールの空き待ちが時間切れ: {error}",
+                "reason": "PoolTimeout", "unsent": True}
+    if isinstance(error, APNsClient.retryable_errors()):
+        return {
+            "success": False,
+            "error": f"HTTP/2接続エラー: {error}",
+            "reason": "ConnectionError",
+            "unsent": True,
+            "note": "APNsはHTTP/2のみをサポートします。httpx[http2]の依存関係を確認してください。"
+        }
+    if isinstance(error, (httpx.ReadError, httpx.WriteError, httpx.RemoteProtocolError,
+                          httpx.ReadTimeout, httpx.WriteTimeout)):
+        logger.warning("⚠️ APNs送信結果が不明（%s）: %s", type(error).__name__, error)
+        return {"success": False, "error": f"APNsの応答を受け取れませんでした: {error}",
+                "reason": "DeliveryUnknown", "delivery_unknown": True}
+    return {"success": False, "error": f"HTTP/2送信エラー: {error}", "reason": "InternalError"}
+
+def send_push_notification(device_token, title, body, badge=None, sound="default", collapse_id=None):
+    """
+    APNsプッシュ通知を1件送信し、結果を待つ
+    """
+    return run_async(send_push_notification_async(device_token, title, body, badge, sound, collapse_id))
+
+async def send_push_notification_async(device_token, title, body, badge=None, sound="default", collapse_id=None):
     """
     APNsプッシュ通知を送信（HTTP/2対応）
+    collapse_id を指定すると、同じIDの通知は端末上で積み重ならずに置き換えられる
     """
     try:
-        # デバッグ情報を出力
-        print(f"🔧 デバッグ情報:")
-        print(f"  - APNS_URL: {APNS_URL}")
-        print(f"  - BUNDLE_ID: {BUNDLE_ID}")
-        print(f"  - TEAM_ID: {TEAM_ID}")
-        print(f"  - KEY_ID: {KEY_ID}")
-        print(f"  - DEVICE_TOKEN: {device_token[:20]}...{device_token[-20:]}")
+        # デバッグ情報を出力（デバイストークンは先頭のみ）
+        logger.debug("🔧 APNs送信: APNS_URL=%s, BUNDLE_ID=%s, DEVICE_TOKEN=%s...",
+                     apns_client.base_url, BUNDLE_ID, device_token[:8])
         
         # JWTトークンを取得
         jwt_token = create_jwt_token()
         if not jwt_token:
-            print("❌ JWTトークンの作成に失敗しました")
-            return {"success": False, "error": "JWTトークンの作成に失敗しました"}
-        
-        print(f"  - JWTトークン取得成功: {len(jwt_token)}文字")
+            logger.error("❌ JWTトークンの作成に失敗しました")
+            return {"success": False, "error": "JWTトークンの作成に失敗しました", "reason": "ProviderTokenUnavailable",
+                    "unsent": True}
         
         # ヘッダーを設定
         headers = {
@@ -161,8 +687,11 @@ def send_push_notification(device_token, title, body, badge=None, sound="default
             'apns-topic': BUNDLE_ID,
             'Content-Type': 'application/json'
         }
+        if collapse_id:
+            headers['apns-collapse-id'] = collapse_id
         
-        print(f"  - Headers: {headers}")
+        # Authorization（JWT）はログに出さない
+        logger.debug("  - Headers: %s", {k: v for k, v in headers.items() if k != 'Authorization'})
         
         # ペイロードを作成
         payload = {
@@ -177,38 +706,15 @@ def send_push_notification(device_token, title, body, badge=None, sound="default
             }
         }
         
-        print(f"  - Payload: {payload}")
+        logger.debug("  - Payload: %s", payload)
         
-        # HTTP/2でリクエストを送信
-        url = f"{APNS_URL}{device_token}"
-        print(f"  - Request URL: {url}")
-        
-        # httpxクライアントを作成
-        # 注意: APNsはHTTP/2のみをサポートするため、http2=Trueが必要
-        # ただし、依存関係の問題がある場合は一時的にhttp2=Falseでテスト可能
+        # HTTP/2でリクエストを送信（共有クライアントの接続を再利用）
         try:
-            with httpx.Client(
-                http2=True, 
-                timeout=30.0,
-                limits=httpx.Limits(max_keepalive_connections=5, max_connections=10)
-            ) as client:
-                response = client.post(
-                    url,
-                    headers=headers,
-                    json=payload
-                )
+            response = await apns_client.post(device_token, headers, payload)
         except Exception as http2_error:
-            # HTTP/2が利用できない場合のエラーハンドリング
-            return {
-                "success": False,
-                "error": f"HTTP/2接続エラー: {str(http2_error)}",
-                "note": "APNsはHTTP/2のみをサポートします。httpx[http2]の依存関係を確認してください。"
-            }
+            return send_error_result(http2_error)
         
-        print(f"  - Response Status: {response.status_code}")
-        print(f"  - Response Protocol: {response.http_version}")
-        print(f"  - Response Headers: {dict(response.headers)}")
-        print(f"  - Response Body: {response.text}")
+        logger.debug("  - Response: %s %s %s", response.http_version, response.status_code, response.text)
         
         if response.status_code == 200:
             return {
@@ -218,9 +724,15 @@ def send_push_notification(device_token, title, body, badge=None, sound="default
                 "protocol": response.http_version
             }
         else:
+            reason = parse_apns_reason(response)
+            if response.status_code == 403 and reason == 'ExpiredProviderToken':
+                # 次の送信で新しいトークンを署名する
+                token_provider.invalidate()
             return {
                 "success": False,
                 "error": f"プッシュ通知の送信に失敗しました: {response.status_code}",
+                "status_code": response.status_code,
+                "reason": reason,
                 "response": response.text,
                 "protocol": response.http_version,
                 "debug_info": {
@@ -234,10 +746,273 @@ def send_push_notification(device_token, title, body, badge=None, sound="default
     except Exception as e:
         return {
             "success": False,
-            "error": f"エラーが発生しました: {str(e)}"
+            "error": f"エラーが発生しました: {str(e)}",
+            "reason": "InternalError"
         }
 
-def send_push_notifications_to_family(family_id, exclude_member_id, title, body, badge=None, sound="default"):
+async def _send_to_member(token_info, title, body, badge, sound, collapse_id=None):
+    """
+    1件分の送信を行い、結果と所要時間（ミリ秒）を返す
+    """
+    started = time.perf_counter()
+    result = await send_push_notification_async(
+        token_info['deviceToken'], 
+        title, 
+        body, 
+        badge, 
+        sound,
+        collapse_id
+    )
+    return {
+        'memberId': token_info['memberId'],
+        'name': token_info['name'],
+        'deviceToken': token_info['deviceToken'],
+        'result': result,
+        'latency_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+
+def _deadline_item(token_info, result):
+    return {
+        'memberId': token_info['memberId'],
+        'name': token_info['name'],
+        'deviceToken': token_info['deviceToken'],
+        'result': result,
+        'latency_ms': None
+    }
+
+def _record_late_send(task):
+    """
+    締め切り後に完了した送信の結果をメトリクスに記録する
+    """
+    if task.cancelled() or task.exception() is not None:
+        return
+    item = task.result()
+    logger.debug("🔧 締め切り後に送信完了: %s (%s) success=%s",
+                 item['name'], item['memberId'], item['result'].get('success', False))
+    record_send_metrics(item)
+
+async def _run_push_sends(sends, concurrency, deadline):
+    import asyncio
+
+    semaphore = asyncio.Semaphore(concurrency)
+    started = [False] * len(sends)
+
+    async def send_one(i, send):
+        async with semaphore:
+            started[i] = True
+            return await _send_to_member(*send)
+
+    tasks = [asyncio.ensure_future(send_one(i, send)) for i, send in enumerate(sends)]
+    await asyncio.wait(tasks, timeout=deadline)
+
+    results = []
+    for i, (send, task) in enumerate(zip(sends, tasks)):
+        token_info = send[0]
+        if task.done():
+            results.append(task.result())
+        elif started[i]:
+            # APNs に送信中のものは止めずに完了させる（届いている可能性があるため失敗にも再送対象にもしない）
+            task.add_done_callback(_record_late_send)
+            logger.warning("⚠️ 送信期限超過（送信中）: %s (%s)", token_info['name'], token_info['memberId'])
+            results.append(_deadline_item(token_info, {
+                "success": False,
+                "error": f"送信期限（{deadline}秒）までに APNs の応答がありませんでした",
+                "reason": "InFlight",
+                "in_flight": True
+            }))
+        else:
+            # まだ送っていないものは取り消す（再送してよい）
+            task.cancel()
+            logger.warning("⚠️ 送信期限超過（未送信）: %s (%s)", token_info['name'], token_info['memberId'])
+            results.append(_deadline_item(token_info, {
+                "success": False,
+                "error": f"送信期限（{deadline}秒）を超過しました",
+                "reason": "DeadlineExceeded",
+                "timed_out": True,
+                "unsent": True
+            }))
+    return results
+
+def run_push_sends(sends, concurrency=None, deadline=None):
+    """
+    送信ジョブ (token_info, title, body, badge, sound[, collapse_id]) のリストを並行して処理する
+    - 送信は共有APNsクライアント（httpx.AsyncClient）のHTTP/2接続上で多重化される
+    - concurrency: 同時送信数の上限（1の場合は1件ずつ送信）
+    - deadline: 全体の締め切り（秒）。締め切りまでに送り始めなかった送信は取り消して未送信（再送対象）とし、
+      送信中のものは in_flight として結果を待たずに返す（完了時にメトリクスだけ記録する）
+    結果はジョブと同じ順序で返す
+    """
+    concurrency = FANOUT_CONCURRENCY if concurrency is None else concurrency
+    deadline = FANOUT_DEADLINE_SECONDS if deadline is None else deadline
+
+    results = run_async(_run_push_sends(sends, max(concurrency, 1), deadline)) if sends else []
+    record_push_metrics(results)
+    return results
+
+def count_send_results(results):
+    """
+    送信結果を (成功, 失敗, 送信中) の件数に数える
+    送信中（in_flight）は APNs に届いている可能性があるため失敗に含めない
+    """
+    sent = sum(1 for result in results if result.get('success', False))
+    in_flight = sum(1 for result in results if result.get('in_flight'))
+    return sent, len(results) - sent - in_flight, in_flight
+
+def record_send_metrics(item):
+    """
+    1件の送信結果（失敗は reason 別）と所要時間を記録する
+    """
+    result = item['result']
+    if result.get('success'):
+        metrics.inc('apns_sends_total', result='success')
+    else:
+        metrics.inc('apns_sends_total', result='failure')
+        reason = result.get('reason') or (f"HTTP{result['status_code']}" if result.get('status_code') else 'Unknown')
+        metrics.inc('apns_failures_total', reason=reason)
+    if item.get('latency_ms') is not None:
+        metrics.observe('apns_send_duration_ms', item['latency_ms'])
+
+def record_push_metrics(results):
+    """
+    1回のファンアウトの送信件数と、送信ごとの結果・所要時間を記録する
+    送信中（in_flight）のものは完了時に記録する
+    """
+    metrics.observe('apns_fanout_size', len(results), COUNT_BUCKETS)
+    for item in results:
+        if not item['result'].get('in_flight'):
+            record_send_metrics(item)
+
+def fan_out_push_notifications(device_tokens, title, body, badge=None, sound="default",
+                               concurrency=None, deadline=None, collapse_id=None):
+    """
+    複数のデバイスへ同じ通知を並行して送信する
+    """
+    sends = [(token_info, title, body, badge, sound, collapse_id) for token_info in device_tokens]
+    return run_push_sends(sends, concurrency=concurrency, deadline=deadline)
+
+# 無効になったデバイストークンを示すAPNsの reason（すぐに削除する）
+DEAD_TOKEN_REASONS = {'Unregistered'}
+# BadDeviceToken はトークンの環境（sandbox / production）と送信先が違うだけでも返る。
+# 登録時の環境（メンバーの apnsEnvironment）が送信先と同じ場合だけすぐに削除し、わからない・違う場合は
+# DEAD_TOKEN_STRIKES 回続けて返ったら削除する（途中で送信に成功すれば数え直す）
+# DeviceTokenNotForTopic は BUNDLE_ID の設定の誤りでも返るため、トークンは削除しない
+SUSPECT_TOKEN_REASONS = {'BadDeviceToken'}
+DEAD_TOKEN_STRIKES = int(os.environ.get('DEAD_TOKEN_STRIKES', 3))
+
+# これまでに削除した無効トークンの数（インスタンス内）
+def token_action(result, member):
+    """
+    送信結果からメンバーのトークンに行う処理
+    'prune'（削除）/ 'strike'（BadDeviceToken の回数を数える）/ 'reset'（回数を戻す）/ None（何もしない）
+    """
+    if result.get('success', False):
+        return 'reset' if member.get('badTokenStrikes') else None
+    if result.get('status_code') == 410 or result.get('reason') in DEAD_TOKEN_REASONS:
+        return 'prune'
+    if result.get('reason') in SUSPECT_TOKEN_REASONS:
+        if member.get('apnsEnvironment') == APNS_ENVIRONMENT:
+            return 'prune'
+        if (member.get('badTokenStrikes') or 0) + 1 >= DEAD_TOKEN_STRIKES:
+            return 'prune'
+        return 'strike'
+    return None
+
+def collect_token_actions(results, members):
+    """
+    送信結果を、同じトークンを持つメンバーごとの処理 [(メンバー, 処理)] にする
+    """
+    results_by_token = {r['deviceToken']: r['result'] for r in results}
+    actions = {}
+    for member in members:
+        result = results_by_token.get(member['deviceToken'])
+        action = token_action(result, member) if result is not None else None
+        if action:
+            actions[(member['familyId'], member['memberId'])] = (member, action)
+    return list(actions.values())
+
+def prune_dead_tokens(results, members):
+    """
+    送信結果に応じて、無効なデバイストークンをメンバードキュメントからまとめて削除する
+    （BadDeviceToken の回数の記録と、送信に成功したメンバーの回数のリセットも同じバッチで書く）
+    - 読み込み後にトークンが更新されたメンバーは対象外（更新時刻を前提条件にする）
+    - 1回のバッチ書き込みで削除し、前提条件エラーの場合のみ1件ずつ書き直す
+    - 削除した件数は metrics の apns_pruned_tokens_total（reason: APNs の reason、なければステータスコード）に数える
+    戻り値: 削除した件数
+    """
+    if not PRUNE_DEAD_TOKENS or not results:
+        return 0
+    targets = collect_token_actions(results, members)
+    if not targets:
+        return 0
+
+    from google.cloud import firestore
+    db = get_db()
+
+    def write(batch, member, action):
+        doc_ref = db.collection(f"family-management/{member['familyId']}/members").document(member['memberId'])
+        option = db.write_option(last_update_time=member['updateTime']) if member.get('updateTime') else None
+        if action == 'prune':
+            field_updates = {'deviceToken': firestore.DELETE_FIELD, 'badTokenStrikes': firestore.DELETE_FIELD}
+        elif action == 'strike':
+            field_updates = {'badTokenStrikes': firestore.Increment(1)}
+        else:
+            field_updates = {'badTokenStrikes': firestore.DELETE_FIELD}
+        batch.update(doc_ref, field_updates, option=option)
+
+    def bump_versions(batch, chunk):
+        # メンバー一覧のETag（management-family の collection-meta）を進める
+        # （別のインスタンスのキャッシュも読み込み直し、次の書き込みの前提条件が新しい更新時刻になる）
+        for family_id in {member['familyId'] for member, _ in chunk}:
+            batch.set(
+                db.document(f'family-management/{family_id}/collection-meta/members'),
+                {'version': firestore.Increment(1)},
+                merge=True
+            )
+
+    reasons = {r['deviceToken']: r['result'].get('reason') or str(r['result'].get('status_code')) for r in results}
+    written = {'prune': 0, 'strike': 0, 'reset': 0}
+
+    def record(member, action):
+        written[action] += 1
+        if action == 'prune':
+            metrics.inc('apns_pruned_tokens_total', reason=reasons[member['deviceToken']])
+
+    # バージョン更新の書き込み分を残しておく
+    chunk_size = FIRESTORE_BATCH_LIMIT // 2
+    for start in range(0, len(targets), chunk_size):
+        chunk = targets[start:start + chunk_size]
+        batch = db.batch()
+        for member, action in chunk:
+            write(batch, member, action)
+        bump_versions(batch, chunk)
+        try:
+            batch.commit()
+            for member, action in chunk:
+                record(member, action)
+        except Exception as e:
+            logger.warning("⚠️ 無効トークンの一括削除に失敗: %s - 1件ずつ削除します", e)
+            for member, action in chunk:
+                batch = db.batch()
+                write(batch, member, action)
+                bump_versions(batch, [(member, action)])
+                try:
+                    batch.commit()
+                    record(member, action)
+                except Exception as member_error:
+                    logger.debug("  - 削除スキップ: %s: %s", member['memberId'], member_error)
+
+    # 書き込んだメンバーがキャッシュから古いまま返らないようにする
+    for family_id in {member['familyId'] for member, _ in targets}:
+        invalidate_family_member_tokens(family_id)
+
+    pruned = written['prune']
+    add_log_fields(token_strikes=written['strike'])
+    logger.info("🧹 無効なデバイストークンを削除: %s件, BadDeviceToken の記録: %s件, リセット: %s件",
+                pruned, written['strike'], written['reset'])
+    return pruned
+
+def send_push_notifications_to_family(family_id, exclude_member_id, title, body, badge=None, sound="default",
+                                      concurrency=None, deadline=None, collapse_id=None):
     """
     ファミリーメンバー全員にプッシュ通知を送信（自分以外）
     """
@@ -252,44 +1027,40 @@ def send_push_notifications_to_family(family_id, exclude_member_id, title, body,
                 "sent_count": 0
             }
         
-        # 各デバイストークンに通知を送信
-        success_count = 0
-        failed_count = 0
-        results = []
-        
-        print(f"🔧 プッシュ通知送信開始:")
-        print(f"  - 送信対象数: {len(device_tokens)}")
-        print(f"  - 通知タイトル: {title}")
-        print(f"  - 通知本文: {body}")
-        
-        for i, token_info in enumerate(device_tokens):
-            print(f"  - 送信 {i+1}/{len(device_tokens)}: {token_info['name']} ({token_info['memberId']})")
-            print(f"    - デバイストークン: {token_info['deviceToken'][:20]}...{token_info['deviceToken'][-20:]}")
-            result = send_push_notification(
-                token_info['deviceToken'], 
-                title, 
-                body, 
-                badge, 
-                sound
-            )
-            
-            if result.get('success', False):
-                success_count += 1
-            else:
-                failed_count += 1
-            
-            results.append({
-                'memberId': token_info['memberId'],
-                'name': token_info['name'],
-                'result': result
-            })
+        logger.debug("🔧 プッシュ通知送信開始: 送信対象数=%s, タイトル=%s, 本文=%s", len(device_tokens), title, body)
+        
+        # 各デバイストークンに並行して通知を送信
+        started = time.perf_counter()
+        results = fan_out_push_notifications(
+            device_tokens,
+            title,
+            body,
+            badge,
+            sound,
+            concurrency=concurrency,
+            deadline=deadline,
+            collapse_id=collapse_id
+        )
+        duration_ms = round((time.perf_counter() - started) * 1000, 1)
+        
+        success_count, failed_count, in_flight_count = count_send_results([r['result'] for r in results])
+        
+        # APNsが無効と返したトークンをメンバーから削除
+        pruned_count = prune_dead_tokens(results, device_tokens)
+        
+        # デバイストークンはレスポンスに含めない
+        for r in results:
+            r.pop('deviceToken', None)
         
         return {
             "success": True,
             "message": f"プッシュ通知送信完了: 成功 {success_count}件, 失敗 {failed_count}件",
             "sent_count": success_count,
             "failed_count": failed_count,
+            "in_flight_count": in_flight_count,
             "total_count": len(device_tokens),
+            "pruned_count": pruned_count,
+            "duration_ms": duration_ms,
             "results": results
         }
     
@@ -299,7 +1070,578 @@ def send_push_notifications_to_family(family_id, exclude_member_id, title, body,
             "error": f"ファミリー通知送信エラー: {str(e)}"
         }
 
+def build_goal_notification(member_name, goal_title):
+    """
+    目標達成通知のタイトルと本文を作成
+    """
+    title = "🎉 目標達成！"
+    body = f"{member_name}が「{goal_title}」を達成しました！"
+    return title, body
+
+def build_goal_summary_notification(member_name, goal_titles):
+    """
+    短時間に続けて達成された目標をまとめた通知のタイトルと本文を作成
+    """
+    if len(goal_titles) == 1:
+        return build_goal_notification(member_name, goal_titles[0])
+    title = "🎉 目標達成！"
+    body = f"{member_name}が{len(goal_titles)}個の目標を達成しました！（最新:「{goal_titles[-1]}」）"
+    return title, body
+
+def goal_collapse_id(family_id, member_id):
+    """
+    達成者ごとの apns-collapse-id（APNsの上限64バイトに収まるようハッシュ化）
+    """
+    return 'goal-' + hashlib.sha1(f'{family_id}/{member_id}'.encode('utf-8')).hexdigest()
+
+class NotificationCoalescer:
+    """
+    同じ達成者（familyId, memberId）の目標達成通知を一定時間まとめて送る
+    - ウィンドウ外の通知はすぐに送信し、そこから window_seconds の空のウィンドウを開く
+    - ウィンドウ内に続いた通知はアウトボックスのジョブ（nextAttemptAt = ウィンドウの終了時刻）に溜め、
+      ウィンドウ終了後に「N個達成」の1通にまとめて送信する（N はすぐに送った通知も含めたウィンドウ内の件数）
+    - まとめたジョブは、同じ達成者の次の通知の受付時か、アウトボックスのドレインで送信される
+      （ウィンドウの状態はアウトボックスに保存するため、インスタンスが止まっても失われない）
+    - どちらも同じ apns-collapse-id で送るため、端末上では通知が置き換えられる
+    """
+
+    def __init__(self, window_seconds, send=None, store=None):
+        self.window_seconds = window_seconds
+        self._send = send or send_push_notifications_to_family
+        self._store = store
+        self._lock = threading.Lock()
+        # 計測用カウンター
+        self.events = 0
+        self.sends = 0
+        self.coalesced = 0
+        self.flushed = 0
+
+    def _outbox(self):
+        return self._store if self._store is not None else outbox
+
+    def submit(self, family_id, member_id, member_name, goal_title):
+        """
+        達成イベントを受け付ける（ウィンドウ外なら即送信、ウィンドウ内なら次のまとめ送信に回す）
+        """
+        collapse_id = goal_collapse_id(family_id, member_id)
+        state = self._outbox().coalesce(collapse_id, {
+            'familyId': family_id,
+            'memberId': member_id,
+            'memberName': member_name,
+            'goalTitle': goal_title,
+            'goalTitles': [goal_title],
+            'collapseId': collapse_id
+        }, self.window_seconds)
+
+        if state['coalesced']:
+            with self._lock:
+                self.events += 1
+                self.coalesced += 1
+            return {
+                "success": True,
+                "coalesced": True,
+                "jobId": state['jobId'],
+                "pending_count": state['pendingCount'],
+                "message": f"{self.window_seconds}秒以内の通知はまとめて送信されます"
+            }
+
+        with self._lock:
+            self.events += 1
+            self.sends += 1
+        if state.get('dueJobId'):
+            # 終わったウィンドウに溜まっていた通知を先に送る（ドレインを待たない）
+            if flush_outbox_job(state['dueJobId'], self._outbox()):
+                with self._lock:
+                    self.flushed += 1
+
+        title, body = build_goal_notification(member_name, goal_title)
+        return self._send(family_id, member_id, title, body, None, "default", collapse_id=collapse_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'events': self.events,
+                'sends': self.sends,
+                'coalesced': self.coalesced,
+                'flushed': self.flushed
+            }
+
+# 目標達成通知のまとめ送信（COALESCE_WINDOW_SECONDS が0なら無効）
+coalescer = NotificationCoalescer(COALESCE_WINDOW_SECONDS) if COALESCE_WINDOW_SECONDS > 0 else None
+
+# メンバー情報の読み込みに使うスレッドプール（インスタンス内で共有）
+member_load_executor = ThreadPoolExecutor(max_workers=max(FANOUT_CONCURRENCY, 1), thread_name_prefix='member-load')
+
+def load_members_for_families(family_ids, concurrency=None):
+    """
+    複数ファミリーのメンバーのデバイストークンをまとめて取得（ファミリーごとに1回だけ読み込む）
+    戻り値: {family_id: [token_info, ...]}（取得に失敗したファミリーは例外を値に持つ）
+    """
+    family_ids = list(dict.fromkeys(family_ids))
+    concurrency = FANOUT_CONCURRENCY if concurrency is None else concurrency
+
+    def load(family_id):
+        try:
+            return load_family_member_tokens(family_id)
+        except Exception as e:
+            logger.error("❌ デバイストークン取得エラー: %s: %s", family_id, e)
+            return e
+
+    if concurrency <= 1 or len(family_ids) <= 1:
+        return {family_id: load(family_id) for family_id in family_ids}
+
+    return dict(zip(family_ids, member_load_executor.map(load, family_ids)))
+
+def deliver_goal_notifications(notifications, concurrency=None, deadline=None):
+    """
+    複数ファミリー分の目標達成通知をまとめて送信し、通知ごとの送信結果を返す
+    - メンバー情報はファミリーごとに1回だけ読み込む
+    - 同じデバイストークン・同じ内容の通知は1回だけ送信する
+    - 全ての送信を1つの共有APNsクライアントで並行して処理する
+    - notification['skipMemberIds'] に含まれるメンバーには送信しない（再送時に使用）
+    戻り値: (通知ごとの {'error', 'outcomes': [(memberId, result), ...]} のリスト, 実送信結果のリスト, 統計)
+    """
+    members_by_family = load_members_for_families(n['familyId'] for n in notifications)
+
+    sends = []
+    send_index = {}  # (deviceToken, title, body, collapseId) -> sends内の位置
+    item_plans = []  # 各通知の (memberId, sends内の位置) のリスト
+    item_errors = {}
+    for i, notification in enumerate(notifications):
+        members = members_by_family.get(notification['familyId'])
+        if isinstance(members, Exception):
+            item_errors[i] = f"デバイストークン取得エラー: {members}"
+            item_plans.append([])
+            continue
+
+        if notification.get('goalTitles'):
+            # まとめ送信のジョブ（NotificationCoalescer）
+            title, body = build_goal_summary_notification(notification['memberName'], notification['goalTitles'])
+        else:
+            title, body = build_goal_notification(notification['memberName'], notification['goalTitle'])
+        collapse_id = notification.get('collapseId')
+        skip_member_ids = set(notification.get('skipMemberIds') or [])
+        plan = []
+        for member in members:
+            if member['memberId'] == notification['memberId'] or member['memberId'] in skip_member_ids:
+                continue
+            key = (member['deviceToken'], title, body, collapse_id)
+            if key not in send_index:
+                send_index[key] = len(sends)
+                sends.append((member, title, body, None, "default", collapse_id))
+            plan.append((member['memberId'], send_index[key]))
+        item_plans.append(plan)
+
+    requested_count = sum(len(plan) for plan in item_plans)
+    logger.debug("🔧 一括通知送信開始: 通知 %s件, ファミリー %s件, 送信 %s件 (重複除外 %s件)",
+                 len(notifications), len(members_by_family), len(sends), requested_count - len(sends))
+
+    results = run_push_sends(sends, concurrency=concurrency, deadline=deadline)
+
+    # APNsが無効と返したトークンを、同じトークンを持つ全メンバーから削除
+    loaded_members = [
+        member
+        for members in members_by_family.values() if not isinstance(members, Exception)
+        for member in members
+    ]
+    pruned_count = prune_dead_tokens(results, loaded_members)
+
+    items = [
+        {
+            'error': item_errors.get(i),
+            'outcomes': [(member_id, results[p]['result']) for member_id, p in plan]
+        }
+        for i, plan in enumerate(item_plans)
+    ]
+    stats = {
+        'family_count': len(members_by_family),
+        'deduplicated_count': requested_count - len(sends),
+        'pruned_count': pruned_count
+    }
+    return items, results, stats
+
+def send_goal_notifications_batch(notifications, concurrency=None, deadline=None):
+    """
+    複数ファミリー分の目標達成通知をまとめて送信し、コンパクトな集計を返す
+    """
+    started = time.perf_counter()
+    delivered, results, stats = deliver_goal_notifications(notifications, concurrency, deadline)
+
+    items = []
+    for i, (notification, delivery) in enumerate(zip(notifications, delivered)):
+        sent, failed, in_flight = count_send_results([result for _, result in delivery['outcomes']])
+        item = {
+            'index': i,
+            'familyId': notification['familyId'],
+            'memberId': notification['memberId'],
+            'sent_count': sent,
+            'failed_count': failed,
+            'in_flight_count': in_flight
+        }
+        if delivery['error']:
+            item['error'] = delivery['error']
+        items.append(item)
+
+    success_count, failed_count, in_flight_count = count_send_results([r['result'] for r in results])
+    return {
+        "success": True,
+        "message": f"一括通知送信完了: 成功 {success_count}件, 失敗 {failed_count}件",
+        "item_count": len(notifications),
+        "family_count": stats['family_count'],
+        "sent_count": success_count,
+        "failed_count": failed_count,
+        "in_flight_count": in_flight_count,
+        "deduplicated_count": stats['deduplicated_count'],
+        "pruned_count": stats['pruned_count'],
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        "items": items
+    }
+
+# ===== 通知アウトボックス =====
+# 送信要求をキューに書き込んで即座にレスポンスを返し、
+# 別のエントリーポイント（drain_notification_outbox）でまとめて送信する
+
+# 再送すれば成功する可能性があるAPNsのステータスコード
+RETRYABLE_STATUS_CODES = {429, 500, 503}
+
+def is_retryable_result(result):
+    """
+    送信結果が一時的な失敗（再送対象）かどうかを判定
+    APNs に届いた可能性がある失敗（delivery_unknown など）は重複通知を避けるため再送しない
+    """
+    if result.get('success', False):
+        return False
+    if result.get('unsent') or result.get('timed_out'):
+        return True
+    return result.get('status_code') in RETRYABLE_STATUS_CODES
+
+def outbox_backoff_seconds(attempts):
+    """
+    再送までの待ち時間（指数バックオフ、上限あり）
+    """
+    return min(OUTBOX_BACKOFF_BASE_SECONDS * (2 ** max(attempts - 1, 0)), OUTBOX_BACKOFF_MAX_SECONDS)
+
+def new_outbox_job(job, now, not_before=None):
+    """
+    アウトボックスに保存するジョブ（not_before を指定するとその時刻まで送信しない）
+    """
+    return dict(job, status='pending', attempts=0, createdAt=now,
+                nextAttemptAt=now if not_before is None else not_before,
+                deliveredMemberIds=[], lastError=None)
+
+def is_open_job(job):
+    """
+    まだ一度も取得されていない送信待ちのジョブか（まとめ送信で通知を追加してよいか）
+    """
+    return job is not None and job.get('status') == 'pending' and not job.get('attempts')
+
+class FirestoreOutbox:
+    """
+    Firestoreのコレクションに通知ジョブを保存するアウトボックス
+    ジョブは nextAttemptAt を先に進めることで取得（リース）し、
+    ドレインが途中で落ちてもリース期限が過ぎれば再び取得対象になる
+    """
+
+    def __init__(self, collection_path='notification-outbox'):
+        self.collection_path = collection_path
+
+    def enqueue(self, job, not_before=None):
+        doc_ref = get_db().collection(self.collection_path).add(new_outbox_job(job, time.time(), not_before))
+        return doc_ref[1].id
+
+    def _lease(self, snapshot, now, lease_seconds):
+        """
+        他のドレインが先に取得していないことを更新時刻で確認してからリースする
+        """
+        data = snapshot.to_dict()
+        try:
+            snapshot.reference.update(
+                {'nextAttemptAt': now + lease_seconds, 'attempts': data.get('attempts', 0) + 1},
+                option=get_db().write_option(last_update_time=snapshot.update_time)
+            )
+        except Exception as e:
+            logger.debug("⏭️ ジョブ取得競合: %s: %s", snapshot.id, e)
+            return None
+        data['attempts'] = data.get('attempts', 0) + 1
+        return snapshot.id, data
+
+    def claim_due(self, limit, lease_seconds):
+        now = time.time()
+        query = (
+            get_db().collection(self.collection_path)
+            .where('status', '==', 'pending')
+            .where('nextAttemptAt', '<=', now)
+            .order_by('nextAttemptAt')
+            .limit(limit)
+        )
+        claimed = [self._lease(snapshot, now, lease_seconds) for snapshot in query.stream()]
+        return [job for job in claimed if job is not None]
+
+    def claim(self, job_id, lease_seconds):
+        """
+        送信期限が来ている指定のジョブを取得する（取得できなければ None）
+        """
+        now = time.time()
+        snapshot = get_db().collection(self.collection_path).document(job_id).get()
+        if not snapshot.exists:
+            return None
+        data = snapshot.to_dict()
+        if data.get('status') != 'pending' or data.get('nextAttemptAt', 0) > now:
+            return None
+        return self._lease(snapshot, now, lease_seconds)
+
+    def coalesce(self, key, job, window_seconds):
+        """
+        まとめ送信のウィンドウ（{collection}-coalesce/{key}）を確認し、トランザクションで次のどちらかを行う
+        - ウィンドウ内: job の目標を送信待ちのジョブに追加する（なければ nextAttemptAt をウィンドウの終了時刻にして作る）
+          ジョブの goalTitles にはウィンドウを開いたときにすぐ送った目標も含める
+          （まとめた通知は同じ apns-collapse-id で最初の通知を置き換えるため）
+          戻り値: {'coalesced': True, 'jobId', 'pendingCount'}（pendingCount はまだ送っていない目標の数）
+        - ウィンドウ外: job の目標をすぐ送る前提で新しいウィンドウを開く。
+          前のウィンドウに送信待ちのジョブが残っていれば dueJobId で返す
+          戻り値: {'coalesced': False, 'dueJobId'}
+        """
+        from google.cloud import firestore
+
+        db = get_db()
+        jobs = db.collection(self.collection_path)
+        window_ref = db.collection(self.collection_path + '-coalesce').document(key)
+
+        @firestore.transactional
+        def run(transaction):
+            now = time.time()
+            window_snapshot = window_ref.get(transaction=transaction)
+            window = window_snapshot.to_dict() if window_snapshot.exists else None
+            pending_ref, pending = None, None
+            if window and window.get('jobId'):
+                pending_ref = jobs.document(window['jobId'])
+                pending_snapshot = pending_ref.get(transaction=transaction)
+                pending = pending_snapshot.to_dict() if pending_snapshot.exists else None
+            if not is_open_job(pending):
+                pending_ref, pending = None, None
+
+            if window and now < window['windowEndsAt']:
+                sent_titles = window.get('goalTitles') or []
+                if pending is not None:
+                    titles = pending['goalTitles'] + job['goalTitles']
+                    transaction.update(pending_ref, {'goalTitles': titles, 'goalTitle': titles[-1],
+                                                     'memberName': job['memberName']})
+                    return {'coalesced': True, 'jobId': pending_ref.id,
+                            'pendingCount': len(titles) - len(sent_titles)}
+                job_ref = jobs.document()
+                titles = sent_titles + job['goalTitles']
+                transaction.set(job_ref, new_outbox_job(dict(job, goalTitles=titles), now,
+                                                        not_before=window['windowEndsAt']))
+                transaction.update(window_ref, {'jobId': job_ref.id})
+                return {'coalesced': True, 'jobId': job_ref.id, 'pendingCount': len(job['goalTitles'])}
+
+            transaction.set(window_ref, {'windowEndsAt': now + window_seconds, 'jobId': None,
+                                         'goalTitles': job['goalTitles']})
+            return {'coalesced': False, 'dueJobId': pending_ref.id if pending_ref is not None else None}
+
+        return run(db.transaction())
+
+    def complete(self, job_id, delivered_member_ids):
+        get_db().collection(self.collection_path).document(job_id).update({
+            'status': 'sent',
+            'sentAt': time.time(),
+            'deliveredMemberIds': delivered_member_ids
+        })
+
+    def retry(self, job_id, delivered_member_ids, error, next_attempt_at):
+        get_db().collection(self.collection_path).document(job_id).update({
+            'deliveredMemberIds': delivered_member_ids,
+            'lastError': error,
+            'nextAttemptAt': next_attempt_at
+        })
+
+    def give_up(self, job_id, delivered_member_ids, error):
+        get_db().collection(self.collection_path).document(job_id).update({
+            'status': 'failed',
+            'deliveredMemberIds': delivered_member_ids,
+            'lastError': error
+        })
+
+class LocalOutbox:
+    """
+    プロセス内のキューを使うアウトボックス（ローカル検証・単一インスタンス用）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._windows = {}  # key -> {'windowEndsAt', 'jobId', 'goalTitles'}
+        self._next_id = 0
+
+    def _add(self, job, now, not_before=None):
+        self._next_id += 1
+        job_id = f"local-{self._next_id}"
+        self._jobs[job_id] = new_outbox_job(job, now, not_before)
+        return job_id
+
+    def enqueue(self, job, not_before=None):
+        with self._lock:
+            return self._add(job, time.time(), not_before)
+
+    def _lease(self, job_id, now, lease_seconds):
+        job = self._jobs[job_id]
+        job['nextAttemptAt'] = now + lease_seconds
+        job['attempts'] += 1
+        return job_id, dict(job)
+
+    def claim_due(self, limit, lease_seconds):
+        now = time.time()
+        with self._lock:
+            due = sorted(
+                (job_id for job_id, job in self._jobs.items()
+                 if job['status'] == 'pending' and job['nextAttemptAt'] <= now),
+                key=lambda job_id: self._jobs[job_id]['nextAttemptAt']
+            )[:limit]
+            return [self._lease(job_id, now, lease_seconds) for job_id in due]
+
+    def claim(self, job_id, lease_seconds):
+        now = time.time()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != 'pending' or job['nextAttemptAt'] > now:
+                return None
+            return self._lease(job_id, now, lease_seconds)
+
+    def coalesce(self, key, job, window_seconds):
+        now = time.time()
+        with self._lock:
+            window = self._windows.get(key)
+            pending_id = window and window['jobId']
+            if not is_open_job(self._jobs.get(pending_id)):
+                pending_id = None
+
+            if window and now < window['windowEndsAt']:
+                if pending_id is not None:
+                    pending = self._jobs[pending_id]
+                    pending['goalTitles'] = pending['goalTitles'] + job['goalTitles']
+                    pending.update(goalTitle=pending['goalTitles'][-1], memberName=job['memberName'])
+                    return {'coalesced': True, 'jobId': pending_id,
+                            'pendingCount': len(pending['goalTitles']) - len(window['goalTitles'])}
+                titles = window['goalTitles'] + job['goalTitles']
+                window['jobId'] = self._add(dict(job, goalTitles=titles), now, not_before=window['windowEndsAt'])
+                return {'coalesced': True, 'jobId': window['jobId'], 'pendingCount': len(job['goalTitles'])}
+
+            self._windows[key] = {'windowEndsAt': now + window_seconds, 'jobId': None,
+                                  'goalTitles': list(job['goalTitles'])}
+            return {'coalesced': False, 'dueJobId': pending_id}
+
+    def complete(self, job_id, delivered_member_ids):
+        with self._lock:
+            self._jobs[job_id].update(status='sent', sentAt=time.time(), deliveredMemberIds=delivered_member_ids)
+
+    def retry(self, job_id, delivered_member_ids, error, next_attempt_at):
+        with self._lock:
+            self._jobs[job_id].update(deliveredMemberIds=delivered_member_ids, lastError=error,
+                                      nextAttemptAt=next_attempt_at)
+
+    def give_up(self, job_id, delivered_member_ids, error):
+        with self._lock:
+            self._jobs[job_id].update(status='failed', deliveredMemberIds=delivered_member_ids, lastError=error)
+
+    def pending_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['status'] == 'pending')
+
+# 通知アウトボックス（OUTBOX_BACKEND=local でプロセス内キューを使用）
+outbox = LocalOutbox() if OUTBOX_BACKEND == 'local' else FirestoreOutbox(OUTBOX_COLLECTION)
+
+def drain_outbox_once(limit=None):
+    """
+    送信期限が来たジョブを1バッチ分取得して送信する
+    - 送信済みのメンバーは記録し、再送時には送らない
+    - 一時的な失敗が残ったジョブは指数バックオフで再送予約する
+    - 最大試行回数に達したジョブは failed にする
+    """
+    limit = OUTBOX_BATCH_SIZE if limit is None else limit
+    return process_outbox_jobs(outbox.claim_due(limit, OUTBOX_LEASE_SECONDS))
+
+def flush_outbox_job(job_id, store=None):
+    """
+    送信期限が来ている指定のジョブをすぐに送信する（他のドレインが取得済みなら何もしない）
+    store を省略するとインスタンス共通の outbox を使う
+    失敗しても、ジョブはリース期限後にドレインで再び取得される
+    """
+    store = outbox if store is None else store
+    try:
+        claimed = store.claim(job_id, OUTBOX_LEASE_SECONDS)
+        if claimed is None:
+            return False
+        process_outbox_jobs([claimed], store)
+        return True
+    except Exception as e:
+        logger.error("❌ まとめ通知の送信エラー: %s: %s", job_id, e)
+        return False
+
+def process_outbox_jobs(claimed, store=None):
+    """
+    取得したジョブ [(job_id, job), ...] を送信し、結果に応じて store（省略時は outbox）の
+    ジョブを完了・再送予約・破棄にする
+    """
+    store = outbox if store is None else store
+    summary = {'claimed': len(claimed), 'sent': 0, 'retried': 0, 'failed': 0}
+    if not claimed:
+        return summary
+
+    notifications = [
+        dict(job, skipMemberIds=job.get('deliveredMemberIds') or [])
+        for _, job in claimed
+    ]
+    delivered, _, _ = deliver_goal_notifications(notifications)
+
+    for (job_id, job), delivery in zip(claimed, delivered):
+        delivered_member_ids = list(job.get('deliveredMemberIds') or [])
+        retryable_errors = []
+        if delivery['error']:
+            retryable_errors.append(delivery['error'])
+        for member_id, result in delivery['outcomes']:
+            if result.get('success', False) or result.get('in_flight') or result.get('delivery_unknown'):
+                # 届いた可能性があるメンバーにも再送時には送らない（重複通知を防ぐ）
+                delivered_member_ids.append(member_id)
+            elif is_retryable_result(result):
+                retryable_errors.append(f"{member_id}: {result.get('error')}")
+
+        try:
+            if not retryable_errors:
+                store.complete(job_id, delivered_member_ids)
+                summary['sent'] += 1
+            elif job['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+                logger.error("❌ 通知ジョブを破棄: %s (試行 %s回): %s", job_id, job['attempts'], retryable_errors)
+                store.give_up(job_id, delivered_member_ids, '; '.join(retryable_errors))
+                summary['failed'] += 1
+            else:
+                next_attempt_at = time.time() + outbox_backoff_seconds(job['attempts'])
+                store.retry(job_id, delivered_member_ids, '; '.join(retryable_errors), next_attempt_at)
+                summary['retried'] += 1
+        except Exception as e:
+            # 状態の更新に失敗してもリース期限後に再取得される
+            logger.error("❌ 通知ジョブの状態更新エラー: %s: %s", job_id, e)
+
+    return summary
+
+def drain_outbox(limit=None, time_budget=None):
+    """
+    キューが空になるか時間切れになるまでバッチ送信を繰り返す
+    """
+    time_budget = OUTBOX_DRAIN_TIME_BUDGET_SECONDS if time_budget is None else time_budget
+    started = time.perf_counter()
+    total = {'claimed': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'batches': 0}
+    while time.perf_counter() - started < time_budget:
+        summary = drain_outbox_once(limit)
+        if not summary['claimed']:
+            break
+        total['batches'] += 1
+        for key in ('claimed', 'sent', 'retried', 'failed'):
+            total[key] += summary[key]
+    total['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return total
+
 @functions_framework.http
+@log_request
 def send_apns_push(request):
 
     # CORSヘッダーを設定
@@ -328,10 +1670,13 @@ def send_apns_push(request):
         
         # プッシュ通知を送信
         result = send_push_notification(device_token, title, body, badge, sound)
+        record_push_metrics([{'result': result, 'latency_ms': None}])
+        add_log_fields(sent=result.get('success', False), apns_status=result.get('status_code'))
         
         return (json.dumps(result, ensure_ascii=False), 200, headers)
     
     except Exception as e:
+        logger.exception("❌ 関数実行エラー: %s", e)
         error_result = {
             "success": False,
             "error": f"関数実行エラー: {str(e)}"
@@ -339,6 +1684,7 @@ def send_apns_push(request):
         return (json.dumps(error_result, ensure_ascii=False), 500, headers)
 
 @functions_framework.http
+@log_request
 def send_family_goal_notification(request):
     """
     目標達成時にファミリーメンバーにプッシュ通知を送信
@@ -375,18 +1721,38 @@ def send_family_goal_notification(request):
         if not family_id or not member_id:
             return (json.dumps({"error": "familyId and memberId are required"}), 400, headers)
         
+        add_log_fields(family_id=family_id, member_id=member_id)
+        
+        # アウトボックスモードではジョブを積んで即座に返す
+        if NOTIFICATION_MODE == 'outbox':
+            job_id = outbox.enqueue({
+                'familyId': family_id,
+                'memberId': member_id,
+                'memberName': member_name,
+                'goalTitle': goal_title
+            })
+            add_log_fields(queued=True, job_id=job_id)
+            result = {
+                "success": True,
+                "queued": True,
+                "jobId": job_id,
+                "message": "通知を送信キューに登録しました"
+            }
+            return (json.dumps(result, ensure_ascii=False), 200, headers)
+        
+        # まとめ送信が有効な場合は、同じ達成者の連続した通知を1通にまとめる
+        if coalescer is not None:
+            result = coalescer.submit(family_id, member_id, member_name, goal_title)
+            add_log_fields(coalesced=result.get('coalesced', False))
+            return (json.dumps(result, ensure_ascii=False), 200, headers)
+        
         # 通知の内容を設定
-        title = "🎉 目標達成！"
-        body = f"{member_name}が「{goal_title}」を達成しました！"
+        title, body = build_goal_notification(member_name, goal_title)
         badge = None  # バッジは動的に管理
         sound = "default"
         
-        print(f"🔧 目標達成通知送信デバッグ:")
-        print(f"  - family_id: {family_id}")
-        print(f"  - member_id (達成者): {member_id}")
-        print(f"  - member_name: {member_name}")
-        print(f"  - goal_title: {goal_title}")
-        print(f"  - exclude_member_id: {member_id} (達成者を除外)")
+        logger.debug("🔧 目標達成通知: family_id=%s, member_id(達成者・除外)=%s, member_name=%s, goal_title=%s",
+                     family_id, member_id, member_name, goal_title)
         
         # ファミリーメンバーに通知を送信
         result = send_push_notifications_to_family(
@@ -397,13 +1763,119 @@ def send_family_goal_notification(request):
             badge, 
             sound
         )
+        add_log_fields(
+            sent_count=result.get('sent_count'),
+            failed_count=result.get('failed_count'),
+            pruned_count=result.get('pruned_count'),
+            fanout_ms=result.get('duration_ms')
+        )
+        
+        return (json.dumps(result, ensure_ascii=False), 200, headers)
+    
+    except Exception as e:
+        logger.exception("❌ 関数実行エラー: %s", e)
+        error_result = {
+            "success": False,
+            "error": f"関数実行エラー: {str(e)}"
+        }
+        return (json.dumps(error_result, ensure_ascii=False), 500, headers)
+
+
+@functions_framework.http
+@log_request
+def send_family_goal_notifications_batch(request):
+    """
+    複数ファミリー分の目標達成通知を1リクエストでまとめて送信
+    リクエスト例: {"notifications": [{"familyId": ..., "memberId": ..., "memberName": ..., "goalTitle": ...}, ...]}
+    """
+    # CORSヘッダーを設定
+    if request.method == 'OPTIONS':
+        headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Max-Age': '3600'
+        }
+        return ('', 204, headers)
+    
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Content-Type': 'application/json'
+    }
+    
+    try:
+        if request.method != 'POST':
+            return (json.dumps({"error": "POST method only"}), 405, headers)
+        
+        data = request.get_json(silent=True)
+        if not data:
+            return (json.dumps({"error": "No JSON payload provided"}), 400, headers)
+        
+        raw_notifications = data.get('notifications')
+        if not isinstance(raw_notifications, list) or not raw_notifications:
+            return (json.dumps({"error": "notifications must be a non-empty list"}), 400, headers)
+        if len(raw_notifications) > MAX_BATCH_NOTIFICATIONS:
+            return (json.dumps({"error": f"notifications must not exceed {MAX_BATCH_NOTIFICATIONS} items"}), 400, headers)
+        
+        notifications = []
+        for i, item in enumerate(raw_notifications):
+            if not isinstance(item, dict) or not item.get('familyId') or not item.get('memberId'):
+                return (json.dumps({"error": f"notifications[{i}]: familyId and memberId are required"}), 400, headers)
+            notifications.append({
+                'familyId': item['familyId'],
+                'memberId': item['memberId'],
+                'memberName': item.get('memberName', 'ファミリーメンバー'),
+                'goalTitle': item.get('goalTitle', '目標')
+            })
+        
+        result = send_goal_notifications_batch(notifications)
+        add_log_fields(
+            item_count=result['item_count'],
+            family_count=result['family_count'],
+            sent_count=result['sent_count'],
+            failed_count=result['failed_count'],
+            deduplicated_count=result['deduplicated_count']
+        )
+        
+        return (json.dumps(result, ensure_ascii=False), 200, headers)
+    
+    except Exception as e:
+        logger.exception("❌ 関数実行エラー: %s", e)
+        error_result = {
+            "success": False,
+            "error": f"関数実行エラー: {str(e)}"
+        }
+        return (json.dumps(error_result, ensure_ascii=False), 500, headers)
+
+@functions_framework.http
+@log_request
+def drain_notification_outbox(request):
+    """
+    アウトボックスに溜まった通知ジョブをまとめて送信（Cloud Schedulerなどから定期実行）
+    """
+    headers = {
+        'Content-Type': 'application/json'
+    }
+    
+    try:
+        if request.method not in ('GET', 'POST'):
+            return (json.dumps({"error": "GET or POST method only"}), 405, headers)
+        
+        limit = request.args.get('limit', type=int)
+        result = drain_outbox(limit=limit)
+        add_log_fields(**{k: result[k] for k in ('claimed', 'sent', 'retried', 'failed', 'batches')})
+        result['success'] = True
         
         return (json.dumps(result, ensure_ascii=False), 200, headers)
     
     except Exception as e:
+        logger.exception("❌ 関数実行エラー: %s", e)
         error_result = {
             "success": False,
             "error": f"関数実行エラー: {str(e)}"
         }
         return (json.dumps(error_result, ensure_ascii=False), 500, headers)
 
+# import 完了までの時間を記録
+startup_report['import_ms'] = round((time.perf_counter() - _import_started) * 1000, 1)
+logger.info('startup', extra={'fields': dict(startup_report)})
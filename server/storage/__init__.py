@@ -0,0 +1,37 @@
+# storage
+#
+# ハンドラーが使うストレージ（Firestore 互換の API）の作成
+#   STORAGE_BACKEND=firestore（既定）: google.cloud.firestore.Client
+#   STORAGE_BACKEND=memory: インメモリの MemoryFirestore（ベンチマーク・負荷試験・ローカル実行用）
+#     MEMORY_STORE_LATENCY_MS / MEMORY_STORE_JITTER_MS で RPC ごとの待ち時間を指定する
+# create_async_client は同じデータを読む非同期クライアント（firestore.AsyncClient 互換、ダッシュボード用）を作成する。
+# 使っている操作の一覧は interface.py を参照。
+
+import os
+
+from .memory import AsyncMemoryFirestore, MemoryFirestore
+
+__all__ = ['AsyncMemoryFirestore', 'MemoryFirestore', 'create_async_client', 'create_client']
+
+
+def create_client(backend=None):
+    backend = backend or os.environ.get('STORAGE_BACKEND', 'firestore')
+    if backend == 'firestore':
+        from google.cloud import firestore
+        return firestore.Client()
+    if backend == 'memory':
+        return MemoryFirestore(
+            latency_ms=float(os.environ.get('MEMORY_STORE_LATENCY_MS', 0)),
+            jitter_ms=float(os.environ.get('MEMORY_STORE_JITTER_MS', 0))
+        )
+    raise ValueError(f'unknown STORAGE_BACKEND: {backend}')
+
+
+def create_async_client(client):
+    """
+    create_client() で作成したクライアントと同じデータを読む非同期クライアント
+    """
+    if isinstance(client, MemoryFirestore):
+        return AsyncMemoryFirestore(client)
+    from google.cloud import firestore
+    return firestore.AsyncClient(project=client.project)
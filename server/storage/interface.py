@@ -0,0 +1,153 @@
+# interface.py
+#
+# ハンドラーが使っているストレージ操作の一覧（google.cloud.firestore.Client の API のうち使っている部分）
+# Firestore の実装は firestore.Client そのもの、インメモリの実装は storage.memory.MemoryFirestore。
+# 新しい操作をハンドラーで使う場合は、ここと MemoryFirestore の両方に追加する。
+
+from typing import Protocol
+
+
+class DocumentSnapshot(Protocol):
+    id: str
+    reference: 'DocumentReference'
+    exists: bool
+    create_time: object
+    update_time: object
+
+    def to_dict(self):
+        """ドキュメントの内容（存在しない場合は None）"""
+
+    def get(self, field_path):
+        """フィールドの値"""
+
+
+class DocumentReference(Protocol):
+    id: str
+    path: str
+
+    def get(self, field_paths=None, transaction=None) -> DocumentSnapshot:
+        """ドキュメントを1件読む"""
+
+    def set(self, document_data, merge=False):
+        """ドキュメントを書き込む（merge=True で既存のフィールドと統合）"""
+
+    def create(self, document_data):
+        """ドキュメントを作成する（既にある場合は AlreadyExists）"""
+
+    def update(self, field_updates, option=None):
+        """フィールドを更新する（ない場合は NotFound）"""
+
+    def delete(self, option=None):
+        """ドキュメントを削除する"""
+
+    def collection(self, collection_id) -> 'CollectionReference':
+        """サブコレクション"""
+
+
+class Query(Protocol):
+    def where(self, field_path=None, op_string=None, value=None, filter=None) -> 'Query':
+        """絞り込み（==, !=, <, <=, >, >=, in, not-in, array-contains）"""
+
+    def order_by(self, field_path, direction='ASCENDING') -> 'Query':
+        """並び替え（__name__ でドキュメントID順）"""
+
+    def select(self, field_paths) -> 'Query':
+        """読み込むフィールドの指定"""
+
+    def start_after(self, document_fields_or_snapshot) -> 'Query':
+        """カーソル（並び替えのフィールドと __name__ の値、またはスナップショット）"""
+
+    def limit(self, count) -> 'Query':
+        """件数の上限"""
+
+    def stream(self, transaction=None):
+        """結果のスナップショットを順に返す"""
+
+    def get(self, transaction=None):
+        """結果のスナップショットのリスト"""
+
+    def on_snapshot(self, callback):
+        """変更を監視する（callback(docs, changes, read_time)、戻り値の unsubscribe() で停止）"""
+
+
+class CollectionReference(Query, Protocol):
+    id: str
+
+    def document(self, document_id=None) -> DocumentReference:
+        """ドキュメント（ID省略時は自動採番）"""
+
+    def add(self, document_data, document_id=None):
+        """ドキュメントを追加する（戻り値は (更新時刻, DocumentReference)）"""
+
+    def list_documents(self):
+        """ドキュメントの参照の一覧（サブコレクションだけを持つドキュメントも含む）"""
+
+
+class WriteBatch(Protocol):
+    def set(self, reference, document_data, merge=False):
+        ...
+
+    def create(self, reference, document_data):
+        ...
+
+    def update(self, reference, field_updates, option=None):
+        ...
+
+    def delete(self, reference, option=None):
+        ...
+
+    def commit(self):
+        """すべての書き込みをアトミックに適用する（前提条件を満たさない場合はすべて失敗）"""
+
+
+class Transaction(WriteBatch, Protocol):
+    """google.cloud.firestore.transactional で実行するトランザクション"""
+
+
+class Client(Protocol):
+    def collection(self, collection_path) -> CollectionReference:
+        ...
+
+    def document(self, document_path) -> DocumentReference:
+        ...
+
+    def batch(self) -> WriteBatch:
+        ...
+
+    def transaction(self) -> Transaction:
+        ...
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        """複数のドキュメントを1回で読む"""
+
+    def write_option(self, **kwargs):
+        """書き込みの前提条件（exists=True/False または last_update_time=...）"""
+
+
+class AsyncQuery(Protocol):
+    """google.cloud.firestore.AsyncClient のクエリ（絞り込み・並び替えは Query と同じ、読み取りはコルーチン）"""
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None) -> 'AsyncQuery':
+        ...
+
+    def order_by(self, field_path, direction='ASCENDING') -> 'AsyncQuery':
+        ...
+
+    def select(self, field_paths) -> 'AsyncQuery':
+        ...
+
+    def limit(self, count) -> 'AsyncQuery':
+        ...
+
+    async def get(self, transaction=None):
+        """結果のスナップショットのリスト"""
+
+    def stream(self, transaction=None):
+        """結果のスナップショットを順に返す（async for で読む）"""
+
+
+class AsyncClient(Protocol):
+    """ダッシュボードで複数のクエリを並行して読むための非同期クライアント"""
+
+    def collection(self, collection_path) -> AsyncQuery:
+        ...
@@ -0,0 +1,733 @@
+# memory.py
+#
+# Firestore のインメモリ実装（ベンチマーク・負荷試験・ローカル実行用）
+# - ハンドラーが使っている範囲の firestore.Client の API を同じ振る舞いで実装する
+#   （前提条件、トランザクションの競合検出、SERVER_TIMESTAMP / Increment / DELETE_FIELD など）
+# - RPC の種類ごとの回数を rpcs に数える
+# - latency_ms / jitter_ms で RPC ごとに待ち時間を入れ、ネットワーク越しの遅延を再現する
+# - AsyncMemoryFirestore は同じデータを firestore.AsyncClient と同じ形（読み取りはコルーチン）で読む
+
+import asyncio
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from google.api_core import exceptions
+from google.cloud.firestore_v1 import transforms
+
+# Firestore と同じ型ごとの並び順（null < bool < 数値 < 時刻 < 文字列 < bytes < 参照 < 配列 < map）
+_TYPE_ORDER = ((type(None), 0), (bool, 1), (int, 2), (float, 2), (datetime, 3), (str, 4), (bytes, 5),
+               (list, 8), (tuple, 8), (dict, 9))
+
+MAX_WRITES_PER_BATCH = 500
+
+
+def _sort_key(value):
+    for value_type, rank in _TYPE_ORDER:
+        if isinstance(value, value_type):
+            if rank == 8:
+                return (rank, tuple(_sort_key(item) for item in value))
+            if rank == 9:
+                return (rank, tuple((key, _sort_key(item)) for key, item in sorted(value.items())))
+            return (rank, value)
+    return (7, id(value))
+
+
+def _copy(value):
+    """保存している値のコピー（dict / list 以外は不変の値なので、そのまま共有する）"""
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _get_field(data, field_path):
+    """ドット区切りのフィールドの値（ない場合は KeyError）"""
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            raise KeyError(field_path)
+        value = value[part]
+    return value
+
+
+def _apply_value(target, key, value, now):
+    """変換（SERVER_TIMESTAMP / DELETE_FIELD / Increment など）を解決して書き込む"""
+    if value is transforms.DELETE_FIELD:
+        target.pop(key, None)
+    elif value is transforms.SERVER_TIMESTAMP:
+        target[key] = now
+    elif isinstance(value, transforms.Increment):
+        current = target.get(key)
+        target[key] = (current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0) + value.value
+    elif isinstance(value, transforms.ArrayUnion):
+        current = list(target.get(key) or [])
+        target[key] = current + [item for item in value.values if item not in current]
+    elif isinstance(value, transforms.ArrayRemove):
+        target[key] = [item for item in (target.get(key) or []) if item not in value.values]
+    elif isinstance(value, dict):
+        target[key] = _resolve(value, now)
+    else:
+        target[key] = _copy(value)
+
+
+def _resolve(data, now):
+    resolved = {}
+    for key, value in data.items():
+        _apply_value(resolved, key, value, now)
+    return resolved
+
+
+def _merge(target, data, now):
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value, now)
+        else:
+            _apply_value(target, key, value, now)
+
+
+def _update(target, field_updates, now):
+    for field_path, value in field_updates.items():
+        parts = field_path.split('.')
+        parent = target
+        for part in parts[:-1]:
+            if not isinstance(parent.get(part), dict):
+                parent[part] = {}
+            parent = parent[part]
+        _apply_value(parent, parts[-1], value, now)
+
+
+class _StoredDocument:
+    # data は書き込みのたびに新しい dict に置き換え、保存後に直接変更しない（スナップショットと共有するため）
+    __slots__ = ('data', 'create_time', 'update_time')
+
+    def __init__(self, data, create_time, update_time):
+        self.data = data
+        self.create_time = create_time
+        self.update_time = update_time
+
+
+class WriteOption:
+    def __init__(self, exists=None, last_update_time=None):
+        self.exists = exists
+        self.last_update_time = last_update_time
+
+
+class WriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None, read_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+
+    def to_dict(self):
+        return _copy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return _copy(_get_field(self._data or {}, field_path))
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other._client is self._client and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __repr__(self):
+        return f'<DocumentReference {self.path}>'
+
+    def collection(self, collection_id):
+        return CollectionReference(self._client, f'{self.path}/{collection_id}')
+
+    def get(self, field_paths=None, transaction=None):
+        self._client._rpc('get')
+        return self._client._snapshot(self, field_paths, transaction)
+
+    def set(self, document_data, merge=False):
+        batch = self._client.batch()
+        batch.set(self, document_data, merge=merge)
+        return batch.commit()[0]
+
+    def create(self, document_data):
+        batch = self._client.batch()
+        batch.create(self, document_data)
+        return batch.commit()[0]
+
+    def update(self, field_updates, option=None):
+        batch = self._client.batch()
+        batch.update(self, field_updates, option=option)
+        return batch.commit()[0]
+
+    def delete(self, option=None):
+        batch = self._client.batch()
+        batch.delete(self, option=option)
+        return batch.commit()[0].update_time
+
+
+class Query:
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    def __init__(self, client, collection_path, filters=(), orders=(), projection=None, start=None, count=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._projection = projection
+        self._start = start
+        self._count = count
+
+    def _copy(self, **changes):
+        fields = dict(filters=self._filters, orders=self._orders, projection=self._projection,
+                      start=self._start, count=self._count)
+        fields.update(changes)
+        return Query(self._client, self._collection_path, **fields)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start=document_fields_or_snapshot)
+
+    def limit(self, count):
+        return self._copy(count=count)
+
+    def _matches(self, doc_id, data):
+        for field_path, op, value in self._filters:
+            if field_path == '__name__':
+                actual = doc_id
+            else:
+                try:
+                    actual = _get_field(data, field_path)
+                except KeyError:
+                    return False
+            if op == '==':
+                ok = actual == value
+            elif op == '!=':
+                ok = actual != value
+            elif op == 'in':
+                ok = actual in value
+            elif op == 'not-in':
+                ok = actual not in value
+            elif op == 'array-contains':
+                ok = isinstance(actual, list) and value in actual
+            elif op == 'array-contains-any':
+                ok = isinstance(actual, list) and any(item in actual for item in value)
+            else:
+                # 範囲の比較は同じ型どうしのみ一致する（Firestore と同じ）
+                left, right = _sort_key(actual), _sort_key(value)
+                if left[0] != right[0]:
+                    return False
+                ok = {'<': left < right, '<=': left <= right, '>': left > right, '>=': left >= right}[op]
+            if not ok:
+                return False
+        return True
+
+    def _effective_orders(self):
+        orders = list(self._orders)
+        # 範囲の絞り込みのフィールドは並び替えの先頭に暗黙で入る
+        if not orders:
+            for field_path, op, _ in self._filters:
+                if op in ('<', '<=', '>', '>=', '!=', 'not-in'):
+                    orders.append((field_path, Query.ASCENDING))
+                    break
+        if not any(field_path == '__name__' for field_path, _ in orders):
+            direction = orders[-1][1] if orders else Query.ASCENDING
+            orders.append(('__name__', direction))
+        return orders
+
+    def _run(self, transaction=None):
+        client = self._client
+        orders = self._effective_orders()
+        with client._lock:
+            rows = []
+            for doc_id, stored in client._children(self._collection_path):
+                if not self._matches(doc_id, stored.data):
+                    continue
+                try:
+                    values = [doc_id if field == '__name__' else _get_field(stored.data, field) for field, _ in orders]
+                except KeyError:
+                    # 並び替えのフィールドがないドキュメントは結果に含まれない
+                    continue
+                rows.append((values, doc_id, stored))
+            read_time = client._now()
+
+        for index in reversed(range(len(orders))):
+            rows.sort(key=lambda row: _sort_key(row[0][index]), reverse=orders[index][1] == Query.DESCENDING)
+
+        if self._start is not None:
+            if isinstance(self._start, DocumentSnapshot):
+                data = self._start._data or {}
+                cursor = [self._start.id if field == '__name__' else _get_field(data, field) for field, _ in orders]
+            else:
+                cursor = [self._start.get(field) for field, _ in orders]
+            cursor_key = [_sort_key(value) for value in cursor]
+
+            def after_cursor(row):
+                for index, (_, direction) in enumerate(orders):
+                    left, right = _sort_key(row[0][index]), cursor_key[index]
+                    if left != right:
+                        return left > right if direction == Query.ASCENDING else left < right
+                return False
+
+            rows = [row for row in rows if after_cursor(row)]
+
+        if self._count is not None:
+            rows = rows[:self._count]
+
+        # スナップショットは読み進めるときに1件ずつ作る（Firestore の stream() と同じく結果全体を持たない）
+        for _, doc_id, stored in rows:
+            reference = DocumentReference(client, f'{self._collection_path}/{doc_id}')
+            data = stored.data
+            if self._projection is not None:
+                data = {}
+                for field_path in self._projection:
+                    if field_path == '__name__':
+                        continue
+                    try:
+                        data[field_path] = _get_field(stored.data, field_path)
+                    except KeyError:
+                        pass
+            if transaction is not None:
+                transaction._record_read(reference.path, stored.update_time)
+            yield DocumentSnapshot(reference, data, stored.create_time, stored.update_time, read_time)
+
+    def stream(self, transaction=None):
+        self._client._rpc('query')
+        yield from self._run(transaction)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+    def on_snapshot(self, callback):
+        return self._client._watch(self, callback)
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, f'{self._collection_path}/{document_id or uuid.uuid4().hex[:20]}')
+
+    def add(self, document_data, document_id=None):
+        reference = self.document(document_id)
+        result = reference.create(document_data)
+        return result.update_time, reference
+
+    def list_documents(self, page_size=None):
+        self._client._rpc('list')
+        prefix = f'{self._collection_path}/'
+        ids = set()
+        with self._client._lock:
+            for path in self._client._docs:
+                if path.startswith(prefix):
+                    ids.add(path[len(prefix):].split('/', 1)[0])
+        return [self.document(doc_id) for doc_id in sorted(ids)]
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference.path, document_data, merge, None))
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference.path, document_data, False, None))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(('update', reference.path, field_updates, False, option))
+
+    def delete(self, reference, option=None):
+        self._writes.append(('delete', reference.path, None, False, option))
+
+    def commit(self):
+        self._client._rpc('commit')
+        results = self._client._apply(self._writes)
+        self._writes = []
+        return results
+
+
+class Transaction(WriteBatch):
+    """
+    google.cloud.firestore.transactional から使うトランザクション
+    読んだドキュメントがコミットまでに変更されていれば Aborted で失敗させ、transactional に再実行させる
+    """
+
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._reads = {}
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _record_read(self, path, update_time):
+        self._reads.setdefault(path, update_time)
+
+    def _clean_up(self):
+        self._writes = []
+        self._reads = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._client._rpc('begin_transaction')
+        self._id = uuid.uuid4().bytes
+
+    def _rollback(self):
+        if self._id is not None:
+            self._client._rpc('rollback')
+        self._clean_up()
+
+    def _commit(self):
+        self._client._rpc('commit')
+        try:
+            return self._client._apply(self._writes, reads=self._reads)
+        finally:
+            self._clean_up()
+
+    def commit(self):
+        return self._commit()
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, DocumentReference):
+            return iter(self._client.get_all([ref_or_query], transaction=self))
+        return ref_or_query.stream(transaction=self)
+
+    def get_all(self, references):
+        return self._client.get_all(references, transaction=self)
+
+
+class BulkWriteStatus:
+    def __init__(self, code=0, message=''):
+        self.code = code
+        self.message = message
+
+
+class BulkWriteResponse:
+    def __init__(self, write_results, status):
+        self.write_results = write_results
+        self.status = status
+
+
+# google.rpc.Code
+_STATUS_CODES = {exceptions.NotFound: 5, exceptions.AlreadyExists: 6, exceptions.FailedPrecondition: 9}
+
+
+class BulkWriteBatch(WriteBatch):
+    """batch_write と同じく、書き込みを1件ずつ独立に適用して結果を返す（アトミックではない）"""
+
+    def commit(self):
+        self._client._rpc('batch_write')
+        write_results, statuses = [], []
+        for write in self._writes:
+            try:
+                write_results.extend(self._client._apply([write]))
+                statuses.append(BulkWriteStatus())
+            except exceptions.GoogleAPICallError as e:
+                write_results.append(WriteResult(None))
+                statuses.append(BulkWriteStatus(_STATUS_CODES.get(type(e), 13), e.message))
+        self._writes = []
+        return BulkWriteResponse(write_results, statuses)
+
+
+class _Watch:
+    def __init__(self, client, query, callback):
+        self._client = client
+        self.query = query
+        self.callback = callback
+
+    def unsubscribe(self):
+        with self._client._lock:
+            if self in self._client._watches:
+                self._client._watches.remove(self)
+
+
+class MemoryFirestore:
+    """
+    firestore.Client の代わりに使うインメモリのストレージ
+
+    latency_ms / jitter_ms: RPC ごとの待ち時間（latency_ms + 0〜jitter_ms のランダムな値）
+    rpc_latency_ms: RPC の種類ごとの待ち時間（例: {'commit': 30}）。指定した種類は latency_ms より優先
+    """
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, rpc_latency_ms=None, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rpc_latency_ms = dict(rpc_latency_ms or {})
+        self.rpcs = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._docs = {}
+        self._watches = []
+        self._last_time = None
+
+    # --- firestore.Client と同じ API ---
+
+    def collection(self, collection_path):
+        return CollectionReference(self, collection_path.strip('/'))
+
+    def document(self, document_path):
+        return DocumentReference(self, document_path.strip('/'))
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def bulk_batch(self):
+        return BulkWriteBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return Transaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        self._rpc('get')
+        for reference in references:
+            yield self._snapshot(reference, field_paths, transaction)
+
+    def write_option(self, **kwargs):
+        return WriteOption(**kwargs)
+
+    def close(self):
+        pass
+
+    # --- ベンチマーク用 ---
+
+    def seed(self, document_path, data):
+        """RPC を数えずにドキュメントを用意する"""
+        now = self._now()
+        with self._lock:
+            self._docs[document_path.strip('/')] = _StoredDocument(_resolve(data, now), now, now)
+
+    def dump(self, prefix=''):
+        """保存されている内容（パス -> データ）"""
+        with self._lock:
+            return {path: _copy(stored.data) for path, stored in self._docs.items() if path.startswith(prefix)}
+
+    def reset_stats(self):
+        self.rpcs = Counter()
+
+    # --- 内部処理 ---
+
+    def _rpc(self, kind):
+        self.rpcs[kind] += 1
+        delay = self.rpc_latency_ms.get(kind, self.latency_ms)
+        if self.jitter_ms:
+            delay += self._random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _now(self):
+        # 更新時刻は前提条件の比較に使うため、必ず増えていくようにする
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            if self._last_time is not None and now <= self._last_time:
+                now = self._last_time + timedelta(microseconds=1)
+            self._last_time = now
+            return now
+
+    def _children(self, collection_path):
+        prefix = f'{collection_path}/'
+        for path, stored in list(self._docs.items()):
+            if path.startswith(prefix) and '/' not in path[len(prefix):]:
+                yield path[len(prefix):], stored
+
+    def _snapshot(self, reference, field_paths, transaction):
+        with self._lock:
+            stored = self._docs.get(reference.path)
+            read_time = self._now()
+        if transaction is not None:
+            transaction._record_read(reference.path, stored.update_time if stored else None)
+        if stored is None:
+            return DocumentSnapshot(reference, None, read_time=read_time)
+        data = stored.data
+        if field_paths is not None:
+            data = {}
+            for field_path in field_paths:
+                try:
+                    data[field_path] = _get_field(stored.data, field_path)
+                except KeyError:
+                    pass
+        return DocumentSnapshot(reference, data, stored.create_time, stored.update_time, read_time)
+
+    def _apply(self, writes, reads=None):
+        if len(writes) > MAX_WRITES_PER_BATCH:
+            raise exceptions.InvalidArgument(f'maximum {MAX_WRITES_PER_BATCH} writes allowed per request')
+        with self._lock:
+            # トランザクションで読んだドキュメントが変わっていれば競合
+            for path, update_time in (reads or {}).items():
+                stored = self._docs.get(path)
+                if (stored.update_time if stored else None) != update_time:
+                    raise exceptions.Aborted(f'Transaction lock timeout / contention on {path}')
+
+            # 前提条件を先にすべて確認し、1件でも満たさなければ何も書き込まない
+            staged = {}
+
+            def current(path):
+                return staged[path] if path in staged else self._docs.get(path)
+
+            now = self._now()
+            for kind, path, data, merge, option in writes:
+                stored = current(path)
+                if option is not None and option.exists is True and stored is None:
+                    raise exceptions.NotFound(f'No document to update: {path}')
+                if option is not None and option.exists is False and stored is not None:
+                    raise exceptions.AlreadyExists(f'Document already exists: {path}')
+                if option is not None and option.last_update_time is not None:
+                    if stored is None or stored.update_time != option.last_update_time:
+                        raise exceptions.FailedPrecondition(f'The update time does not match: {path}')
+                if kind == 'create' and stored is not None:
+                    raise exceptions.AlreadyExists(f'Document already exists: {path}')
+                if kind == 'update' and stored is None:
+                    raise exceptions.NotFound(f'No document to update: {path}')
+
+                if kind == 'delete':
+                    staged[path] = None
+                    continue
+                create_time = stored.create_time if stored is not None else now
+                if kind == 'update' or (kind == 'set' and merge and stored is not None):
+                    new_data = _copy(stored.data)
+                    (_update if kind == 'update' else _merge)(new_data, data, now)
+                else:
+                    new_data = _resolve(data, now)
+                staged[path] = _StoredDocument(new_data, create_time, now)
+
+            for path, stored in staged.items():
+                if stored is None:
+                    self._docs.pop(path, None)
+                else:
+                    self._docs[path] = stored
+            watches = list(self._watches)
+
+        self._notify(watches, {path.rsplit('/', 1)[0] for path in staged})
+        return [WriteResult(now) for _ in writes]
+
+    def _watch(self, query, callback):
+        watch = _Watch(self, query, callback)
+        with self._lock:
+            self._watches.append(watch)
+        self._notify([watch], {query._collection_path})
+        return watch
+
+    def _notify(self, watches, collection_paths):
+        # 監視中のクエリに変更後の結果を渡す（本物と同じく書き込みとは別のスレッドから呼ぶ）
+        for watch in watches:
+            if watch.query._collection_path not in collection_paths:
+                continue
+            docs = list(watch.query._run())
+            read_time = self._now()
+            threading.Thread(target=watch.callback, args=(docs, [], read_time), daemon=True).start()
+
+
+class _AsyncQuery:
+    """Query を AsyncQuery と同じ形で使うためのラッパー（RPC は別スレッドで実行し、待ち時間の間も並行して進む）"""
+
+    def __init__(self, query):
+        self._query = query
+
+    def where(self, *args, **kwargs):
+        return _AsyncQuery(self._query.where(*args, **kwargs))
+
+    def order_by(self, field_path, direction=Query.ASCENDING):
+        return _AsyncQuery(self._query.order_by(field_path, direction=direction))
+
+    def select(self, field_paths):
+        return _AsyncQuery(self._query.select(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return _AsyncQuery(self._query.start_after(document_fields_or_snapshot))
+
+    def limit(self, count):
+        return _AsyncQuery(self._query.limit(count))
+
+    async def get(self, transaction=None):
+        return await asyncio.to_thread(self._query.get)
+
+    async def stream(self, transaction=None):
+        for snapshot in await self.get():
+            yield snapshot
+
+
+class _AsyncDocumentReference:
+    def __init__(self, reference):
+        self._reference = reference
+        self.id = reference.id
+        self.path = reference.path
+
+    def collection(self, collection_id):
+        return _AsyncQuery(self._reference.collection(collection_id))
+
+    async def get(self, field_paths=None, transaction=None):
+        return await asyncio.to_thread(self._reference.get, field_paths)
+
+
+class AsyncMemoryFirestore:
+    """
+    MemoryFirestore のデータを firestore.AsyncClient の代わりに読むクライアント（読み取りのみ）
+    RPC の回数と待ち時間は元の MemoryFirestore のものを使う
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    @property
+    def rpcs(self):
+        return self._client.rpcs
+
+    def collection(self, collection_path):
+        return _AsyncQuery(self._client.collection(collection_path))
+
+    def document(self, document_path):
+        return _AsyncDocumentReference(self._client.document(document_path))
+
+    async def get_all(self, references, field_paths=None, transaction=None):
+        references = [getattr(reference, '_reference', reference) for reference in references]
+        snapshots = await asyncio.to_thread(lambda: list(self._client.get_all(references, field_paths)))
+        for snapshot in snapshots:
+            yield snapshot
+
+    def close(self):
+        pass
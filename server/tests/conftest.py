@@ -0,0 +1,116 @@
+"""
+テスト共通の部品（server/ から python -m pytest で実行する）
+- サービスの main.py を読み込み、Firestore をインメモリの MemoryFirestore に差し替える
+- functions_framework と同じく flask.request を渡してハンドラーを呼ぶ
+"""
+import json
+import logging
+import os
+import sys
+import time
+
+import flask
+import httpx
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (SERVER_DIR, os.path.join(SERVER_DIR, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from common import idempotency  # noqa: E402
+from harness import load_service  # noqa: E402
+from storage import MemoryFirestore  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+_app = flask.Flask('tests')
+
+
+@pytest.fixture(autouse=True)
+def fresh_idempotency_cache(monkeypatch):
+    """
+    冪等キーのキャッシュはプロセス内で共有されるため、テストごとに空にする
+    """
+    monkeypatch.setattr(idempotency, 'idempotency_cache',
+                        idempotency.IdempotencyCache(idempotency.IDEMPOTENCY_CACHE_SECONDS,
+                                                     idempotency.IDEMPOTENCY_CACHE_MAX_KEYS))
+
+
+@pytest.fixture
+def store():
+    return MemoryFirestore()
+
+
+@pytest.fixture
+def load(store):
+    """
+    サービスを読み込み、store を Firestore として使わせる
+    """
+    def load(service):
+        module = load_service(service)
+        module._db = store
+        return module
+    return load
+
+
+@pytest.fixture
+def push(load, monkeypatch):
+    """
+    push-notification サービス（JWT の署名を省き、BUNDLE_ID を設定する）
+    """
+    module = load('push-notification')
+    module.member_token_cache.invalidate()
+    monkeypatch.setattr(module, 'create_jwt_token', lambda: 'jwt')
+    monkeypatch.setattr(module, 'BUNDLE_ID', 'com.example.test')
+    return module
+
+
+def use_apns(push, monkeypatch, handle):
+    """
+    handle(request)（通常の関数か async の関数）が応答する APNs のスタンドインに送信先を向ける
+    """
+    client = push.APNsClient(base_url='https://apns.test/3/device/', transport=httpx.MockTransport(handle))
+    monkeypatch.setattr(push, 'apns_client', client)
+    return client
+
+
+def call(handler, method='GET', query=None, body=None, headers=None, path='/'):
+    """
+    ハンドラーを呼び、(ステータス, 本体, ヘッダー) を返す
+    本体は JSON なら読んだ値、NDJSON なら行ごとに読んだ値のリスト、それ以外は文字列
+    """
+    with _app.test_request_context(path, method=method, query_string=query or {}, json=body, headers=headers or {}):
+        response = handler(flask.request)
+        if not isinstance(response, tuple):
+            response = (response,)
+        payload = response[0]
+        status = response[1] if len(response) > 1 else 200
+        response_headers = response[2] if len(response) > 2 else {}
+        if not isinstance(payload, (bytes, str)):
+            # NDJSON はジェネレーターで返るため、送信し終わるまで読む
+            payload = b''.join(payload)
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8')
+    content_type = response_headers.get('Content-Type', '')
+    if content_type == 'application/x-ndjson':
+        return status, [json.loads(line) for line in payload.splitlines()], response_headers
+    try:
+        return status, json.loads(payload), response_headers
+    except ValueError:
+        return status, payload, response_headers
+
+
+class Clock:
+    """
+    time.time() だけを進められる time モジュールの代わり
+    """
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
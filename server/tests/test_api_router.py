@@ -0,0 +1,72 @@
+"""
+4つのサービスをまとめたエントリーポイント（server/main.py の api_router）
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+from conftest import SERVER_DIR, call
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setenv('STORAGE_BACKEND', 'memory')
+    module = sys.modules.get('api_router_main')
+    if module is None:
+        spec = importlib.util.spec_from_file_location('api_router_main', os.path.join(SERVER_DIR, 'main.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['api_router_main'] = module
+        spec.loader.exec_module(module)
+    # テストごとに空のストレージを作らせる
+    monkeypatch.setattr(module, '_db', None)
+    module.services['push-notification'].member_token_cache.invalidate()
+    return module
+
+
+def route(router, path, method='GET', query=None, body=None):
+    return call(router.api_router, method, query, body, path=path)
+
+
+def test_services_share_one_storage_client(router):
+    status, body, _ = route(router, '/management-family', 'POST', {'familyId': 'f1'}, {'name': 'taro'})
+    assert status == 200
+
+    db = router.get_db()
+    assert all(module._db is db for module in router.services.values())
+    status, members, _ = route(router, '/management-family/', query={'familyId': 'f1'})
+    assert status == 200
+    assert [member['memberId'] for member in members] == [body['memberId']]
+    assert route(router, '/family-dashboard', query={'familyId': 'f1'})[1]['members'][0]['name'] == 'taro'
+
+
+def test_member_change_invalidates_the_push_cache_in_the_same_instance(router):
+    push = router.services['push-notification']
+    _, body, _ = route(router, '/management-family', 'POST', {'familyId': 'f1'}, {'name': 'taro', 'deviceToken': 'old'})
+    assert [member['deviceToken'] for member in push.load_family_member_tokens('f1')] == ['old']
+
+    status, _, _ = route(router, '/management-family', 'PUT', {'familyId': 'f1'},
+                         {'memberId': body['memberId'], 'name': 'taro', 'deviceToken': 'new'})
+
+    assert status == 200
+    assert 'f1' not in push.member_token_cache._entries
+    assert [member['deviceToken'] for member in push.load_family_member_tokens('f1')] == ['new']
+
+
+def test_unknown_path_lists_the_routes(router):
+    status, body, _ = route(router, '/nope')
+
+    assert status == 404
+    assert '/push-notification/drain_notification_outbox' in body['routes']
+
+
+def test_metrics_cover_every_service(router):
+    route(router, '/update-user-mission', query={'userId': 'u1'})
+
+    status, body, headers = route(router, '/metrics')
+
+    assert status == 200
+    assert headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    assert 'service="update-user-mission"' in body
+    assert '# TYPE' in body
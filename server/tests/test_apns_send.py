@@ -0,0 +1,101 @@
+"""
+APNs への送信エラーの扱い（再送してよい失敗と、届いた可能性がある失敗）
+"""
+import httpx
+import pytest
+
+from conftest import use_apns
+
+MEMBERS = 'family-management/f1/members'
+
+
+def use_transport(push, monkeypatch, *responses):
+    """
+    responses を順に返す（例外なら送出する）APNs のスタンドインに向け、受けたリクエストのリストを返す
+    """
+    requests = []
+    responses = list(responses)
+
+    def handle(request):
+        requests.append(request)
+        response = responses.pop(0) if len(responses) > 1 else responses[0]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    use_apns(push, monkeypatch, handle)
+    return requests
+
+
+def test_connect_error_is_retried_once_on_the_same_client(push, monkeypatch):
+    requests = use_transport(push, monkeypatch, httpx.ConnectError('refused'), httpx.Response(200))
+
+    result = push.send_push_notification('t1', 'title', 'body')
+
+    assert result['success']
+    assert len(requests) == 2
+    assert push.apns_client.stats()['connects'] == 1
+
+
+def test_connect_error_twice_is_reported_as_unsent(push, monkeypatch):
+    requests = use_transport(push, monkeypatch, httpx.ConnectTimeout('timeout'))
+
+    result = push.send_push_notification('t1', 'title', 'body')
+
+    assert len(requests) == 2
+    assert result['unsent'] and push.is_retryable_result(result)
+
+
+@pytest.mark.parametrize('error', [
+    httpx.ReadError('reset'),
+    httpx.WriteError('broken pipe'),
+    httpx.RemoteProtocolError('stream reset'),
+    httpx.ReadTimeout('timeout'),
+])
+def test_errors_after_the_request_was_written_are_not_retried(push, monkeypatch, error):
+    requests = use_transport(push, monkeypatch, error, httpx.Response(200))
+
+    result = push.send_push_notification('t1', 'title', 'body')
+
+    assert len(requests) == 1
+    assert result['delivery_unknown']
+    assert not push.is_retryable_result(result)
+
+
+def test_pool_timeout_fails_without_resetting_the_shared_client(push, monkeypatch):
+    requests = use_transport(push, monkeypatch, httpx.PoolTimeout('no free connection'))
+    client = push.apns_client.get_client()
+
+    result = push.send_push_notification('t1', 'title', 'body')
+
+    assert len(requests) == 1
+    assert result['reason'] == 'PoolTimeout' and push.is_retryable_result(result)
+    assert push.apns_client.get_client() is client
+
+
+def test_read_error_is_not_sent_twice_by_the_outbox(push, monkeypatch, store):
+    store.seed(MEMBERS + '/m0', {'name': 'taro', 'deviceToken': 't0'})
+    store.seed(MEMBERS + '/m1', {'name': 'hanako', 'deviceToken': 't1'})
+    monkeypatch.setattr(push, 'outbox', push.LocalOutbox())
+    monkeypatch.setattr(push, 'OUTBOX_BACKOFF_BASE_SECONDS', 0)
+    requests = use_transport(push, monkeypatch, httpx.ReadError('reset'), httpx.Response(200))
+
+    push.outbox.enqueue({'familyId': 'f1', 'memberId': 'm0', 'memberName': 'taro', 'goalTitle': 'run'})
+    assert push.drain_outbox()['sent'] == 1
+    assert push.drain_outbox()['claimed'] == 0
+
+    assert len(requests) == 1
+
+
+def test_unsent_notifications_are_retried_by_the_outbox(push, monkeypatch, store):
+    store.seed(MEMBERS + '/m0', {'name': 'taro', 'deviceToken': 't0'})
+    store.seed(MEMBERS + '/m1', {'name': 'hanako', 'deviceToken': 't1'})
+    monkeypatch.setattr(push, 'outbox', push.LocalOutbox())
+    monkeypatch.setattr(push, 'OUTBOX_BACKOFF_BASE_SECONDS', 0)
+    requests = use_transport(push, monkeypatch, httpx.PoolTimeout('busy'), httpx.Response(200))
+
+    push.outbox.enqueue({'familyId': 'f1', 'memberId': 'm0', 'memberName': 'taro', 'goalTitle': 'run'})
+    total = push.drain_outbox()
+
+    assert (total['retried'], total['sent']) == (1, 1)
+    assert len(requests) == 2
@@ -0,0 +1,129 @@
+"""
+APNs のプロバイダートークン（APNsTokenProvider）の使い回しと再署名
+"""
+import threading
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from common.observability import Metrics
+
+
+@pytest.fixture(scope='module')
+def key():
+    return ec.generate_private_key(ec.SECP256R1())
+
+
+@pytest.fixture
+def key_path(key, tmp_path):
+    path = tmp_path / 'AuthKey.p8'
+    path.write_bytes(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                       serialization.NoEncryption()))
+    return str(path)
+
+
+@pytest.fixture
+def clock():
+    now = [1_000_000.0]
+
+    def clock():
+        return now[0]
+    clock.now = now
+    return clock
+
+
+def claims(key, token):
+    return jwt.decode(token, key.public_key(), algorithms=['ES256']), jwt.get_unverified_header(token)
+
+
+def test_token_is_signed_with_the_key_and_reused(push, key, key_path, clock):
+    provider = push.APNsTokenProvider(key_path, 'TEAM000000', 'KEY0000000', clock=clock)
+
+    token = provider.get_token()
+
+    payload, header = claims(key, token)
+    assert payload == {'iss': 'TEAM000000', 'iat': 1_000_000}
+    assert header['kid'] == 'KEY0000000'
+    assert provider.get_token() == token
+    assert {k: provider.stats()[k] for k in ('hits', 'refreshes', 'key_loads')} == {'hits': 1, 'refreshes': 1,
+                                                                                  'key_loads': 1}
+
+
+def test_token_is_signed_again_after_the_refresh_window(push, key, key_path, clock):
+    provider = push.APNsTokenProvider(key_path, 'TEAM000000', 'KEY0000000', refresh_seconds=30 * 60, clock=clock)
+    first = provider.get_token()
+
+    clock.now[0] += 30 * 60 - 1
+    assert provider.get_token() == first
+    assert provider.stats()['token_age_seconds'] == 30 * 60 - 1
+
+    clock.now[0] += 1
+    second = provider.get_token()
+    assert second != first
+    assert claims(key, second)[0]['iat'] == 1_000_000 + 30 * 60
+    # 鍵は読み直さない
+    assert (provider.stats()['refreshes'], provider.stats()['key_loads']) == (2, 1)
+
+
+def test_invalidate_forces_a_new_token(push, key_path, clock):
+    provider = push.APNsTokenProvider(key_path, 'TEAM000000', 'KEY0000000', clock=clock)
+    provider.get_token()
+
+    provider.invalidate()
+
+    assert provider.stats()['token_age_seconds'] is None
+    provider.get_token()
+    assert provider.stats()['refreshes'] == 2
+
+
+@pytest.mark.parametrize('requested, clamped', [(0, 20 * 60), (60, 20 * 60), (45 * 60, 45 * 60),
+                                                (24 * 60 * 60, 60 * 60)])
+def test_refresh_window_is_clamped_to_what_apns_accepts(push, key_path, requested, clamped):
+    provider = push.APNsTokenProvider(key_path, 'TEAM000000', 'KEY0000000', refresh_seconds=requested)
+
+    assert provider.refresh_seconds == clamped
+
+
+def test_concurrent_callers_share_one_signature(push, key_path, monkeypatch):
+    signed = []
+    encode = jwt.encode
+
+    def slow_encode(*args, **kwargs):
+        signed.append(threading.current_thread().name)
+        time.sleep(0.05)
+        return encode(*args, **kwargs)
+
+    monkeypatch.setattr(jwt, 'encode', slow_encode)
+    provider = push.APNsTokenProvider(key_path, 'TEAM000000', 'KEY0000000')
+    start = threading.Barrier(16)
+    tokens = []
+
+    def get():
+        start.wait()
+        tokens.append(provider.get_token())
+
+    threads = [threading.Thread(target=get) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(signed) == 1
+    assert len(set(tokens)) == 1 and len(tokens) == 16
+    stats = provider.stats()
+    assert (stats['hits'], stats['refreshes'], stats['key_loads']) == (15, 1, 1)
+
+
+def test_hits_and_refreshes_are_recorded_in_the_metrics(push, key_path, clock):
+    metrics = Metrics('push-notification')
+    provider = push.APNsTokenProvider(key_path, 'TEAM000000', 'KEY0000000', clock=clock, metrics=metrics)
+
+    for _ in range(3):
+        provider.get_token()
+
+    counters = {counter['labels']['result']: counter['value'] for counter in metrics.snapshot()['counters']
+                if counter['name'] == 'apns_provider_tokens_total'}
+    assert counters == {'hit': 2, 'refresh': 1}
@@ -0,0 +1,118 @@
+"""
+目標達成通知のまとめ送信（NotificationCoalescer とアウトボックス）
+"""
+import json
+
+import httpx
+import pytest
+
+from conftest import Clock, use_apns
+
+MEMBERS = 'family-management/f1/members'
+WINDOW = 60
+
+
+@pytest.fixture(params=['local', 'firestore'])
+def push(request, push, store, monkeypatch):
+    store.seed(MEMBERS + '/m0', {'name': 'taro', 'deviceToken': 't0'})
+    store.seed(MEMBERS + '/m1', {'name': 'hanako', 'deviceToken': 't1'})
+    monkeypatch.setattr(push, 'time', Clock())
+    outbox = push.LocalOutbox() if request.param == 'local' else push.FirestoreOutbox('notification-outbox')
+    monkeypatch.setattr(push, 'outbox', outbox)
+    return push
+
+
+@pytest.fixture
+def sent(push, monkeypatch):
+    """
+    APNs に送った通知の (本文, apns-collapse-id) のリスト
+    """
+    sent = []
+
+    def handle(request):
+        alert = json.loads(request.content)['aps']['alert']
+        sent.append((alert['body'], request.headers.get('apns-collapse-id')))
+        return httpx.Response(200)
+
+    use_apns(push, monkeypatch, handle)
+    return sent
+
+
+def achieve(coalescer, goal_title):
+    return coalescer.submit('f1', 'm0', 'taro', goal_title)
+
+
+def test_burst_is_sent_once_and_the_rest_once_after_the_window(push, sent):
+    coalescer = push.NotificationCoalescer(WINDOW)
+    collapse_id = push.goal_collapse_id('f1', 'm0')
+
+    assert achieve(coalescer, 'a')['sent_count'] == 1
+    assert achieve(coalescer, 'b')['pending_count'] == 1
+    assert achieve(coalescer, 'c')['pending_count'] == 2
+    assert len(sent) == 1
+
+    # ウィンドウが終わるまではドレインでも送らない
+    assert push.drain_outbox()['claimed'] == 0
+
+    push.time.now += WINDOW
+    assert push.drain_outbox()['sent'] == 1
+    # まとめた通知は端末上で最初の通知を置き換えるため、すぐ送った「a」も数える
+    assert sent == [
+        ('taroが「a」を達成しました！', collapse_id),
+        ('taroが3個の目標を達成しました！（最新:「c」）', collapse_id),
+    ]
+    assert push.drain_outbox()['claimed'] == 0
+
+
+def test_next_event_flushes_the_due_window_and_opens_an_empty_one(push, sent):
+    coalescer = push.NotificationCoalescer(WINDOW)
+
+    achieve(coalescer, 'a')
+    achieve(coalescer, 'b')
+    achieve(coalescer, 'c')
+
+    # ドレインが動く前に次の達成があれば、溜まっていた通知をその場で送る
+    push.time.now += WINDOW
+    achieve(coalescer, 'd')
+    assert [body for body, _ in sent] == [
+        'taroが「a」を達成しました！',
+        'taroが3個の目標を達成しました！（最新:「c」）',
+        'taroが「d」を達成しました！',
+    ]
+    assert push.drain_outbox()['claimed'] == 0
+
+    # 新しいウィンドウには前のウィンドウの目標を持ち越さない
+    assert achieve(coalescer, 'e')['pending_count'] == 1
+    push.time.now += WINDOW
+    push.drain_outbox()
+    assert sent[-1][0] == 'taroが2個の目標を達成しました！（最新:「e」）'
+    assert coalescer.stats() == {'events': 5, 'sends': 2, 'coalesced': 3, 'flushed': 1}
+
+
+def test_window_without_a_burst_sends_nothing_more(push, sent):
+    coalescer = push.NotificationCoalescer(WINDOW)
+
+    achieve(coalescer, 'a')
+    push.time.now += WINDOW
+    assert push.drain_outbox()['claimed'] == 0
+    achieve(coalescer, 'b')
+
+    assert [body for body, _ in sent] == ['taroが「a」を達成しました！', 'taroが「b」を達成しました！']
+
+
+def test_due_window_is_flushed_from_the_injected_outbox(push, sent):
+    store = push.LocalOutbox()
+    coalescer = push.NotificationCoalescer(WINDOW, store=store)
+
+    achieve(coalescer, 'a')
+    achieve(coalescer, 'b')
+    push.time.now += WINDOW
+    achieve(coalescer, 'c')
+
+    assert [body for body, _ in sent] == [
+        'taroが「a」を達成しました！',
+        'taroが2個の目標を達成しました！（最新:「b」）',
+        'taroが「c」を達成しました！',
+    ]
+    assert [job['status'] for job in store._jobs.values()] == ['sent']
+    assert push.drain_outbox()['claimed'] == 0
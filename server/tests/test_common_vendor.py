@@ -0,0 +1,56 @@
+"""
+サービスの単独デプロイ（common.vendor でコピーした common を使う）
+"""
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from common import vendor
+from conftest import SERVER_DIR
+
+
+def import_main(directory):
+    """
+    directory だけを置いた状態（単独デプロイと同じ）で main.py を import する
+    """
+    return subprocess.run([sys.executable, '-c', 'import main'], cwd=directory, capture_output=True, text=True,
+                          env=dict(os.environ, PYTHONPATH=''), timeout=60)
+
+
+@pytest.fixture
+def deployed(tmp_path, monkeypatch):
+    """
+    tmp_path/server/<service> にサービスの main.py だけを置き、そのディレクトリを返す
+    """
+    monkeypatch.setattr(vendor, 'SERVER_DIR', str(tmp_path / 'server'))
+
+    def deployed(service):
+        directory = tmp_path / 'server' / service
+        directory.mkdir(parents=True)
+        shutil.copy(os.path.join(SERVER_DIR, service, 'main.py'), directory)
+        return directory
+    return deployed
+
+
+def test_service_without_common_fails_with_the_vendor_command(deployed):
+    result = import_main(deployed('management-family'))
+
+    assert result.returncode != 0
+    assert 'python -m common.vendor management-family' in result.stderr
+
+
+def test_vendored_service_imports_on_its_own(deployed):
+    directory = deployed('management-family')
+
+    target = vendor.vendor('management-family')
+
+    assert target == str(directory / 'common')
+    assert not os.path.exists(os.path.join(target, 'vendor.py'))
+    result = import_main(directory)
+    assert result.returncode == 0, result.stderr
+
+    vendor.vendor('management-family', clean=True)
+    assert not os.path.exists(target)
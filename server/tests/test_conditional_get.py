@@ -0,0 +1,76 @@
+"""
+一覧の条件付きGET（ETag / If-None-Match）
+"""
+import pytest
+
+from conftest import call
+
+ENDPOINTS = {
+    'goals': ('update-user-mission', 'user_goals_handler', {'userId': 'u1'},
+              {'title': 'a', 'createdAt': '2026-10-01T00:00:00Z'}, 'title'),
+    'missions': ('update-family-mission', 'family_missions_handler', {'familyId': 'f1'},
+                 {'mission': 'a', 'isCleared': False, 'createdAt': '2026-10-01T00:00:00Z'}, 'mission'),
+    'members': ('management-family', 'family_members_handler', {'familyId': 'f1'}, {'name': 'a'}, 'name'),
+}
+
+
+@pytest.fixture(params=sorted(ENDPOINTS))
+def endpoint(request, load):
+    service, handler, query, body, field = ENDPOINTS[request.param]
+    module = load(service)
+    handler = getattr(module, handler)
+
+    def get(headers=None, **params):
+        return call(handler, 'GET', dict(query, **params), headers=headers)
+
+    def create():
+        assert call(handler, 'POST', query, body)[0] == 200
+
+    return get, create, field
+
+
+def test_unchanged_collection_returns_304_without_reading_it(endpoint, store):
+    get, create, _ = endpoint
+    create()
+    status, body, headers = get()
+    assert status == 200 and len(body) == 1
+    assert headers['ETag'].startswith('W/"') and headers['Cache-Control'] == 'no-cache'
+
+    store.reset_stats()
+    status, body, again = get({'If-None-Match': headers['ETag']})
+
+    assert (status, body) == (304, '')
+    assert again['ETag'] == headers['ETag']
+    # バージョンのドキュメント1件だけを読む
+    assert dict(store.rpcs) == {'get': 1}
+
+
+def test_write_changes_the_etag(endpoint):
+    get, create, _ = endpoint
+    _, _, headers = get()
+
+    create()
+    status, body, changed = get({'If-None-Match': headers['ETag']})
+
+    assert status == 200 and len(body) == 1
+    assert changed['ETag'] != headers['ETag']
+
+
+def test_etag_depends_on_the_query_and_the_format(endpoint):
+    get, create, field = endpoint
+    create()
+    _, _, plain = get()
+    _, _, ndjson = get({'Accept': 'application/x-ndjson'})
+    _, _, projected = get(fields=field)
+
+    assert len({plain['ETag'], ndjson['ETag'], projected['ETag']}) == 3
+    assert get({'If-None-Match': plain['ETag'], 'Accept': 'application/x-ndjson'})[0] == 200
+
+
+def test_bulk_goal_writes_change_the_etag(load):
+    module = load('update-user-mission')
+    _, _, headers = call(module.user_goals_handler, 'GET', {'userId': 'u1'})
+
+    call(module.user_goals_handler, 'POST', {'userId': 'u1'}, {'operations': [{'op': 'create', 'goal': {'title': 'a'}}]})
+
+    assert call(module.user_goals_handler, 'GET', {'userId': 'u1'}, headers={'If-None-Match': headers['ETag']})[0] == 200
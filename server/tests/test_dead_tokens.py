@@ -0,0 +1,114 @@
+"""
+APNs の送信結果による無効なデバイストークンの削除（prune_dead_tokens）
+"""
+import pytest
+
+from common.observability import Metrics
+
+MEMBERS = 'family-management/f1/members'
+
+
+def send_result(push, store, member_id, result):
+    """
+    メンバーを読み直し、そのトークンへの送信結果を1件処理する
+    """
+    members = push.fetch_family_member_tokens('f1')
+    token = member(store, member_id)['deviceToken']
+    return push.prune_dead_tokens([{'deviceToken': token, 'result': result}], members)
+
+
+def member(store, member_id):
+    return store.dump(f'{MEMBERS}/{member_id}')[f'{MEMBERS}/{member_id}']
+
+
+@pytest.mark.parametrize('result', [
+    {'success': False, 'status_code': 410, 'reason': 'Unregistered'},
+    {'success': False, 'status_code': 410},
+])
+def test_unregistered_token_is_pruned_immediately(push, store, result):
+    store.seed(MEMBERS + '/m1', {'name': 'taro', 'deviceToken': 't1'})
+
+    assert send_result(push, store, 'm1', result) == 1
+    assert 'deviceToken' not in member(store, 'm1')
+
+
+def test_bad_device_token_is_pruned_when_the_environment_matches(push, store):
+    store.seed(MEMBERS + '/m1', {'name': 'taro', 'deviceToken': 't1', 'apnsEnvironment': push.APNS_ENVIRONMENT})
+
+    assert send_result(push, store, 'm1', {'success': False, 'status_code': 400, 'reason': 'BadDeviceToken'}) == 1
+    assert 'deviceToken' not in member(store, 'm1')
+
+
+@pytest.mark.parametrize('environment', [None, 'other'])
+def test_bad_device_token_needs_repeated_strikes_otherwise(push, store, environment):
+    data = {'name': 'taro', 'deviceToken': 't1'}
+    if environment:
+        data['apnsEnvironment'] = 'production' if push.APNS_ENVIRONMENT == 'sandbox' else 'sandbox'
+    store.seed(MEMBERS + '/m1', data)
+    bad = {'success': False, 'status_code': 400, 'reason': 'BadDeviceToken'}
+
+    for strike in range(1, push.DEAD_TOKEN_STRIKES):
+        assert send_result(push, store, 'm1', bad) == 0
+        assert member(store, 'm1')['badTokenStrikes'] == strike
+
+    assert send_result(push, store, 'm1', bad) == 1
+    assert 'deviceToken' not in member(store, 'm1')
+    assert 'badTokenStrikes' not in member(store, 'm1')
+
+
+def test_pruned_tokens_are_counted_by_reason(push, store, monkeypatch):
+    metrics = Metrics('push-notification')
+    monkeypatch.setattr(push, 'metrics', metrics)
+    for member_id in ('m1', 'm2', 'm3', 'm4'):
+        store.seed(f'{MEMBERS}/{member_id}', {'name': member_id, 'deviceToken': f'token-{member_id}',
+                                             'apnsEnvironment': push.APNS_ENVIRONMENT})
+    members = push.fetch_family_member_tokens('f1')
+    # m4 は読み込んだ後にトークンが更新された（前提条件エラーで削除しない）
+    store.document(f'{MEMBERS}/m4').update({'deviceToken': 'token-new'})
+    results = [
+        {'deviceToken': 'token-m1', 'result': {'success': False, 'status_code': 410, 'reason': 'Unregistered'}},
+        {'deviceToken': 'token-m2', 'result': {'success': False, 'status_code': 410}},
+        {'deviceToken': 'token-m3', 'result': {'success': False, 'status_code': 400, 'reason': 'BadDeviceToken'}},
+        {'deviceToken': 'token-m4', 'result': {'success': False, 'status_code': 410, 'reason': 'Unregistered'}},
+    ]
+
+    assert push.prune_dead_tokens(results, members) == 3
+
+    pruned = {counter['labels']['reason']: counter['value'] for counter in metrics.snapshot()['counters']
+              if counter['name'] == 'apns_pruned_tokens_total'}
+    assert pruned == {'Unregistered': 1, '410': 1, 'BadDeviceToken': 1}
+
+
+def test_successful_send_resets_strikes(push, store):
+    store.seed(MEMBERS + '/m1', {'name': 'taro', 'deviceToken': 't1'})
+
+    send_result(push, store, 'm1', {'success': False, 'status_code': 400, 'reason': 'BadDeviceToken'})
+    send_result(push, store, 'm1', {'success': True, 'status_code': 200})
+
+    assert 'badTokenStrikes' not in member(store, 'm1')
+    assert member(store, 'm1')['deviceToken'] == 't1'
+
+
+def test_device_token_not_for_topic_keeps_the_token(push, store):
+    store.seed(MEMBERS + '/m1', {'name': 'taro', 'deviceToken': 't1', 'apnsEnvironment': push.APNS_ENVIRONMENT})
+
+    assert send_result(push, store, 'm1', {'success': False, 'status_code': 400,
+                                            'reason': 'DeviceTokenNotForTopic'}) == 0
+    assert member(store, 'm1')['deviceToken'] == 't1'
+
+
+def test_re_registering_a_token_clears_its_environment_and_strikes(load, store):
+    from conftest import call
+
+    family = load('management-family')
+    store.seed(MEMBERS + '/m1', {'name': 'taro', 'deviceToken': 'old', 'apnsEnvironment': 'production',
+                                 'badTokenStrikes': 2})
+
+    status, _, _ = call(family.family_members_handler, 'PUT', {'familyId': 'f1'},
+                        {'memberId': 'm1', 'name': 'taro', 'deviceToken': 'new'})
+    assert status == 200
+    assert member(store, 'm1') == {'name': 'taro', 'deviceToken': 'new'}
+
+    status, _, _ = call(family.family_members_handler, 'PUT', {'familyId': 'f1'},
+                        {'memberId': 'm1', 'name': 'taro', 'deviceToken': 'new', 'apnsEnvironment': 'staging'})
+    assert status == 400
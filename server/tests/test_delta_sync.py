@@ -0,0 +1,115 @@
+"""
+目標・家族ミッションの差分同期（since と墓標）
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from common.sync import TOMBSTONE_RETENTION_DAYS, encode_sync_token
+from conftest import call
+
+
+class Goals:
+    id_key = 'goalId'
+
+    def __init__(self, load):
+        self.module = load('update-user-mission')
+        self.handler = self.module.user_goals_handler
+        self.query = {'userId': 'u1'}
+
+    def create(self, title):
+        status, body, _ = call(self.handler, 'POST', self.query, {'title': title, 'createdAt': '2026-10-01T00:00:00Z'})
+        assert status == 200
+        return body['goalId']
+
+    def update(self, doc_id, title):
+        assert call(self.handler, 'PUT', self.query, {'goalId': doc_id, 'title': title})[0] == 200
+
+    def delete(self, doc_id):
+        assert call(self.handler, 'DELETE', dict(self.query, goalId=doc_id))[0] == 200
+
+    def title(self, doc):
+        return doc['title']
+
+
+class Missions:
+    id_key = 'doc_id'
+
+    def __init__(self, load):
+        self.module = load('update-family-mission')
+        self.handler = self.module.family_missions_handler
+        self.query = {'familyId': 'f1'}
+
+    def create(self, title):
+        status, body, _ = call(self.handler, 'POST', self.query,
+                               {'mission': title, 'isCleared': False, 'createdAt': '2026-10-01T00:00:00Z'})
+        assert status == 200
+        return body['doc_id']
+
+    def update(self, doc_id, title):
+        assert call(self.handler, 'PUT', self.query, {'doc_id': doc_id, 'mission': title, 'isCleared': True})[0] == 200
+
+    def delete(self, doc_id):
+        assert call(self.handler, 'DELETE', dict(self.query, doc_id=doc_id))[0] == 200
+
+    def title(self, doc):
+        return doc['mission']
+
+
+@pytest.fixture(params=[Goals, Missions], ids=['goals', 'missions'])
+def api(request, load):
+    return request.param(load)
+
+
+def sync(api, since, **query):
+    status, body, _ = call(api.handler, 'GET', dict(api.query, since=since, **query))
+    assert status == 200
+    return body
+
+
+def test_changes_and_deletes_since_the_last_sync(api):
+    kept = api.create('kept')
+    renamed = api.create('renamed')
+    removed = api.create('removed')
+
+    first = sync(api, '')
+    assert first['reset'] is True
+    assert sorted(api.title(doc) for doc in first['changed']) == ['kept', 'removed', 'renamed']
+    assert first['deleted'] == []
+
+    api.update(renamed, 'renamed again')
+    api.delete(removed)
+    added = api.create('added')
+
+    second = sync(api, first['syncToken'])
+    assert second['reset'] is False
+    assert sorted((doc[api.id_key], api.title(doc)) for doc in second['changed']) == sorted(
+        [(renamed, 'renamed again'), (added, 'added')])
+    assert second['deleted'] == [removed]
+    assert kept not in [doc[api.id_key] for doc in second['changed']]
+
+    third = sync(api, second['syncToken'])
+    assert (third['changed'], third['deleted']) == ([], [])
+    assert third['syncToken'] == second['syncToken']
+
+
+def test_since_older_than_the_tombstone_retention_resets(api):
+    api.create('a')
+    old = datetime.now(timezone.utc) - timedelta(days=TOMBSTONE_RETENTION_DAYS + 1)
+
+    body = sync(api, encode_sync_token(old))
+
+    assert body['reset'] is True
+    assert [api.title(doc) for doc in body['changed']] == ['a']
+
+
+def test_changes_can_be_projected(api):
+    api.create('a')
+
+    body = sync(api, '', fields=api.id_key)
+
+    assert list(body['changed'][0]) == [api.id_key]
+
+
+def test_invalid_since_is_rejected(api):
+    assert call(api.handler, 'GET', dict(api.query, since='%%%'))[0] == 400
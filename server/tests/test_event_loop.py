@@ -0,0 +1,44 @@
+"""
+インスタンス共通のイベントループ（common/event_loop.py）
+"""
+import asyncio
+import threading
+
+import pytest
+
+from common.event_loop import get_loop, run_async
+
+
+def test_coroutines_run_on_one_background_loop():
+    async def current():
+        return asyncio.get_running_loop(), threading.current_thread()
+
+    first_loop, first_thread = run_async(current())
+    second_loop, _ = run_async(current())
+
+    assert first_loop is second_loop is get_loop()
+    assert first_thread is not threading.current_thread()
+
+
+def test_errors_are_raised_in_the_caller():
+    async def fail():
+        raise KeyError('missing')
+
+    with pytest.raises(KeyError):
+        run_async(fail())
+
+
+def test_timeout_cancels_the_coroutine():
+    cancelled = threading.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(TimeoutError):
+        run_async(slow(), timeout=0.05)
+
+    assert cancelled.wait(1)
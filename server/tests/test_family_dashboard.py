@@ -0,0 +1,98 @@
+"""
+家族画面のダッシュボード（management-family の family_dashboard_handler）
+"""
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from conftest import call
+from storage import MemoryFirestore, create_async_client
+
+FAMILY = 'family-management/f1'
+
+
+@pytest.fixture
+def dashboard(load, store, monkeypatch):
+    module = load('management-family')
+    monkeypatch.setattr(module, '_async_db', create_async_client(store))
+
+    def get(**query):
+        return call(module.family_dashboard_handler, 'GET', query)
+    get.module = module
+    return get
+
+
+def test_members_missions_and_stats_in_one_response(dashboard, store):
+    today = datetime.now(ZoneInfo(dashboard.module.MISSION_SUMMARY_TIMEZONE)).date().isoformat()
+    store.seed(f'{FAMILY}/members/m1', {'name': 'taro', 'deviceToken': 'secret'})
+    store.seed(f'{FAMILY}/missions/a', {'mission': 'a', 'isCleared': True, 'clearedOn': today,
+                                         'createdAt': '2026-10-01T00:00:00Z'})
+    store.seed(f'{FAMILY}/missions/b', {'mission': 'b', 'isCleared': True, 'clearedOn': '2026-01-01',
+                                         'createdAt': '2026-10-02T00:00:00Z'})
+    store.seed(f'{FAMILY}/missions/c', {'mission': 'c', 'isCleared': False, 'createdAt': '2026-10-03T00:00:00Z'})
+
+    status, body, headers = dashboard(familyId='f1')
+
+    assert status == 200
+    assert headers['Cache-Control'] == 'no-cache'
+    assert body['familyId'] == 'f1'
+    # deviceToken と clearedOn は返さない
+    assert body['members'] == [{'memberId': 'm1', 'name': 'taro'}]
+    assert body['missions'][0] == {'doc_id': 'c', 'mission': 'c', 'isCleared': False,
+                                   'createdAt': '2026-10-03T00:00:00Z'}
+    assert body['stats'] == {'members': 1, 'missions': 3, 'cleared': 2, 'clearedToday': 1, 'remaining': 1,
+                             'today': today}
+
+
+def test_missions_without_created_at_are_sorted_last(dashboard, store):
+    store.seed(f'{FAMILY}/missions/old', {'mission': 'old', 'createdAt': '2026-10-01T00:00:00Z'})
+    store.seed(f'{FAMILY}/missions/none', {'mission': 'none', 'createdAt': None})
+    store.seed(f'{FAMILY}/missions/new', {'mission': 'new', 'createdAt': '2026-10-02T00:00:00Z'})
+
+    status, body, _ = dashboard(familyId='f1')
+
+    assert status == 200
+    assert [mission['doc_id'] for mission in body['missions']] == ['new', 'old', 'none']
+
+
+def test_empty_family(dashboard):
+    status, body, _ = dashboard(familyId='f1')
+
+    assert status == 200
+    assert (body['members'], body['missions']) == ([], [])
+    assert body['stats']['remaining'] == 0
+
+
+def test_members_and_missions_are_read_concurrently(dashboard, monkeypatch):
+    slow = MemoryFirestore(rpc_latency_ms={'query': 200})
+    slow.seed(f'{FAMILY}/members/m1', {'name': 'taro'})
+    slow.seed(f'{FAMILY}/missions/a', {'mission': 'a'})
+    monkeypatch.setattr(dashboard.module, '_async_db', create_async_client(slow))
+
+    started = time.perf_counter()
+    status, body, _ = dashboard(familyId='f1')
+
+    assert status == 200
+    assert dict(slow.rpcs) == {'query': 2}
+    # 2つのクエリを順番に読めば 400ms 以上かかる
+    assert time.perf_counter() - started < 0.35
+    assert (len(body['members']), len(body['missions'])) == (1, 1)
+
+
+def test_slow_reads_return_503(dashboard, monkeypatch):
+    slow = MemoryFirestore(rpc_latency_ms={'query': 300})
+    monkeypatch.setattr(dashboard.module, '_async_db', create_async_client(slow))
+    monkeypatch.setattr(dashboard.module, 'DASHBOARD_TIMEOUT_SECONDS', 0.05)
+
+    status, body, headers = dashboard(familyId='f1')
+
+    assert status == 503
+    assert headers['Retry-After'] == '1'
+    assert 'error' in body
+
+
+def test_family_id_is_required(dashboard):
+    assert dashboard()[0] == 400
+    assert call(dashboard.module.family_dashboard_handler, 'POST', {'familyId': 'f1'}, {})[0] == 405
@@ -0,0 +1,58 @@
+"""
+家族ミッションの一覧（JSON / NDJSON）と createdAt の補完
+"""
+import pytest
+
+from conftest import call
+
+COLLECTION = 'family-management/f1/missions'
+NDJSON = {'Accept': 'application/x-ndjson'}
+
+
+@pytest.fixture
+def service(load):
+    return load('update-family-mission')
+
+
+def create(service, mission, created_at):
+    status, body, _ = call(service.family_missions_handler, 'POST', {'familyId': 'f1'},
+                           {'mission': mission, 'isCleared': False, 'createdAt': created_at})
+    assert status == 200
+    return body['doc_id']
+
+
+def list_missions(service, headers=None):
+    status, body, _ = call(service.family_missions_handler, 'GET', {'familyId': 'f1'}, headers=headers)
+    assert status == 200
+    return [mission['mission'] for mission in body]
+
+
+def test_null_created_at_does_not_fail_the_list(service):
+    create(service, 'old', '2026-10-01T00:00:00Z')
+    create(service, 'no date', None)
+    create(service, 'new', '2026-10-02T00:00:00Z')
+
+    assert list_missions(service) == ['new', 'old', 'no date']
+
+
+def test_json_and_ndjson_return_the_same_missions_in_the_same_order(service):
+    create(service, 'old', '2026-10-01T00:00:00Z')
+    create(service, 'no date', None)
+    create(service, 'new', '2026-10-02T00:00:00Z')
+
+    assert list_missions(service, NDJSON) == list_missions(service)
+
+
+def test_backfill_created_at_adds_missions_without_the_field(service, store):
+    create(service, 'api', '2026-10-01T00:00:00Z')
+    # API 以外で作成された createdAt のないミッション
+    store.collection(COLLECTION).document('legacy').set({'mission': 'legacy', 'isCleared': False})
+    assert list_missions(service) == ['api']
+
+    assert service.backfill_created_at(store, COLLECTION) == 1
+
+    created_at = store.collection(COLLECTION).document('legacy').get().to_dict()['createdAt']
+    assert created_at.endswith('Z')
+    assert sorted(list_missions(service)) == ['api', 'legacy']
+    assert list_missions(service, NDJSON) == list_missions(service)
+    assert service.backfill_created_at(store, COLLECTION) == 0
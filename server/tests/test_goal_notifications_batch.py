@@ -0,0 +1,100 @@
+"""
+複数ファミリー分の目標達成通知の一括送信（send_family_goal_notifications_batch）
+"""
+import json
+
+import httpx
+import pytest
+
+from conftest import call, use_apns
+
+
+@pytest.fixture
+def push(push, store):
+    for family_id, members in {'f1': ['a', 'b', 'c'], 'f2': ['d', 'shared'], 'f3': ['e', 'shared']}.items():
+        for member_id in members:
+            store.seed(f'family-management/{family_id}/members/{member_id}',
+                       {'name': member_id, 'deviceToken': f'token-{member_id}'})
+    return push
+
+
+@pytest.fixture
+def sent(push, monkeypatch):
+    """
+    APNs に送った (デバイストークン, 本文) のリスト（token-dead には 410 を返す）
+    """
+    sent = []
+
+    def handle(request):
+        token = request.url.path.rsplit('/', 1)[-1]
+        sent.append((token, json.loads(request.content)['aps']['alert']['body']))
+        if token == 'token-dead':
+            return httpx.Response(410, json={'reason': 'Unregistered'})
+        return httpx.Response(200)
+
+    use_apns(push, monkeypatch, handle)
+    return sent
+
+
+def send_batch(push, notifications):
+    return call(push.send_family_goal_notifications_batch, 'POST', body={'notifications': notifications})
+
+
+def test_each_family_is_notified_except_the_achiever(push, store, sent):
+    status, body, _ = send_batch(push, [
+        {'familyId': 'f1', 'memberId': 'a', 'memberName': 'A', 'goalTitle': 'run'},
+        {'familyId': 'f2', 'memberId': 'd', 'memberName': 'D', 'goalTitle': 'read'},
+    ])
+
+    assert status == 200
+    assert sorted(token for token, _ in sent) == ['token-b', 'token-c', 'token-shared']
+    assert (body['item_count'], body['family_count'], body['sent_count'], body['failed_count']) == (2, 2, 3, 0)
+    assert [(item['sent_count'], item['failed_count']) for item in body['items']] == [(2, 0), (1, 0)]
+
+    # メンバーはファミリーごとに1回だけ読む
+    assert store.rpcs['query'] == 2
+
+
+def test_same_notification_to_the_same_device_is_sent_once(push, sent):
+    status, body, _ = send_batch(push, [
+        {'familyId': 'f2', 'memberId': 'd', 'memberName': 'D', 'goalTitle': 'read'},
+        {'familyId': 'f3', 'memberId': 'e', 'memberName': 'D', 'goalTitle': 'read'},
+    ])
+
+    assert status == 200
+    assert sent == [('token-shared', 'Dが「read」を達成しました！')]
+    assert body['deduplicated_count'] == 1
+    assert [item['sent_count'] for item in body['items']] == [1, 1]
+
+
+def test_dead_tokens_are_counted_and_pruned(push, store, sent):
+    store.seed('family-management/f1/members/dead', {'name': 'dead', 'deviceToken': 'token-dead'})
+
+    status, body, _ = send_batch(push, [{'familyId': 'f1', 'memberId': 'a', 'goalTitle': 'run'}])
+
+    assert status == 200
+    assert (body['sent_count'], body['failed_count'], body['pruned_count']) == (2, 1, 1)
+    assert 'deviceToken' not in store.dump('family-management/f1/members/dead')['family-management/f1/members/dead']
+
+
+@pytest.mark.parametrize('notifications', [
+    [],
+    [{'familyId': 'f1'}],
+    [{'memberId': 'a'}],
+    'f1',
+])
+def test_invalid_batches_are_rejected_before_sending(push, sent, notifications):
+    status, body, _ = send_batch(push, notifications)
+
+    assert status == 400
+    assert 'error' in body
+    assert sent == []
+
+
+def test_batch_size_is_limited(push, sent, monkeypatch):
+    monkeypatch.setattr(push, 'MAX_BATCH_NOTIFICATIONS', 2)
+
+    status, _, _ = send_batch(push, [{'familyId': 'f1', 'memberId': 'a'}] * 3)
+
+    assert status == 400
+    assert sent == []
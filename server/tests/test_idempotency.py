@@ -0,0 +1,82 @@
+"""
+POST の Idempotency-Key（common/idempotency.py）
+"""
+import pytest
+
+from common import idempotency
+from conftest import call
+
+# (サービス, ハンドラー, クエリ, 作成するボディ, 内容の違うボディ, コレクション)
+SERVICES = [
+    ('management-family', 'family_members_handler', {'familyId': 'f1'},
+     {'name': 'taro'}, {'name': 'jiro'}, 'family-management/f1/members'),
+    ('update-user-mission', 'user_goals_handler', {'userId': 'u1'},
+     {'title': 'run'}, {'title': 'swim'}, 'user-goals/u1/goals'),
+    ('update-family-mission', 'family_missions_handler', {'familyId': 'f1'},
+     {'mission': 'clean', 'isCleared': False}, {'mission': 'cook', 'isCleared': False}, 'family-management/f1/missions'),
+]
+
+
+def created_docs(store, collection_path):
+    return [path for path in store.dump(collection_path + '/') if path.count('/') == collection_path.count('/') + 1]
+
+
+@pytest.fixture(params=SERVICES, ids=[service[0] for service in SERVICES])
+def service(request, load):
+    name, handler_name, query, body, other_body, collection_path = request.param
+    return getattr(load(name), handler_name), query, body, other_body, collection_path
+
+
+def test_retry_replays_first_response(service, store):
+    handler, query, body, _, collection_path = service
+    headers = {'Idempotency-Key': 'k1'}
+
+    first = call(handler, 'POST', query, body, headers)
+    retry = call(handler, 'POST', query, body, headers)
+
+    assert first[0] == retry[0] == 200
+    assert retry[1] == first[1]
+    assert retry[2].get('Idempotent-Replayed') == 'true'
+    assert len(created_docs(store, collection_path)) == 1
+
+
+def test_retry_on_another_instance_replays_from_firestore(service, store, monkeypatch):
+    handler, query, body, _, collection_path = service
+    headers = {'Idempotency-Key': 'k1'}
+
+    first = call(handler, 'POST', query, body, headers)
+    # 別のインスタンス: インスタンス内のキャッシュには何もない
+    monkeypatch.setattr(idempotency, 'idempotency_cache', idempotency.IdempotencyCache(600, 100))
+    retry = call(handler, 'POST', query, body, headers)
+
+    assert retry[0] == 200
+    assert retry[1] == first[1]
+    assert len(created_docs(store, collection_path)) == 1
+
+
+def test_same_key_with_different_body_is_rejected(service, store):
+    handler, query, body, other_body, collection_path = service
+    headers = {'Idempotency-Key': 'k1'}
+
+    call(handler, 'POST', query, body, headers)
+    status, _, _ = call(handler, 'POST', query, other_body, headers)
+
+    assert status == 422
+    assert len(created_docs(store, collection_path)) == 1
+
+
+def test_without_key_each_post_creates(service, store):
+    handler, query, body, _, collection_path = service
+
+    call(handler, 'POST', query, body)
+    call(handler, 'POST', query, body)
+
+    assert len(created_docs(store, collection_path)) == 2
+
+
+def test_empty_key_is_rejected(service):
+    handler, query, body, _, _ = service
+
+    status, _, _ = call(handler, 'POST', query, body, {'Idempotency-Key': ''})
+
+    assert status == 400
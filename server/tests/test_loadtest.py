@@ -0,0 +1,37 @@
+"""
+負荷試験（benchmarks/loadtest.py）がすべてのシナリオをエラーなしで最後まで実行できること
+"""
+import json
+import os
+import subprocess
+import sys
+
+from conftest import SERVER_DIR
+
+LOADTEST = os.path.join(SERVER_DIR, 'benchmarks', 'loadtest.py')
+
+
+def test_every_scenario_runs_without_errors(tmp_path):
+    output = tmp_path / 'results.json'
+    # 各サービスの main.py を読み込み直すので、テストとは別のプロセスで小さく実行する
+    subprocess.run(
+        [sys.executable, LOADTEST, '--requests', '6', '--concurrency', '2', '--warmup', '2',
+         '--memory-requests', '2', '--family-size', '5', '--history', '30', '--missions', '20',
+         '--families', '3', '--broadcast-family-size', '3', '--dashboard-missions', '5',
+         '--output', str(output)],
+        cwd=SERVER_DIR, env=dict(os.environ, STORAGE_BACKEND='memory'), check=True, capture_output=True, timeout=120,
+    )
+
+    report = json.loads(output.read_text(encoding='utf-8'))
+
+    assert report['settings']['requests'] == 6
+    scenarios = {result['scenario']: result for result in report['scenarios']}
+    assert set(scenarios) == {'members_large_family', 'goals_long_history', 'missions_family',
+                              'push_broadcast_burst', 'family_dashboard'}
+    for result in scenarios.values():
+        assert result['errors'] == 0, result['status']
+        assert set(result['latency']) >= {'p50_ms', 'p95_ms', 'p99_ms'}
+        assert result['firestore_rpcs_total'] is not None
+    push = scenarios['push_broadcast_burst']
+    assert push['notifications']['sent'] > 0
+    assert push['apns']['streams'] > 0
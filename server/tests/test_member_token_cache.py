@@ -0,0 +1,89 @@
+"""
+push-notification のメンバー・デバイストークンのキャッシュ（MemberTokenCache）
+"""
+import threading
+
+from conftest import call
+
+MEMBERS = 'family-management/f1/members'
+
+
+def tokens(push):
+    return sorted(member['deviceToken'] for member in push.load_family_member_tokens('f1'))
+
+
+def test_member_change_on_another_instance_is_seen_after_the_version_check(push, load, store, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(push.member_token_cache, '_clock', lambda: now[0])
+    family = load('management-family')
+    store.seed(MEMBERS + '/m1', {'name': 'taro', 'deviceToken': 'old'})
+    assert tokens(push) == ['old']
+
+    # management-family は push-notification のキャッシュを直接無効化できない（別のインスタンス）
+    status, _, _ = call(family.family_members_handler, 'PUT', {'familyId': 'f1'},
+                        {'memberId': 'm1', 'name': 'taro', 'deviceToken': 'new'})
+    assert status == 200
+    assert tokens(push) == ['old']
+
+    now[0] += push.member_token_cache.version_check_seconds
+    assert tokens(push) == ['new']
+    assert push.member_token_cache.stats()['stale'] == 1
+
+
+def test_unchanged_members_are_served_from_the_cache_without_reads(push, store):
+    store.seed(MEMBERS + '/m1', {'name': 'taro', 'deviceToken': 't1'})
+    tokens(push)
+    store.reset_stats()
+
+    assert tokens(push) == ['t1']
+
+    assert dict(store.rpcs) == {}
+    assert push.member_token_cache.stats()['hits'] == 1
+
+
+def test_expired_version_check_reads_only_the_version(push, store, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(push.member_token_cache, '_clock', lambda: now[0])
+    store.seed(MEMBERS + '/m1', {'name': 'taro', 'deviceToken': 't1'})
+    tokens(push)
+    store.reset_stats()
+
+    now[0] += push.member_token_cache.version_check_seconds
+    assert tokens(push) == ['t1']
+
+    # バージョンのドキュメント1件だけを読む（メンバーのクエリはしない）
+    assert dict(store.rpcs) == {'get': 1}
+
+
+def test_version_is_not_checked_within_version_check_seconds(push):
+    now = [0.0]
+    versions = iter(range(100))
+    cache = push.MemberTokenCache(ttl_seconds=300, version_check_seconds=10,
+                                  loader=lambda family_id: [], version_loader=lambda family_id: next(versions),
+                                  clock=lambda: now[0])
+    cache.get('f1')
+    now[0] = 5
+    cache.get('f1')
+    assert cache.stats()['hits'] == 1
+
+    now[0] = 20
+    cache.get('f1')
+    assert cache.stats()['stale'] == 1
+
+
+def test_counters_are_exact_under_concurrency(push):
+    cache = push.MemberTokenCache(ttl_seconds=300, loader=lambda family_id: [],
+                                  version_loader=lambda family_id: 0)
+
+    def read():
+        for _ in range(500):
+            cache.get('f1')
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = cache.stats()
+    assert stats['hits'] + stats['misses'] == 8 * 500
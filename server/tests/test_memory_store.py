@@ -0,0 +1,150 @@
+"""
+インメモリの Firestore（storage.MemoryFirestore）が本物と同じ振る舞いをすること
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+from google.api_core import exceptions
+from google.cloud import firestore
+
+from storage import AsyncMemoryFirestore, create_async_client, create_client
+
+
+def test_batch_writes_nothing_when_one_precondition_fails(store):
+    store.seed('c/a', {'n': 1})
+    batch = store.batch()
+    batch.set(store.document('c/b'), {'n': 2})
+    batch.update(store.document('c/missing'), {'n': 3})
+
+    with pytest.raises(exceptions.NotFound):
+        batch.commit()
+
+    assert store.dump('c/') == {'c/a': {'n': 1}}
+
+
+def test_last_update_time_precondition(store):
+    store.seed('c/a', {'n': 1})
+    snapshot = store.document('c/a').get()
+    store.document('c/a').update({'n': 2})
+
+    with pytest.raises(exceptions.FailedPrecondition):
+        store.document('c/a').update({'n': 3}, option=store.write_option(last_update_time=snapshot.update_time))
+
+    fresh = store.document('c/a').get()
+    store.document('c/a').update({'n': 3}, option=store.write_option(last_update_time=fresh.update_time))
+    assert store.document('c/a').get().to_dict() == {'n': 3}
+
+
+def test_transforms(store):
+    store.seed('c/a', {'counts': {'x': 1}, 'gone': True})
+    store.document('c/a').set({'counts': {'x': firestore.Increment(2), 'y': firestore.Increment(1)},
+                               'gone': firestore.DELETE_FIELD, 'at': firestore.SERVER_TIMESTAMP}, merge=True)
+
+    data = store.document('c/a').get().to_dict()
+    assert data['counts'] == {'x': 3, 'y': 1}
+    assert 'gone' not in data
+    assert data['at'] == store.document('c/a').get().update_time
+
+
+def test_transaction_is_retried_when_a_read_document_changes(store):
+    store.seed('c/a', {'n': 0})
+    attempts = []
+
+    @firestore.transactional
+    def increment(transaction):
+        n = store.document('c/a').get(transaction=transaction).to_dict()['n']
+        attempts.append(n)
+        if len(attempts) == 1:
+            # 読んだ後に別のクライアントが書き込んだ
+            store.document('c/a').set({'n': 10})
+        transaction.set(store.document('c/a'), {'n': n + 1})
+
+    increment(store.transaction())
+
+    assert attempts == [0, 10]
+    assert store.document('c/a').get().to_dict() == {'n': 11}
+
+
+def test_queries_filter_order_page_and_project(store):
+    for doc_id, value in [('a', 'b'), ('b', None), ('c', 3), ('d', 'a'), ('e', 1)]:
+        store.seed(f'c/{doc_id}', {'v': value, 'other': doc_id})
+    store.seed('c/f', {'other': 'no v'})
+    store.seed('c/a/sub/x', {'v': 0})
+
+    ordered = store.collection('c').order_by('v')
+    # null < 数値 < 文字列。v のないドキュメントとサブコレクションは含まれない
+    assert [doc.id for doc in ordered.stream()] == ['b', 'e', 'c', 'd', 'a']
+
+    page = ordered.start_after({'v': 1, '__name__': 'e'}).limit(2).select(['v'])
+    assert [(doc.id, doc.to_dict()) for doc in page.stream()] == [('c', {'v': 3}), ('d', {'v': 'a'})]
+
+    assert [doc.id for doc in store.collection('c').where('v', '>', 1).stream()] == ['c']
+
+
+def test_bulk_batch_reports_each_write_separately(store):
+    store.seed('c/a', {'n': 1})
+    batch = store.bulk_batch()
+    batch.update(store.document('c/missing'), {'n': 1})
+    batch.create(store.document('c/a'), {'n': 2})
+    batch.set(store.document('c/b'), {'n': 3})
+
+    response = batch.commit()
+
+    assert [status.code for status in response.status] == [5, 6, 0]
+    assert store.dump('c/') == {'c/a': {'n': 1}, 'c/b': {'n': 3}}
+
+
+def test_rpcs_are_counted_and_delayed(store):
+    slow = type(store)(rpc_latency_ms={'get': 30})
+    slow.seed('c/a', {'n': 1})
+
+    started = time.perf_counter()
+    slow.document('c/a').get()
+    list(slow.collection('c').stream())
+
+    assert dict(slow.rpcs) == {'get': 1, 'query': 1}
+    assert time.perf_counter() - started >= 0.03
+
+
+def test_async_client_reads_the_same_data(store):
+    store.seed('c/a', {'n': 1})
+    client = create_async_client(store)
+    assert isinstance(client, AsyncMemoryFirestore)
+
+    async def read():
+        return await asyncio.gather(client.document('c/a').get(), client.collection('c').get())
+
+    doc, docs = asyncio.run(read())
+
+    assert doc.to_dict() == {'n': 1}
+    assert [d.id for d in docs] == ['a']
+
+
+def test_snapshot_listener_receives_changes(store):
+    received = []
+    changed = threading.Event()
+
+    def on_snapshot(docs, changes, read_time):
+        received.append(sorted(doc.id for doc in docs))
+        if len(received) == 2:
+            changed.set()
+
+    watch = store.collection('c').on_snapshot(on_snapshot)
+    store.document('c/a').set({'n': 1})
+
+    assert changed.wait(2)
+    assert ['a'] in received
+    watch.unsubscribe()
+
+
+def test_create_client_uses_the_storage_backend(monkeypatch):
+    monkeypatch.setenv('STORAGE_BACKEND', 'memory')
+    monkeypatch.setenv('MEMORY_STORE_LATENCY_MS', '2')
+
+    client = create_client()
+
+    assert client.latency_ms == 2
+    with pytest.raises(ValueError):
+        create_client('sqlite')
@@ -0,0 +1,112 @@
+"""
+家族ミッションの進捗の集計（write_mission の Increment と read_mission_summary）
+"""
+import pytest
+
+from conftest import call
+
+COLLECTION = 'family-management/f1/missions'
+SUMMARY = 'family-management/f1/collection-meta/missions-summary'
+
+
+@pytest.fixture
+def service(load):
+    return load('update-family-mission')
+
+
+def create(service, mission, is_cleared=False):
+    status, body, _ = call(service.family_missions_handler, 'POST', {'familyId': 'f1'},
+                           {'mission': mission, 'isCleared': is_cleared, 'createdAt': '2026-10-01T00:00:00Z'})
+    assert status == 200
+    return body['doc_id']
+
+
+def update(service, doc_id, is_cleared):
+    return call(service.family_missions_handler, 'PUT', {'familyId': 'f1'},
+                {'doc_id': doc_id, 'mission': 'm', 'isCleared': is_cleared})[0]
+
+
+def delete(service, doc_id):
+    return call(service.family_missions_handler, 'DELETE', {'familyId': 'f1', 'doc_id': doc_id})[0]
+
+
+def summary(service):
+    status, body, _ = call(service.family_missions_handler, 'GET', {'familyId': 'f1', 'summary': '1'})
+    assert status == 200
+    return body['total'], body['cleared'], body['clearedToday']
+
+
+def recounted(service, store):
+    counted = service.count_missions(store.collection(COLLECTION).stream(), service.today_string())
+    return counted['total'], counted['cleared'], counted['clearedByDay'][service.today_string()]
+
+
+def test_summary_follows_creates_updates_and_deletes(service, store):
+    first = create(service, 'a', is_cleared=True)
+    second = create(service, 'b')
+    create(service, 'c')
+    assert summary(service) == (3, 1, 1)
+
+    assert update(service, second, True) == 200
+    assert update(service, first, False) == 200
+    assert delete(service, second) == 200
+
+    assert summary(service) == (2, 0, 0)
+    assert summary(service) == recounted(service, store)
+
+
+def test_create_is_one_rpc_and_update_reads_once(service, store):
+    doc_id = create(service, 'warm up')
+    store.reset_stats()
+
+    create(service, 'a')
+    assert dict(store.rpcs) == {'commit': 1}
+
+    store.reset_stats()
+    assert update(service, doc_id, True) == 200
+    assert dict(store.rpcs) == {'get': 1, 'commit': 1}
+
+    store.reset_stats()
+    assert update(service, 'missing', True) == 404
+    assert dict(store.rpcs) == {'get': 1}
+
+
+def test_update_rereads_when_the_mission_changed_after_the_read(service, store, monkeypatch):
+    doc_id = create(service, 'a')
+    batch = store.batch
+    calls = []
+
+    def batch_after_concurrent_clear():
+        calls.append(1)
+        if len(calls) == 1:
+            # 読んだ後、コミットの前に別のリクエストがクリアした
+            assert update(service, doc_id, True) == 200
+        return batch()
+
+    monkeypatch.setattr(store, 'batch', batch_after_concurrent_clear)
+    assert update(service, doc_id, False) == 200
+
+    assert len(calls) == 3
+    assert summary(service) == recounted(service, store) == (1, 0, 0)
+
+
+def test_summary_without_a_count_is_rebuilt(service, store):
+    store.seed(COLLECTION + '/a', {'mission': 'a', 'isCleared': True, 'clearedOn': '2026-01-01'})
+    store.seed(COLLECTION + '/b', {'mission': 'b', 'isCleared': False})
+    # 集計がない家族で作成した場合は Increment だけされる
+    create(service, 'c')
+
+    assert summary(service) == (3, 1, 0)
+    assert 'countedAt' in store.dump(SUMMARY)[SUMMARY]
+
+
+def test_legacy_summary_keeps_counting_today(service, store):
+    today = service.today_string()
+    doc_id = create(service, 'a', is_cleared=True)
+    store.seed(SUMMARY, {'total': 1, 'cleared': 1, 'clearedToday': 1, 'clearedTodayDate': today})
+
+    create(service, 'b', is_cleared=True)
+    assert summary(service) == (2, 2, 2)
+
+    assert update(service, doc_id, False) == 200
+    assert summary(service) == (2, 1, 1)
@@ -0,0 +1,36 @@
+"""
+PUT / DELETE の RPC 数のベンチマーク（benchmarks/mutation_rpcs.py）を古いリビジョンと比較できること
+"""
+import subprocess
+
+import pytest
+
+import mutation_rpcs
+from conftest import SERVER_DIR
+from harness import load_service
+
+
+@pytest.fixture(scope='module')
+def baseline():
+    """
+    リポジトリの最初のコミット（import 時に firestore.Client() を作る、共通化する前のコード）
+    """
+    result = subprocess.run(['git', 'rev-list', '--max-parents=0', 'HEAD'], cwd=SERVER_DIR,
+                            capture_output=True, text=True)
+    if result.returncode != 0 or not result.stdout.strip():
+        pytest.skip('git の履歴がない')
+    return result.stdout.split()[-1]
+
+
+@pytest.mark.parametrize('service, handler_name, collection_path, id_key, parent, put_body', mutation_rpcs.SERVICES)
+def test_baseline_and_current_can_be_compared(baseline, service, handler_name, collection_path, id_key, parent,
+                                              put_body):
+    args = (handler_name, collection_path, id_key, parent, put_body)
+
+    before = mutation_rpcs.run_service(load_service(service, baseline), *args)
+    after = mutation_rpcs.run_service(load_service(service), *args)
+
+    assert [(scenario, status) for scenario, status, _, _ in before] == [
+        ('PUT existing', 200), ('PUT missing', 404), ('DELETE existing', 200), ('DELETE missing', 404)]
+    assert [status for _, status, _, _ in after] == [status for _, status, _, _ in before]
+    assert all(new[2] <= old[2] for old, new in zip(before, after))
@@ -0,0 +1,142 @@
+"""
+共通のメトリクスと Firestore の呼び出し回数の記録（common/observability.py）
+"""
+import types
+
+import pytest
+
+from common import observability
+from common.observability import Metrics, Telemetry, bucket_quantile
+
+
+def counters(metrics, name):
+    return {tuple(sorted(counter['labels'].items())): counter['value']
+            for counter in metrics.snapshot()['counters'] if counter['name'] == name}
+
+
+def histogram(metrics, name):
+    return next(h for h in metrics.snapshot()['histograms'] if h['name'] == name)
+
+
+def test_counters_are_keyed_by_name_and_labels():
+    metrics = Metrics('test')
+
+    metrics.inc('sends_total', result='success', code=200)
+    metrics.inc('sends_total', 2, code='200', result='success')
+    metrics.inc('sends_total', result='failure', code=410)
+
+    assert counters(metrics, 'sends_total') == {
+        (('code', '200'), ('result', 'success')): 3,
+        (('code', '410'), ('result', 'failure')): 1,
+    }
+
+
+def test_histogram_buckets_sum_and_quantiles():
+    metrics = Metrics('test')
+    for value in (1, 10, 10, 11, 1000):
+        metrics.observe('size', value, buckets=(1, 10, 100))
+
+    size = histogram(metrics, 'size')
+
+    # 上限ちょうどの値はそのバケットに、最大の上限を超えた値は最後の要素に入る
+    assert size['counts'] == [1, 2, 1, 1]
+    assert (size['count'], size['sum']) == (5, 1032)
+    assert (size['p50'], size['p95'], size['p99']) == (10, None, None)
+
+
+def test_bucket_quantile():
+    assert bucket_quantile((1, 10), [0, 0, 0], 0.5) is None
+    assert bucket_quantile((1, 10), [9, 1, 0], 0.9) == 1
+    assert bucket_quantile((1, 10), [9, 1, 0], 0.95) == 10
+
+
+def test_metrics_are_dumped_at_most_once_per_interval(monkeypatch):
+    logged = []
+    logger = types.SimpleNamespace(info=lambda message, extra: logged.append(extra['fields']))
+    monkeypatch.setattr(observability, 'METRICS_DUMP_SECONDS', 60)
+    metrics = Metrics('test', logger)
+    metrics.inc('requests_total')
+
+    metrics.maybe_dump()
+    metrics._last_dump -= 60
+    metrics.maybe_dump()
+    metrics.maybe_dump()
+
+    assert len(logged) == 1
+    assert logged[0]['service'] == 'test'
+    assert logged[0]['counters'] == [{'name': 'requests_total', 'labels': {}, 'value': 1}]
+
+
+class FakeFirestoreApi:
+    """
+    GAPIC クライアントの代わり（run_query は documents 件のドキュメントと、ドキュメントのない応答を1件返す）
+    """
+
+    def __init__(self, documents=0, writes=0):
+        self.documents = documents
+        self.writes = writes
+
+    @staticmethod
+    def _response(field):
+        return types.SimpleNamespace(_pb=types.SimpleNamespace(HasField=lambda name: name == field))
+
+    def run_query(self, request=None):
+        return iter([self._response('document')] * self.documents + [self._response(None)])
+
+    def batch_get_documents(self, request=None):
+        return iter([self._response('found'), self._response('missing')])
+
+    def commit(self, request=None):
+        return types.SimpleNamespace(write_results=[object()] * self.writes)
+
+
+@pytest.fixture
+def telemetry(monkeypatch):
+    monkeypatch.setattr(observability, '_background_telemetry', None)
+    monkeypatch.setattr(observability, 'METRICS_DUMP_SECONDS', 0)
+    return Telemetry('test')
+
+
+def test_rpcs_reads_and_writes_are_recorded_for_the_request(telemetry):
+    db = types.SimpleNamespace(_firestore_api=FakeFirestoreApi(documents=2, writes=3))
+    telemetry.instrument_firestore(db)
+
+    @telemetry.log_request
+    def handler(request):
+        list(db._firestore_api.run_query())
+        list(db._firestore_api.batch_get_documents())
+        db._firestore_api.commit()
+        return ('ok', 200)
+
+    handler(types.SimpleNamespace(method='GET'))
+
+    metrics = telemetry.metrics
+    assert counters(metrics, 'firestore_rpcs_total') == {
+        (('function', 'handler'), ('rpc', rpc)): 1 for rpc in ('run_query', 'batch_get_documents', 'commit')
+    }
+    assert counters(metrics, 'firestore_documents_read_total') == {(('function', 'handler'),): 3}
+    assert counters(metrics, 'firestore_documents_written_total') == {(('function', 'handler'),): 3}
+    assert histogram(metrics, 'firestore_reads_per_request')['sum'] == 3
+    assert counters(metrics, 'requests_total') == {(('function', 'handler'), ('method', 'GET'), ('status', '200')): 1}
+
+
+def test_calls_outside_a_request_are_recorded_as_background(telemetry):
+    db = types.SimpleNamespace(_firestore_api=FakeFirestoreApi(documents=1))
+    telemetry.instrument_firestore(db)
+
+    list(db._firestore_api.run_query())
+
+    assert counters(telemetry.metrics, 'firestore_rpcs_total') == {(('function', 'background'), ('rpc', 'run_query')): 1}
+
+
+def test_clients_are_wrapped_once(telemetry):
+    api = FakeFirestoreApi(writes=1)
+    db = types.SimpleNamespace(_firestore_api=api)
+    telemetry.instrument_firestore(db)
+    telemetry.instrument_firestore(db)
+
+    api.commit()
+
+    assert counters(telemetry.metrics, 'firestore_rpcs_total') == {(('function', 'background'), ('rpc', 'commit')): 1}
+    # GAPIC を持たないクライアントはそのまま
+    telemetry.instrument_firestore(types.SimpleNamespace())
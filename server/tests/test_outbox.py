@@ -0,0 +1,126 @@
+"""
+通知アウトボックス（キューへの登録・ドレイン・再送・破棄）
+"""
+import httpx
+import pytest
+
+from conftest import Clock, call, use_apns
+
+MEMBERS = 'family-management/f1/members'
+
+
+@pytest.fixture(params=['local', 'firestore'])
+def push(request, push, store, monkeypatch):
+    for member_id in ('m0', 'm1', 'm2'):
+        store.seed(f'{MEMBERS}/{member_id}', {'name': member_id, 'deviceToken': f'token-{member_id}'})
+    monkeypatch.setattr(push, 'NOTIFICATION_MODE', 'outbox')
+    monkeypatch.setattr(push, 'time', Clock())
+    outbox = push.LocalOutbox() if request.param == 'local' else push.FirestoreOutbox('notification-outbox')
+    monkeypatch.setattr(push, 'outbox', outbox)
+    return push
+
+
+@pytest.fixture
+def apns(push, monkeypatch):
+    """
+    トークンごとに返すステータスを決められる APNs のスタンドイン
+    apns['token-m1'] = [503, 200] なら1回目は 503、以降は 200 を返す。送信したトークンは apns['sent'] に残る
+    """
+    apns = {'sent': []}
+
+    def handle(request):
+        token = request.url.path.rsplit('/', 1)[-1]
+        apns['sent'].append(token)
+        statuses = apns.get(token) or [200]
+        status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+        if status == 200:
+            return httpx.Response(200)
+        reason = {400: 'BadDeviceToken', 503: 'ServiceUnavailable'}[status]
+        return httpx.Response(status, json={'reason': reason})
+
+    use_apns(push, monkeypatch, handle)
+    return apns
+
+
+def enqueue(push):
+    status, body, _ = call(push.send_family_goal_notification, 'POST',
+                           body={'familyId': 'f1', 'memberId': 'm0', 'memberName': 'm0', 'goalTitle': 'run'})
+    assert status == 200 and body['queued']
+    return body['jobId']
+
+
+def drain(push):
+    status, body, _ = call(push.drain_notification_outbox, 'POST')
+    assert status == 200
+    return body['claimed'], body['sent'], body['retried'], body['failed']
+
+
+def job(push, store, job_id):
+    if isinstance(push.outbox, push.LocalOutbox):
+        return push.outbox._jobs[job_id]
+    return store.dump(f'notification-outbox/{job_id}')[f'notification-outbox/{job_id}']
+
+
+def test_queued_notification_is_sent_by_the_drain(push, store, apns):
+    job_id = enqueue(push)
+    assert apns['sent'] == []
+
+    assert drain(push) == (1, 1, 0, 0)
+    assert sorted(apns['sent']) == ['token-m1', 'token-m2']
+    assert job(push, store, job_id)['status'] == 'sent'
+    assert drain(push) == (0, 0, 0, 0)
+
+
+def test_retry_waits_for_the_backoff_and_skips_delivered_members(push, store, apns):
+    apns['token-m1'] = [503, 200]
+    job_id = enqueue(push)
+
+    assert drain(push) == (1, 0, 1, 0)
+    assert job(push, store, job_id)['deliveredMemberIds'] == ['m2']
+
+    # バックオフの間は取得しない
+    assert drain(push) == (0, 0, 0, 0)
+
+    push.time.now += push.outbox_backoff_seconds(1)
+    assert drain(push) == (1, 1, 0, 0)
+    assert sorted(apns['sent']) == ['token-m1', 'token-m1', 'token-m2']
+    assert sorted(job(push, store, job_id)['deliveredMemberIds']) == ['m1', 'm2']
+
+
+def test_job_is_given_up_after_the_max_attempts(push, store, apns, monkeypatch):
+    monkeypatch.setattr(push, 'OUTBOX_MAX_ATTEMPTS', 3)
+    apns['token-m1'] = [503]
+    job_id = enqueue(push)
+
+    for attempt in (1, 2):
+        assert drain(push) == (1, 0, 1, 0)
+        push.time.now += push.outbox_backoff_seconds(attempt)
+    assert drain(push) == (1, 0, 0, 1)
+
+    stored = job(push, store, job_id)
+    assert stored['status'] == 'failed'
+    assert 'm1' in stored['lastError']
+    assert apns['sent'].count('token-m2') == 1
+
+    push.time.now += push.OUTBOX_BACKOFF_MAX_SECONDS
+    assert drain(push) == (0, 0, 0, 0)
+
+
+def test_permanent_failures_are_not_retried(push, store, apns):
+    store.seed(f'{MEMBERS}/m1', {'name': 'm1', 'deviceToken': 'token-m1', 'apnsEnvironment': 'other'})
+    apns['token-m1'] = [400]
+    job_id = enqueue(push)
+
+    assert drain(push) == (1, 1, 0, 0)
+    assert job(push, store, job_id)['deliveredMemberIds'] == ['m2']
+
+
+def test_job_left_by_a_crashed_drain_is_claimed_again_after_the_lease(push, store, apns):
+    job_id = enqueue(push)
+    assert [claimed_id for claimed_id, _ in push.outbox.claim_due(10, push.OUTBOX_LEASE_SECONDS)] == [job_id]
+
+    assert drain(push) == (0, 0, 0, 0)
+
+    push.time.now += push.OUTBOX_LEASE_SECONDS
+    assert drain(push) == (1, 1, 0, 0)
+    assert job(push, store, job_id)['attempts'] == 2
@@ -0,0 +1,115 @@
+"""
+リクエストのプロファイリング（common/profiling.py）
+"""
+import itertools
+import os
+import pstats
+import time
+import types
+from collections import deque
+
+import pytest
+
+from common import profiling
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', 'secret')
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_RATE', 0)
+    monkeypatch.setattr(profiling, '_profile_paths', deque())
+    return tmp_path
+
+
+def request(headers=None):
+    return types.SimpleNamespace(headers=headers or {})
+
+
+def run(func, headers=None):
+    telemetry = types.SimpleNamespace(service='test', logger=types.SimpleNamespace(warning=print))
+    return profiling.run_profiled(func, request(headers), telemetry)
+
+
+def test_every_nth_request_is_sampled(monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_RATE', 3)
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', None)
+    monkeypatch.setattr(profiling, '_profile_counter', itertools.count(1))
+
+    assert [profiling.should_profile(request()) for _ in range(6)] == [False, False, True, False, False, True]
+
+
+@pytest.mark.parametrize('configured, sent, expected', [
+    ('secret', 'secret', True),
+    ('secret', 'wrong', False),
+    ('secret', None, False),
+    (None, 'secret', False),
+])
+def test_debug_header_must_match_the_token(monkeypatch, configured, sent, expected):
+    monkeypatch.setattr(profiling, 'PROFILE_SAMPLE_RATE', 0)
+    monkeypatch.setattr(profiling, 'PROFILE_TOKEN', configured)
+    headers = {profiling.PROFILE_HEADER: sent} if sent else {}
+
+    assert profiling.should_profile(request(headers)) is expected
+
+
+def test_unprofiled_requests_write_nothing(profile_dir):
+    assert run(lambda request: 'ok') == 'ok'
+    assert os.listdir(profile_dir) == []
+
+
+def handler(request):
+    return sum(i * i for i in range(10000))
+
+
+def test_cprofile_mode_saves_pstats(profile_dir, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_MODE', 'cprofile')
+
+    assert run(handler, {profiling.PROFILE_HEADER: 'secret'}) == handler(None)
+
+    [name] = os.listdir(profile_dir)
+    assert name.startswith('test-handler-') and name.endswith('.prof')
+    stats = pstats.Stats(str(profile_dir / name))
+    assert any(function == 'handler' for _, _, function in stats.stats)
+
+
+def wait_for_apns(request):
+    time.sleep(0.1)
+    return 'sent'
+
+
+def test_sample_mode_saves_collapsed_stacks(profile_dir, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_MODE', 'sample')
+    monkeypatch.setattr(profiling, 'PROFILE_INTERVAL_SECONDS', 0.005)
+
+    assert run(wait_for_apns, {profiling.PROFILE_HEADER: 'secret'}) == 'sent'
+
+    [name] = os.listdir(profile_dir)
+    assert name.startswith('test-wait_for_apns-') and name.endswith('.folded')
+    lines = (profile_dir / name).read_text(encoding='utf-8').splitlines()
+    stacks = dict(line.rsplit(' ', 1) for line in lines)
+    # 待ち時間もサンプルに入る
+    assert any(stack.endswith('wait_for_apns (test_profiling.py)') for stack in stacks)
+    assert sum(int(count) for count in stacks.values()) >= 5
+
+
+def test_oldest_profiles_are_removed_beyond_the_max_files(profile_dir, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_MAX_FILES', 2)
+    logger = types.SimpleNamespace(warning=print)
+
+    def write(path):
+        with open(path, 'w') as f:
+            f.write(os.path.basename(path))
+
+    for i in range(3):
+        profiling.save_profile('test', f'handler{i}', time.time(), 'prof', write, logger)
+
+    assert sorted(name.split('-')[1] for name in os.listdir(profile_dir)) == ['handler1', 'handler2']
+
+
+def test_zero_max_files_saves_nothing(profile_dir, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_MAX_FILES', 0)
+
+    run(handler, {profiling.PROFILE_HEADER: 'secret'})
+
+    assert os.listdir(profile_dir) == []
@@ -0,0 +1,96 @@
+"""
+一覧の fields= による絞り込みと、JSONの圧縮（common/responses.py）
+"""
+import gzip
+import json
+import types
+from datetime import datetime, timezone
+
+import flask
+import pytest
+
+from common import responses
+from conftest import call
+
+COLLECTION = 'user-goals/u1/goals'
+
+
+@pytest.fixture
+def service(load, store):
+    for i in range(30):
+        store.seed(f'{COLLECTION}/g{i:02d}', {'title': f'goal {i}', 'detail': 'x' * 50, 'isCompleted': False,
+                                             'createdAt': f'2026-10-01T00:00:{i:02d}Z'})
+    return load('update-user-mission')
+
+
+def get(service, headers=None, **query):
+    """
+    圧縮されたままの (ステータス, 本体のバイト列, ヘッダー) を返す
+    """
+    app = flask.Flask('projection')
+    with app.test_request_context('/', query_string=dict(query, userId='u1'), headers=headers or {}):
+        body, status, response_headers = service.user_goals_handler(flask.request)
+    return status, body, response_headers
+
+
+def test_fields_limit_each_goal_to_the_requested_keys(service):
+    status, goals, _ = call(service.user_goals_handler, 'GET', {'userId': 'u1', 'fields': 'title'})
+
+    assert status == 200
+    assert len(goals) == 30
+    assert all(set(goal) == {'title', 'goalId'} for goal in goals)
+
+
+def test_projected_pages_still_have_a_cursor(service):
+    query = {'userId': 'u1', 'fields': 'goalId', 'limit': 20}
+    _, first, _ = call(service.user_goals_handler, 'GET', query)
+    _, second, _ = call(service.user_goals_handler, 'GET', dict(query, startAfter=first['nextCursor']))
+
+    assert all(list(goal) == ['goalId'] for goal in first['goals'] + second['goals'])
+    assert len({goal['goalId'] for goal in first['goals'] + second['goals']}) == 30
+    assert second['nextCursor'] is None
+
+
+def test_unknown_fields_are_rejected(service):
+    status, body, _ = call(service.user_goals_handler, 'GET', {'userId': 'u1', 'fields': 'title,secret'})
+
+    assert status == 400
+    assert 'secret' in body
+
+
+def test_large_lists_are_gzipped_when_accepted(service):
+    status, body, headers = get(service, {'Accept-Encoding': 'gzip'})
+
+    assert status == 200
+    assert headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in headers['Vary']
+    assert len(json.loads(gzip.decompress(body))) == 30
+
+
+def test_brotli_is_preferred_when_available(service, monkeypatch):
+    monkeypatch.setattr(responses, 'brotli', types.SimpleNamespace(compress=lambda body, quality: b'br' + body))
+
+    _, body, headers = get(service, {'Accept-Encoding': 'gzip, br'})
+
+    assert headers['Content-Encoding'] == 'br'
+    assert len(json.loads(body[2:])) == 30
+
+
+@pytest.mark.parametrize('headers, query', [
+    ({}, {}),
+    ({'Accept-Encoding': 'gzip'}, {'fields': 'goalId', 'limit': 1}),
+])
+def test_small_or_unaccepted_responses_are_not_compressed(service, headers, query):
+    _, body, response_headers = get(service, headers, **query)
+
+    assert 'Content-Encoding' not in response_headers
+    json.loads(body)
+
+
+def test_json_encoding_is_the_same_with_and_without_orjson(monkeypatch):
+    value = [{'goalId': 'g1', 'title': '目標', 'updatedAt': datetime(2026, 10, 1, 12, 30, tzinfo=timezone.utc)}]
+    encoded = responses.dumps_json(value)
+
+    monkeypatch.setattr(responses, 'orjson', None)
+
+    assert json.loads(responses.dumps_json(value)) == json.loads(encoded)
@@ -0,0 +1,82 @@
+"""
+家族への通知の並行送信（run_push_sends の同時送信数と締め切り）
+"""
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from conftest import use_apns
+
+MEMBERS = 'family-management/f1/members'
+
+
+def use_slow_apns(push, monkeypatch, seconds):
+    """
+    seconds 秒後に 200 を返す APNs のスタンドインに向け、(受けた件数, 同時送信数の最大, 完了) を返す
+    """
+    state = {'requests': 0, 'active': 0, 'max_active': 0, 'finished': threading.Event()}
+
+    async def handle(request):
+        state['requests'] += 1
+        state['active'] += 1
+        state['max_active'] = max(state['max_active'], state['active'])
+        await asyncio.sleep(seconds)
+        state['active'] -= 1
+        if state['active'] == 0:
+            state['finished'].set()
+        return httpx.Response(200)
+
+    use_apns(push, monkeypatch, handle)
+    return state
+
+
+def sends(count):
+    return [({'memberId': f'm{i}', 'name': f'member {i}', 'deviceToken': f't{i}'}, 'title', 'body', None, 'default')
+            for i in range(count)]
+
+
+def test_sends_run_concurrently_up_to_the_cap(push, monkeypatch):
+    state = use_slow_apns(push, monkeypatch, 0.1)
+
+    started = time.perf_counter()
+    results = push.run_push_sends(sends(12), concurrency=4, deadline=5)
+    elapsed = time.perf_counter() - started
+
+    assert all(item['result']['success'] for item in results)
+    assert [item['memberId'] for item in results] == [f'm{i}' for i in range(12)]
+    assert state['max_active'] == 4
+    assert elapsed < 0.3 * 4
+    assert push.apns_client.stats()['connects'] == 1
+
+
+def test_deadline_cancels_unsent_and_leaves_in_flight_sends_running(push, monkeypatch):
+    state = use_slow_apns(push, monkeypatch, 0.3)
+
+    results = push.run_push_sends(sends(3), concurrency=1, deadline=0.1)
+
+    first, *rest = [item['result'] for item in results]
+    assert first['in_flight'] and not push.is_retryable_result(first)
+    assert all(result['unsent'] and push.is_retryable_result(result) for result in rest)
+    assert push.count_send_results([item['result'] for item in results]) == (0, 2, 1)
+
+    # 送信中だったものは締め切り後も完了し、取り消したものは送られない
+    assert state['finished'].wait(2)
+    time.sleep(0.05)
+    assert state['requests'] == 1
+
+
+def test_family_response_counts_in_flight_sends_separately(push, monkeypatch, store):
+    store.seed(MEMBERS + '/m0', {'name': 'taro', 'deviceToken': 't0'})
+    store.seed(MEMBERS + '/m1', {'name': 'hanako', 'deviceToken': 't1'})
+    store.seed(MEMBERS + '/m2', {'name': 'jiro', 'deviceToken': 't2'})
+    state = use_slow_apns(push, monkeypatch, 0.3)
+
+    result = push.send_push_notifications_to_family('f1', 'm0', 'title', 'body', concurrency=1, deadline=0.1)
+
+    assert (result['sent_count'], result['failed_count'], result['in_flight_count']) == (0, 1, 1)
+    assert [item['memberId'] for item in result['results']] == ['m1', 'm2']
+    assert all('deviceToken' not in item for item in result['results'])
+    assert state['finished'].wait(2)
@@ -0,0 +1,56 @@
+"""
+Firestore の書き込みエラーのHTTPレスポンスへの変換（common/responses.py）
+"""
+import json
+
+import pytest
+from google.api_core import exceptions
+
+from common.responses import commit_write, firestore_error_response
+
+
+@pytest.mark.parametrize('error, response', [
+    (exceptions.NotFound('No document to update'), ('Goal not found', 404)),
+    (exceptions.AlreadyExists('Document already exists'), ('Already exists', 409)),
+    (exceptions.FailedPrecondition('The update time does not match'), ('Conflict', 409)),
+])
+def test_precondition_and_conflict_errors(error, response):
+    assert firestore_error_response(error, 'Goal not found') == response
+
+
+@pytest.mark.parametrize('error', [
+    exceptions.ServiceUnavailable('unavailable'),
+    exceptions.DeadlineExceeded('deadline'),
+    exceptions.Aborted('contention'),
+    exceptions.TooManyRequests('quota'),
+])
+def test_transient_errors_ask_the_client_to_retry(error):
+    body, status, headers = firestore_error_response(error, 'Goal not found')
+
+    assert status == 503
+    assert headers['Retry-After'] == '1'
+    assert json.loads(body) == {'error': 'Firestore is temporarily unavailable'}
+
+
+@pytest.mark.parametrize('error', [exceptions.PermissionDenied('denied'), ValueError('bug')])
+def test_other_errors_are_left_to_the_caller(error):
+    assert firestore_error_response(error, 'Goal not found') is None
+
+
+def test_commit_write_returns_the_mapped_response_or_raises(store):
+    store.seed('c/a', {'n': 1})
+    batch = store.batch()
+    batch.create(store.document('c/a'), {'n': 2})
+    assert commit_write(batch, 'Not found') == ('Already exists', 409)
+
+    batch = store.batch()
+    batch.set(store.document('c/b'), {'n': 1})
+    assert commit_write(batch, 'Not found') is None
+    assert store.dump('c/b') == {'c/b': {'n': 1}}
+
+    class Broken:
+        def commit(self):
+            raise exceptions.PermissionDenied('denied')
+
+    with pytest.raises(exceptions.PermissionDenied):
+        commit_write(Broken(), 'Not found')
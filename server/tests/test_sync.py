@@ -0,0 +1,56 @@
+"""
+差分同期の共通処理（common/sync.py）
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from common import sync
+
+COLLECTION = 'user-goals/u1/goals'
+TOMBSTONES = 'user-goals/u1/goal-tombstones'
+
+
+def test_sync_token_round_trips_to_the_microsecond():
+    timestamp = datetime(2026, 10, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+    token = sync.encode_sync_token(timestamp)
+
+    assert '=' not in token
+    assert sync.decode_sync_token(token) == timestamp
+
+
+@pytest.mark.parametrize('token', ['%%%', 'YWJj', '🙂'])
+def test_invalid_sync_token(token):
+    with pytest.raises(ValueError, match='since is invalid'):
+        sync.decode_sync_token(token)
+
+
+def test_tombstone_expires_after_the_retention():
+    data = sync.tombstone_data()
+
+    expected = datetime.now(timezone.utc) + timedelta(days=sync.TOMBSTONE_RETENTION_DAYS)
+    assert abs(data['expireAt'] - expected) < timedelta(seconds=5)
+    assert 'deletedAt' in data
+
+
+def test_changes_use_the_given_id_key_and_the_latest_time_as_the_next_token(store):
+    older = datetime(2026, 10, 1, tzinfo=timezone.utc)
+    newer = older + timedelta(hours=1)
+    deleted_at = newer + timedelta(hours=1)
+    store.seed(f'{COLLECTION}/a', {'title': 'a', 'updatedAt': older})
+    store.seed(f'{COLLECTION}/b', {'title': 'b', 'updatedAt': newer})
+    store.seed(f'{TOMBSTONES}/c', {'deletedAt': deleted_at})
+
+    first = sync.query_changes(store, COLLECTION, TOMBSTONES, '', 'goalId', ['goalId'])
+    assert first['reset'] is True
+    assert sorted(first['changed'], key=lambda doc: doc['goalId']) == [{'goalId': 'a'}, {'goalId': 'b'}]
+    # 初回同期では墓標を読まない
+    assert first['deleted'] == []
+    assert sync.decode_sync_token(first['syncToken']) == newer
+
+    second = sync.query_changes(store, COLLECTION, TOMBSTONES, sync.encode_sync_token(older), 'goalId')
+    assert [(doc['goalId'], doc['title']) for doc in second['changed']] == [('b', 'b')]
+    assert second['deleted'] == ['c']
+    assert sync.decode_sync_token(second['syncToken']) == deleted_at
+    assert second['reset'] is False
@@ -0,0 +1,99 @@
+"""
+目標の一覧（全件・ページング・NDJSON）
+"""
+import pytest
+
+from conftest import call
+
+COLLECTION = 'user-goals/u1/goals'
+NDJSON = {'Accept': 'application/x-ndjson'}
+
+
+@pytest.fixture
+def service(load):
+    return load('update-user-mission')
+
+
+def create(service, title, created_at):
+    status, body, _ = call(service.user_goals_handler, 'POST', {'userId': 'u1'},
+                           {'title': title, 'createdAt': created_at})
+    assert status == 200
+    return body['goalId']
+
+
+def list_goals(service, headers=None, **query):
+    status, body, _ = call(service.user_goals_handler, 'GET', dict(query, userId='u1'), headers=headers)
+    assert status == 200
+    return body
+
+
+def titles(goals):
+    return [goal['title'] for goal in goals]
+
+
+def test_null_created_at_does_not_fail_the_list(service):
+    create(service, 'old', '2026-10-01T00:00:00Z')
+    create(service, 'no date', None)
+    create(service, 'new', '2026-10-02T00:00:00Z')
+
+    assert titles(list_goals(service)) == ['new', 'old', 'no date']
+    assert titles(list_goals(service, NDJSON)) == titles(list_goals(service))
+
+
+def walk_pages(service, **query):
+    """
+    nextCursor をたどって全ページを読み、ページごとのタイトルのリストを返す
+    """
+    pages, cursor = [], None
+    while True:
+        page = list_goals(service, **dict(query, **({'startAfter': cursor} if cursor else {})))
+        pages.append(titles(page['goals']))
+        cursor = page['nextCursor']
+        if cursor is None:
+            return pages
+
+
+def test_pages_follow_created_at_without_gaps_or_duplicates(service):
+    # 同じ createdAt の目標がページ境界をまたいでもずれない
+    for i in range(7):
+        create(service, f'g{i}', f'2026-10-0{1 + i // 3}T00:00:00Z')
+
+    pages = walk_pages(service, limit=3)
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    flat = [title for page in pages for title in page]
+    assert sorted(flat) == [f'g{i}' for i in range(7)]
+    assert flat[:1] == ['g6'] and set(flat[-3:]) == {'g0', 'g1', 'g2'}
+
+
+def test_filters_apply_before_the_limit(service):
+    for i in range(4):
+        status, _, _ = call(service.user_goals_handler, 'POST', {'userId': 'u1'},
+                            {'title': f'g{i}', 'isCompleted': i % 2 == 0, 'createdAt': f'2026-10-0{i + 1}T00:00:00Z'})
+        assert status == 200
+
+    assert walk_pages(service, limit=1, isCompleted='true') == [['g2'], ['g0']]
+    assert walk_pages(service, createdAfter='2026-10-02T00:00:00Z') == [['g3', 'g2']]
+
+
+def test_limit_is_capped(service, monkeypatch):
+    monkeypatch.setattr(service, 'MAX_PAGE_SIZE', 2)
+    for i in range(3):
+        create(service, f'g{i}', f'2026-10-0{i + 1}T00:00:00Z')
+
+    page = list_goals(service, limit=50)
+
+    assert titles(page['goals']) == ['g2', 'g1']
+    assert page['nextCursor'] is not None
+
+
+@pytest.mark.parametrize('query', [
+    {'limit': '0'},
+    {'limit': 'ten'},
+    {'startAfter': 'not-a-cursor'},
+    {'isCompleted': 'yes'},
+])
+def test_invalid_page_parameters_are_rejected(service, query):
+    status, _, _ = call(service.user_goals_handler, 'GET', dict(query, userId='u1'))
+
+    assert status == 400
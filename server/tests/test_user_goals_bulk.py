@@ -0,0 +1,89 @@
+"""
+目標の一括書き込み（operations）の操作ごとの結果と墓標
+"""
+import pytest
+
+from conftest import call
+
+COLLECTION = 'user-goals/u1/goals'
+TOMBSTONES = 'user-goals/u1/goal-tombstones'
+
+
+@pytest.fixture
+def service(load):
+    return load('update-user-mission')
+
+
+def apply(service, operations):
+    status, body, _ = call(service.user_goals_handler, 'POST', {'userId': 'u1'}, {'operations': operations})
+    assert status == 200
+    return body
+
+
+def test_each_operation_gets_its_own_result(service, store):
+    store.collection(COLLECTION).document('g1').set({'title': 'old'})
+
+    body = apply(service, [
+        {'op': 'create', 'goal': {'title': 'new'}},
+        {'op': 'update', 'goalId': 'g1', 'goal': {'title': 'renamed'}},
+        {'op': 'update', 'goalId': 'missing', 'goal': {'title': 'x'}},
+        {'op': 'delete', 'goalId': 'missing'},
+        {'op': 'unknown'},
+    ])
+
+    assert [result['status'] for result in body['results']] == [200, 200, 404, 404, 400]
+    assert (body['succeeded'], body['failed']) == (2, 3)
+    assert store.collection(COLLECTION).document('g1').get().to_dict()['title'] == 'renamed'
+    created_id = body['results'][0]['goalId']
+    assert store.collection(COLLECTION).document(created_id).get().exists
+
+
+def test_tombstone_is_written_only_for_successful_deletes(service, store):
+    store.collection(COLLECTION).document('g1').set({'title': 'done'})
+
+    body = apply(service, [
+        {'op': 'delete', 'goalId': 'g1'},
+        {'op': 'delete', 'goalId': 'missing'},
+    ])
+
+    assert [result['status'] for result in body['results']] == [200, 404]
+    assert not store.collection(COLLECTION).document('g1').get().exists
+    assert store.collection(TOMBSTONES).document('g1').get().exists
+    assert not store.collection(TOMBSTONES).document('missing').get().exists
+
+
+def test_deleting_the_same_goal_twice_splits_the_batch(service, store):
+    store.collection(COLLECTION).document('g1').set({'title': 'done'})
+
+    body = apply(service, [
+        {'op': 'delete', 'goalId': 'g1'},
+        {'op': 'delete', 'goalId': 'g1'},
+    ])
+
+    assert [result['status'] for result in body['results']] == [200, 404]
+    assert store.collection(TOMBSTONES).document('g1').get().exists
+
+
+def test_malformed_operations_fail_on_their_own(service, store):
+    store.collection(COLLECTION).document('g1').set({'title': 'old'})
+
+    body = apply(service, [
+        {'op': 'create', 'goal': 'new'},
+        {'op': 'update', 'goalId': 'g1', 'goal': ['renamed']},
+        {'op': 'update', 'goalId': 'g1/sub/g2', 'goal': {'title': 'x'}},
+        {'op': 'delete', 'goalId': ''},
+        'delete',
+        {'op': 'update', 'goalId': 'g1', 'goal': {'title': 'renamed'}},
+    ])
+
+    assert [result['status'] for result in body['results']] == [400, 400, 400, 400, 400, 200]
+    assert body['results'][0]['error'] == 'goal must be an object'
+    assert (body['succeeded'], body['failed']) == (1, 5)
+    assert store.collection(COLLECTION).document('g1').get().to_dict()['title'] == 'renamed'
+
+
+@pytest.mark.parametrize('method', ['POST', 'PUT'])
+def test_non_object_payload_is_rejected(service, method):
+    status, body, _ = call(service.user_goals_handler, method, {'userId': 'u1'}, [{'title': 'a'}])
+
+    assert (status, body) == (400, 'JSON payload must be an object')
@@ -1,14 +1,282 @@
 # main.py
 
+import time
+_import_started = time.perf_counter()
+
 import functions_framework
-from google.cloud import firestore
 import json
+import os
+import sys
+import threading
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+# 共通モジュール（server/common）。単独でデプロイする場合は python -m common.vendor でコピーしておく
+try:
+    import common  # noqa: F401
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        import common  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            "common パッケージが見つかりません。このサービスを単独でデプロイする場合は、"
+            "server/ で python -m common.vendor update-family-mission を実行してからデプロイしてください"
+        ) from e
+from common import observability
+from common.observability import add_log_fields
+from common.responses import (
+    json_default, parse_fields, select_fields, project_fields, json_response, wants_ndjson,
+    ndjson_response, bump_collection_version, collection_etag, firestore_error_response
+)
+from common.sync import query_changes, tombstone_data
+from common.idempotency import cached_replay, idempotency_key, request_fingerprint, write_idempotent
+
+# ログ・メトリクス・起動時間の計測（common/observability.py）
+SERVICE_NAME = 'update-family-mission'
+telemetry = observability.Telemetry(SERVICE_NAME)
+logger = telemetry.logger
+metrics = telemetry.metrics
+startup_report = telemetry.startup_report
+record_init_timing = telemetry.record_init_timing
+instrument_firestore = telemetry.instrument_firestore
+log_request = telemetry.log_request
+
+# Firestoreクライアント（最初に使うときに作成し、インスタンス内で使い回す）
+# google.cloud.firestore の import も初回利用時まで遅らせてコールドスタートを短縮する
+_db = None
+_db_lock = threading.Lock()
+
+def get_db():
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                started = time.perf_counter()
+                from google.cloud import firestore
+                db = firestore.Client()
+                instrument_firestore(db)
+                _db = db
+                record_init_timing('firestore_client_ms', started)
+    return _db
+
+# 一覧で返せるミッションのフィールド
+MISSION_FIELDS = ('mission', 'isCleared', 'createdAt', 'updatedAt', 'clearedOn')
+
+# 進捗の集計で「今日」を判定するタイムゾーン
+MISSION_SUMMARY_TIMEZONE = os.environ.get('MISSION_SUMMARY_TIMEZONE', 'Asia/Tokyo')
+
+def today_string():
+    return datetime.now(ZoneInfo(MISSION_SUMMARY_TIMEZONE)).date().isoformat()
+
+def mission_summary_ref(db, collection_path):
+    """
+    家族ごとの進捗の集計ドキュメント
+    例: family-management/{familyId}/missions -> family-management/{familyId}/collection-meta/missions-summary
+    """
+    parent_path, name = collection_path.rsplit('/', 1)
+    return db.document(f'{parent_path}/collection-meta/{name}-summary')
+
+def count_missions(docs, today):
+    """
+    ミッション一覧から集計（total / cleared / 今日のクリア数）を数える
+    """
+    summary = {'total': 0, 'cleared': 0, 'clearedByDay': {today: 0}}
+    for doc in docs:
+        mission = doc.to_dict() or {}
+        summary['total'] += 1
+        if mission.get('isCleared'):
+            summary['cleared'] += 1
+            if mission.get('clearedOn') == today:
+                summary['clearedByDay'][today] += 1
+    return summary
+
+def summary_increments(before, after):
+    """
+    1件のミッションの変更前後（作成時は before、削除時は after が None）から、集計に足す差分を Increment で作る
+    今日のクリア数はクリアした日（clearedOn）ごとに clearedByDay.{日付} で数える（変化のない項目は含めない）
+    """
+    from google.cloud import firestore
+
+    deltas = {'total': 0, 'cleared': 0}
+    by_day = {}
+    for mission, sign in ((before, -1), (after, 1)):
+        if not mission:
+            continue
+        deltas['total'] += sign
+        if mission.get('isCleared'):
+            deltas['cleared'] += sign
+            if mission.get('clearedOn'):
+                by_day[mission['clearedOn']] = by_day.get(mission['clearedOn'], 0) + sign
+    changes = {key: firestore.Increment(value) for key, value in deltas.items() if value}
+    by_day = {day: firestore.Increment(value) for day, value in by_day.items() if value}
+    if by_day:
+        changes['clearedByDay'] = by_day
+    return changes
+
+def is_counted_summary(summary):
+    """
+    集計ドキュメントがコレクションから数えたものか
+    countedAt（rebuild_mission_summary で設定）か、以前のトランザクションで書いた形式（clearedTodayDate）があれば、
+    その後の Increment と合わせて正しい。ない場合は集計がないまま Increment だけされたもの
+    """
+    return summary is not None and ('countedAt' in summary or 'clearedTodayDate' in summary)
+
+def cleared_today_count(summary, today):
+    """
+    今日のクリア数（以前の形式の clearedToday に、その後の clearedByDay の増減を足す）
+    """
+    legacy = summary.get('clearedToday', 0) if summary.get('clearedTodayDate') == today else 0
+    return max(legacy + (summary.get('clearedByDay') or {}).get(today, 0), 0)
+
+# 更新・削除で、読んでから書くまでの間に別の書き込みがあった場合に読み直す回数
+WRITE_MISSION_ATTEMPTS = 5
+
+def write_mission(db, collection_path, doc_ref, data, creating=False, tombstone_ref=None, idempotency=None):
+    """
+    ミッションの作成・更新・削除と進捗の集計を1回のコミットで書き込む
+    - creating=True で作成、data が None の場合は削除（tombstone_ref に墓標を残す）
+    - 集計は同じバッチで Increment する（集計ドキュメントは読まない）
+    - 作成は1 RPC。idempotency（冪等キーのドキュメントの (参照, データ)）を指定した場合は一緒に create し、
+      キーが既にあればコミット全体が AlreadyExists で失敗する（write_idempotent が保存済みの内容を返す）
+    - 更新・削除は集計の差分に変更前の isCleared / clearedOn が必要なため、ミッションを1回読み、
+      その更新時刻を前提条件にして書く（2 RPC）。間に別の書き込みがあれば読み直す
+    """
+    from google.api_core import exceptions
+    from google.cloud import firestore
+
+    summary_ref = mission_summary_ref(db, collection_path)
+    today = today_string()
+
+    for _ in range(WRITE_MISSION_ATTEMPTS):
+        before = None
+        option = None
+        if not creating:
+            snapshot = doc_ref.get()
+            if not snapshot.exists:
+                raise exceptions.NotFound(f'No document to write: {doc_ref.path}')
+            before = snapshot.to_dict()
+            option = db.write_option(last_update_time=snapshot.update_time)
+
+        after = None
+        if data is not None:
+            after = {**(before or {}), **data}
+            if after.get('isCleared'):
+                # クリアした日を残す（クリア済みのままの更新では元の日付を引き継ぐ）
+                was_cleared = before and before.get('isCleared')
+                after['clearedOn'] = before.get('clearedOn') if was_cleared else today
+            else:
+                after['clearedOn'] = None
+            data['clearedOn'] = after['clearedOn']
+
+        batch = db.batch()
+        if data is None:
+            batch.delete(doc_ref, option=option)
+            batch.set(tombstone_ref, tombstone_data())
+        elif creating:
+            batch.create(doc_ref, data)
+            if idempotency:
+                batch.create(*idempotency)
+        else:
+            batch.update(doc_ref, data, option=option)
+        changes = summary_increments(before, after)
+        if changes:
+            batch.set(summary_ref, {**changes, 'updatedAt': firestore.SERVER_TIMESTAMP}, merge=True)
+        bump_collection_version(batch, db, collection_path)
+        try:
+            batch.commit()
+            return None
+        except exceptions.FailedPrecondition:
+            # 読んだ後にミッションが更新・削除された（読み直して差分を作り直す）
+            if creating:
+                raise
+            logger.info("ミッションが同時に更新されたため読み直します: %s", doc_ref.path)
+    raise exceptions.Aborted(f'Too much contention on {doc_ref.path}')
 
-db = firestore.Client()
+def read_mission_summary(db, collection_path):
+    """
+    集計ドキュメント1件だけを読んで進捗を返す（まだない、または数えていない場合は作り直す）
+    """
+    snapshot = mission_summary_ref(db, collection_path).get()
+    summary = snapshot.to_dict() if snapshot.exists else None
+    if not is_counted_summary(summary):
+        summary = rebuild_mission_summary(db, collection_path)
+    today = today_string()
+    return {
+        'total': max(summary.get('total', 0), 0),
+        'cleared': max(summary.get('cleared', 0), 0),
+        # 日付が変わっていれば今日のクリア数は0
+        'clearedToday': cleared_today_count(summary, today),
+        'date': today,
+        'lastUpdated': summary.get('updatedAt')
+    }
+
+def rebuild_mission_summary(db, collection_path):
+    """
+    コレクションを全件読んで集計ドキュメントを作り直す（既存データの移行・修復用）
+    数えている間に Increment された場合はトランザクションをやり直す
+    """
+    from google.cloud import firestore
+
+    summary_ref = mission_summary_ref(db, collection_path)
+    today = today_string()
+
+    @firestore.transactional
+    def run(transaction):
+        summary_ref.get(transaction=transaction)
+        summary = count_missions(db.collection(collection_path).stream(transaction=transaction), today)
+        transaction.set(summary_ref, {
+            **summary,
+            'countedAt': firestore.SERVER_TIMESTAMP,
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        })
+        return summary
+
+    summary = run(db.transaction())
+    summary['updatedAt'] = datetime.now(timezone.utc)
+    return summary
+
+# 1回のコミットで更新するミッションの数（Firestore の上限は500件、バージョンの更新の分を空けておく）
+BACKFILL_BATCH_SIZE = 499
+
+def backfill_created_at(db, collection_path):
+    """
+    createdAt フィールドのないミッションに、ドキュメントの作成時刻を設定する（戻り値は更新した件数）
+    一覧は createdAt で並び替えるため、フィールドのないドキュメントは一覧に含まれない。
+    値はアプリが送るのと同じ ISO 8601 の文字列にし、差分同期で伝わるよう updatedAt も進める
+    """
+    from google.cloud import firestore
+
+    missing = [doc for doc in db.collection(collection_path).stream() if 'createdAt' not in doc.to_dict()]
+    for start in range(0, len(missing), BACKFILL_BATCH_SIZE):
+        batch = db.batch()
+        for doc in missing[start:start + BACKFILL_BATCH_SIZE]:
+            created_at = doc.create_time.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            batch.update(doc.reference, {'createdAt': created_at, 'updatedAt': firestore.SERVER_TIMESTAMP})
+        bump_collection_version(batch, db, collection_path)
+        batch.commit()
+    return len(missing)
+
+def run_write(write, not_found_message):
+    """
+    write_mission の書き込みを実行する（成功時は None、既知のエラーはHTTPレスポンスを返す）
+    """
+    try:
+        write()
+    except Exception as e:
+        response = firestore_error_response(e, not_found_message)
+        if response is None:
+            raise
+        logger.info("書き込みの前提条件エラー: %s", e)
+        return response
+    return None
 
 @functions_framework.http
+@log_request
 def family_missions_handler(request):
     try:
+        db = get_db()
+
         # familyIdの取得（クエリ or JSONボディ）
         family_id = request.args.get('familyId')
         doc_id = request.args.get('doc_id')
@@ -21,7 +289,26 @@ def family_missions_handler(request):
         if not family_id:
             return ('familyId must be provided', 400)
 
+        add_log_fields(family_id=family_id)
         collection_path = f'family-management/{family_id}/missions'
+        tombstone_collection_path = f'family-management/{family_id}/mission-tombstones'
+
+        # 進捗のサマリー: 集計ドキュメント1件だけを読む（日付で値が変わるため ETag は使わない）
+        if request.method == 'GET' and request.args.get('summary') in ('1', 'true'):
+            summary = read_mission_summary(db, collection_path)
+            add_log_fields(summary=True)
+            return (json.dumps({'familyId': family_id, **summary}, ensure_ascii=False, default=json_default), 200,
+                    {'Content-Type': 'application/json', 'Cache-Control': 'no-cache'})
+
+        # GETは条件付きリクエストに対応（変更がなければコレクションを読まずに304を返す）
+        cache_headers = {}
+        if request.method == 'GET':
+            etag = collection_etag(db, collection_path, request)
+            # 圧縮やエンコーダーでバイト列が変わるため弱い ETag にする
+            cache_headers = {'ETag': f'W/"{etag}"', 'Cache-Control': 'no-cache'}
+            if request.if_none_match.contains_weak(etag):
+                add_log_fields(not_modified=True)
+                return ('', 304, cache_headers)
 
         if request.method == 'POST':
             data = request.get_json(silent=True)
@@ -37,16 +324,35 @@ def family_missions_handler(request):
             if not isinstance(mission, str):
                 return ('mission must be a string', 400)
 
+            from google.cloud import firestore
             create_data = {
                 'isCleared': is_cleared,
                 'mission': mission,
-                'createdAt': created_at
+                'createdAt': created_at,
+                'updatedAt': firestore.SERVER_TIMESTAMP  # 差分同期用のサーバー時刻
             }
-            doc_ref = db.collection(collection_path).add(create_data)
+            try:
+                key = idempotency_key(request)
+            except ValueError as e:
+                return (str(e), 400)
+            fingerprint = request_fingerprint(data)
+            replay = cached_replay(collection_path, key, fingerprint)
+            if replay:
+                return replay
+
+            doc_ref = db.collection(collection_path).document()
             response = {
                 'result': 'created',
-                'doc_id': doc_ref[1].id
+                'doc_id': doc_ref.id
             }
+            # 作成と進捗の集計（と冪等キー）を1回のコミットで書き込む
+            replay = write_idempotent(
+                db, collection_path, key, fingerprint, response,
+                lambda record: write_mission(db, collection_path, doc_ref, create_data, creating=True, idempotency=record)
+            )
+            if replay:
+                return replay
+            add_log_fields(doc_id=doc_ref.id)
             return (json.dumps(response), 200, {'Content-Type': 'application/json'})
 
         elif request.method == 'PUT':
@@ -66,47 +372,112 @@ def family_missions_handler(request):
                 return ('doc_id must be provided as a string for update', 400)
 
             doc_ref = db.collection(collection_path).document(doc_id)
-            if not doc_ref.get().exists:
-                return ('Document not found', 404)
 
-            doc_ref.update({
+            from google.cloud import firestore
+            update_data = {
                 'isCleared': is_cleared,
-                'mission': mission
-            })
+                'mission': mission,
+                'updatedAt': firestore.SERVER_TIMESTAMP  # 差分同期用のサーバー時刻
+            }
+            error = run_write(lambda: write_mission(db, collection_path, doc_ref, update_data), 'Document not found')
+            if error:
+                return error
             response = {
                 'result': 'updated',
                 'doc_id': doc_id
             }
+            add_log_fields(doc_id=doc_id)
             return (json.dumps(response), 200, {'Content-Type': 'application/json'})
 
+        elif request.method == 'GET' and request.args.get('since') is not None:
+            # 差分同期: since 以降の変更と削除だけを返す（since= で初回の全件同期）
+            try:
+                fields = parse_fields(request, MISSION_FIELDS + ('doc_id',))
+                changes = query_changes(db, collection_path, tombstone_collection_path, request.args.get('since'),
+                                        'doc_id', fields)
+            except ValueError as e:
+                return (str(e), 400)
+            add_log_fields(count=len(changes['changed']), deleted=len(changes['deleted']), reset=changes['reset'])
+            return json_response(request, changes, cache_headers)
+
         elif request.method == 'GET':
-            docs = db.collection(collection_path).stream()
+            try:
+                fields = parse_fields(request, MISSION_FIELDS + ('doc_id',))
+            except ValueError as e:
+                return (str(e), 400)
+            # 作成日時順（新しい順）。JSON と NDJSON で同じクエリを使い、並び替えは Firestore 側で行う
+            # （createdAt が null のミッションは最後。createdAt フィールドのないドキュメントは order_by の結果に
+            # 含まれないため、API 以外で作成したミッションは python main.py backfill-created-at で補っておく）
+            from google.cloud import firestore
+            query = db.collection(collection_path).order_by('createdAt', direction=firestore.Query.DESCENDING)
+            docs = select_fields(query, fields, 'doc_id', required=('createdAt',)).stream()
+            if wants_ndjson(request):
+                # ストリーミング: 読んだ順にそのまま送る
+                return ndjson_response(docs, 'doc_id', fields, cache_headers)
             result = []
             for doc in docs:
                 doc_dict = doc.to_dict()
                 doc_dict['doc_id'] = doc.id
-                result.append(doc_dict)
-            
-            # 作成日時順にソート（新しい順）
-            result.sort(key=lambda x: x.get('createdAt', ''), reverse=false)
-            
-            return (json.dumps(result, ensure_ascii=False), 200, {'Content-Type': 'application/json'})
+                result.append(project_fields(doc_dict, fields, 'doc_id'))
+            add_log_fields(count=len(result))
+
+            return json_response(request, result, cache_headers)
 
         elif request.method == 'DELETE':
             if not doc_id or not isinstance(doc_id, str):
                 return ('doc_id must be provided as a string for delete', 400)
             doc_ref = db.collection(collection_path).document(doc_id)
-            if not doc_ref.get().exists:
-                return ('Document not found', 404)
-            doc_ref.delete()
+            # 削除と同時に墓標を残し、差分同期で削除を伝えられるようにする
+            tombstone_ref = db.collection(tombstone_collection_path).document(doc_id)
+            error = run_write(lambda: write_mission(db, collection_path, doc_ref, None, tombstone_ref=tombstone_ref),
+                              'Document not found')
+            if error:
+                return error
             response = {
                 'result': 'deleted',
                 'doc_id': doc_id
             }
+            add_log_fields(doc_id=doc_id)
             return (json.dumps(response), 200, {'Content-Type': 'application/json'})
 
         else:
             return ('Method Not Allowed', 405)
 
     except Exception as e:
+        logger.exception("❌ 関数実行エラー: %s", e)
         return (json.dumps({'error': str(e)}), 500, {'Content-Type': 'application/json'})
+
+# import 完了までの時間を記録
+startup_report['import_ms'] = round((time.perf_counter() - _import_started) * 1000, 1)
+logger.info('startup', extra={'fields': dict(startup_report)})
+
+if __name__ == '__main__':
+    # 既存データから進捗の集計を作り直す
+    #   python main.py rebuild-summary            # すべての家族
+    #   python main.py rebuild-summary fam1 fam2  # 指定した家族のみ
+    # createdAt のないミッション（API 以外で作成したもの）に作成時刻を設定し、一覧に含まれるようにする
+    #   python main.py backfill-created-at [fam1 ...]
+    import argparse
+
+    parser = argparse.ArgumentParser(description='家族ミッションの管理ツール')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    rebuild_parser = subparsers.add_parser('rebuild-summary', help='進捗の集計ドキュメントを作り直す')
+    rebuild_parser.add_argument('family_ids', nargs='*', help='対象の familyId（省略時はすべて）')
+    backfill_parser = subparsers.add_parser('backfill-created-at', help='createdAt のないミッションに作成時刻を設定する')
+    backfill_parser.add_argument('family_ids', nargs='*', help='対象の familyId（省略時はすべて）')
+    args = parser.parse_args()
+
+    db = get_db()
+    family_ids = args.family_ids or [ref.id for ref in db.collection('family-management').list_documents()]
+    for family_id in family_ids:
+        if args.command == 'backfill-created-at':
+            updated = backfill_created_at(db, f'family-management/{family_id}/missions')
+            logger.info('createdAt backfilled', extra={'fields': {'family_id': family_id, 'updated': updated}})
+            continue
+        summary = rebuild_mission_summary(db, f'family-management/{family_id}/missions')
+        logger.info('summary rebuilt', extra={'fields': {
+            'family_id': family_id,
+            'total': summary['total'],
+            'cleared': summary['cleared'],
+            'cleared_today': cleared_today_count(summary, today_string())
+        }})
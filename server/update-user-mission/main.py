@@ -1,12 +1,340 @@
+import time
+_import_started = time.perf_counter()
+
 import functions_framework
-from google.cloud import firestore
 import json
+import base64
+import os
+import sys
+import threading
+
+# 共通モジュール（server/common）。単独でデプロイする場合は python -m common.vendor でコピーしておく
+try:
+    import common  # noqa: F401
+except ImportError:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        import common  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            "common パッケージが見つかりません。このサービスを単独でデプロイする場合は、"
+            "server/ で python -m common.vendor update-user-mission を実行してからデプロイしてください"
+        ) from e
+from common import observability
+from common.observability import add_log_fields
+from common.responses import (
+    parse_fields, select_fields, project_fields, json_response, wants_ndjson, ndjson_response,
+    bump_collection_version, collection_etag, commit_write
+)
+from common.sync import query_changes, tombstone_data
+from common.idempotency import cached_replay, idempotency_key, request_fingerprint, write_idempotent
+
+# ログ・メトリクス・起動時間の計測（common/observability.py）
+SERVICE_NAME = 'update-user-mission'
+telemetry = observability.Telemetry(SERVICE_NAME)
+logger = telemetry.logger
+metrics = telemetry.metrics
+startup_report = telemetry.startup_report
+record_init_timing = telemetry.record_init_timing
+instrument_firestore = telemetry.instrument_firestore
+log_request = telemetry.log_request
+
+# Firestoreクライアント（最初に使うときに作成し、インスタンス内で使い回す）
+# google.cloud.firestore の import も初回利用時まで遅らせてコールドスタートを短縮する
+_db = None
+_db_lock = threading.Lock()
+
+def get_db():
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                started = time.perf_counter()
+                from google.cloud import firestore
+                db = firestore.Client()
+                instrument_firestore(db)
+                _db = db
+                record_init_timing('firestore_client_ms', started)
+    return _db
+
+# ページング付きGETの1ページあたりの件数（既定値と上限）
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 20))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 100))
+
+# これらのクエリパラメータのいずれかがあればページング付きのレスポンスを返す
+PAGINATION_PARAMS = ('limit', 'startAfter', 'isCompleted', 'createdAfter')
+
+def encode_cursor(doc_dict, doc_id):
+    """
+    ページの最後のドキュメントから次ページ用の不透明なカーソルを作成
+    """
+    raw = json.dumps({'c': doc_dict.get('createdAt'), 'id': doc_id}, ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    カーソルを start_after に渡す値に戻す（不正な場合は ValueError）
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        if not isinstance(raw, dict) or not isinstance(raw.get('id'), str):
+            raise ValueError('invalid cursor')
+        return {'createdAt': raw.get('c'), '__name__': raw['id']}
+    except Exception:
+        raise ValueError('startAfter is invalid')
+
+def query_user_goals_page(db, collection_path, args, fields=None):
+    """
+    目標を新しい順に1ページ分だけFirestoreから取得する
+    並び替え・件数制限・カーソル・絞り込みはすべてFirestore側で行う
+    """
+    from google.cloud import firestore
+
+    limit = args.get('limit', DEFAULT_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be a positive integer')
+    if limit <= 0:
+        raise ValueError('limit must be a positive integer')
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    query = db.collection(collection_path)
+
+    is_completed = args.get('isCompleted')
+    if is_completed is not None:
+        if is_completed not in ('true', 'false'):
+            raise ValueError('isCompleted must be true or false')
+        # 注意: isCompleted + createdAt の複合インデックスが必要
+        query = query.where('isCompleted', '==', is_completed == 'true')
+
+    created_after = args.get('createdAfter')
+    if created_after:
+        query = query.where('createdAt', '>', created_after)
+
+    # createdAtが同じ場合もページ境界がずれないよう、ドキュメントIDでも並べる
+    query = (
+        query.order_by('createdAt', direction=firestore.Query.DESCENDING)
+        .order_by('__name__', direction=firestore.Query.DESCENDING)
+    )
+
+    start_after = args.get('startAfter')
+    if start_after:
+        query = query.start_after(decode_cursor(start_after))
+
+    # 次ページの有無を知るために1件多く取得する（カーソル用に createdAt は常に読む）
+    query = select_fields(query, fields, 'goalId', required=('createdAt',))
+    docs = list(query.limit(limit + 1).stream())
+    has_more = len(docs) > limit
+
+    goals = []
+    for doc in docs[:limit]:
+        doc_dict = doc.to_dict()
+        doc_dict['goalId'] = doc.id
+        goals.append(doc_dict)
+
+    next_cursor = encode_cursor(goals[-1], goals[-1]['goalId']) if has_more and goals else None
+    return {
+        'goals': [project_fields(goal, fields, 'goalId') for goal in goals],
+        'nextCursor': next_cursor
+    }
+
+# 一覧で返せる目標のフィールド
+GOAL_FIELDS = ('title', 'detail', 'isCompleted', 'createdAt', 'updatedAt')
+
+def build_goal_create_data(data):
+    """
+    作成リクエストから保存するGoalデータを作成（不正な場合は ValueError）
+    """
+    from google.cloud import firestore
+
+    if not isinstance(data, dict):
+        raise ValueError('goal must be an object')
+
+    # Goalデータ例: title, detail, isCompleted, createdAt など
+    title = data.get('title')
+    if not isinstance(title, str):
+        raise ValueError('title must be a string')
+
+    return {
+        'title': title,
+        'detail': data.get('detail'),
+        'isCompleted': data.get('isCompleted', False),
+        'createdAt': data.get('createdAt'),
+        'updatedAt': firestore.SERVER_TIMESTAMP  # 差分同期用のサーバー時刻
+    }
 
-db = firestore.Client()
+def build_goal_update_data(data):
+    """
+    更新リクエストから更新するフィールドだけを取り出す（不正な場合は ValueError）
+    """
+    from google.cloud import firestore
+
+    if not isinstance(data, dict):
+        raise ValueError('goal must be an object')
+
+    title = data.get('title')
+    if title is not None and not isinstance(title, str):
+        raise ValueError('title must be a string')
+
+    update_data = {}
+    for field in ('title', 'detail', 'isCompleted', 'createdAt'):
+        if data.get(field) is not None:
+            update_data[field] = data[field]
+    update_data['updatedAt'] = firestore.SERVER_TIMESTAMP  # 差分同期用のサーバー時刻
+    return update_data
+
+# 一括操作で受け付ける最大件数
+MAX_BULK_OPERATIONS = int(os.environ.get('MAX_BULK_OPERATIONS', 2000))
+
+# Firestoreの1回のバッチ書き込みの上限
+FIRESTORE_BATCH_LIMIT = 500
+
+# batch_write の結果コード（google.rpc.Code）とHTTPステータスの対応
+_RPC_STATUS_TO_HTTP = {
+    0: 200,   # OK
+    5: 404,   # NOT_FOUND（update / exists前提条件の失敗）
+    6: 409,   # ALREADY_EXISTS
+    9: 404,   # FAILED_PRECONDITION
+}
+
+def new_bulk_batch(db):
+    """
+    batch_write 用のバッチ（インメモリのストレージなど、独自の実装を持つクライアントはそれを使う）
+    """
+    if hasattr(db, 'bulk_batch'):
+        return db.bulk_batch()
+    from google.cloud.firestore_v1.bulk_batch import BulkWriteBatch
+    return BulkWriteBatch(db)
+
+def bulk_goal_id(operation, op):
+    """
+    一括操作の goalId（コレクション直下のドキュメントIDとして使えない場合は ValueError）
+    """
+    goal_id = operation.get('goalId')
+    if not isinstance(goal_id, str) or not goal_id or '/' in goal_id:
+        raise ValueError(f'goalId must be provided as a string for {op}')
+    return goal_id
+
+def apply_goal_operations(db, collection_path, tombstone_collection_path, operations):
+    """
+    複数の作成・更新・削除をまとめて書き込み、操作ごとの結果を返す
+    - 1回の batch_write（上限500件）で送るため、操作ごとの成否がわかる（全体はアトミックではない）
+    - 存在確認は読み込みではなく書き込みの前提条件（update / exists=True）で行う
+    - 同じドキュメントへの書き込みは1つのバッチに入れられないため、その手前でバッチを区切る
+    - 削除の墓標は、削除が成功した操作の分だけ後から書き込む（batch_write は書き込みごとに成否が分かれるため）
+    """
+    collection = db.collection(collection_path)
+    results = [None] * len(operations)
+
+    # 各操作を (index, op, goal_id, 書き込みのリスト) に変換する
+    planned = []
+    for i, operation in enumerate(operations):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        try:
+            if op == 'create':
+                doc_ref = collection.document()
+                writes = [('create', doc_ref, build_goal_create_data(operation.get('goal') or {}))]
+            elif op == 'update':
+                doc_ref = collection.document(bulk_goal_id(operation, op))
+                writes = [('update', doc_ref, build_goal_update_data(operation.get('goal') or {}))]
+            elif op == 'delete':
+                goal_id = bulk_goal_id(operation, op)
+                doc_ref = collection.document(goal_id)
+                writes = [
+                    ('delete', doc_ref, None),
+                    # 差分同期用の墓標（削除が成功した場合だけ書き込む）
+                    ('tombstone', db.collection(tombstone_collection_path).document(goal_id), tombstone_data())
+                ]
+            else:
+                raise ValueError('op must be one of create, update, delete')
+        except ValueError as e:
+            results[i] = {'index': i, 'op': op, 'status': 400, 'error': str(e)}
+            continue
+        planned.append((i, op, doc_ref.id, writes))
+
+    def flush(chunk):
+        if not chunk:
+            return
+        batch = new_bulk_batch(db)
+        positions = []  # 各書き込みがどの操作のものか
+        for i, op, goal_id, writes in chunk:
+            for kind, doc_ref, payload in writes:
+                if kind == 'tombstone':
+                    continue
+                if kind == 'create':
+                    batch.create(doc_ref, payload)
+                elif kind == 'update':
+                    batch.update(doc_ref, payload)
+                else:
+                    batch.delete(doc_ref, option=db.write_option(exists=True))
+                positions.append(i)
+        bump_collection_version(batch, db, collection_path)
+
+        try:
+            response = batch.commit()
+            statuses = list(response.status)
+        except Exception as e:
+            logger.exception("❌ 一括書き込みエラー: %s", e)
+            statuses = None
+
+        for i, op, goal_id, _ in chunk:
+            results[i] = {'index': i, 'op': op, 'goalId': goal_id, 'status': 200}
+        for position, i in enumerate(positions):
+            if statuses is None:
+                results[i].update(status=500, error='write failed')
+                continue
+            status = statuses[position]
+            if status.code != 0 and results[i]['status'] == 200:
+                results[i].update(status=_RPC_STATUS_TO_HTTP.get(status.code, 500), error=status.message)
+
+        tombstones = [(i, doc_ref, payload) for i, _, _, writes in chunk if results[i]['status'] == 200
+                      for kind, doc_ref, payload in writes if kind == 'tombstone']
+        if not tombstones:
+            return
+        batch = new_bulk_batch(db)
+        for _, doc_ref, payload in tombstones:
+            batch.set(doc_ref, payload)
+        try:
+            response = batch.commit()
+            statuses = list(response.status)
+        except Exception as e:
+            logger.exception("❌ 墓標の書き込みエラー: %s", e)
+            statuses = None
+        for position, (i, _, _) in enumerate(tombstones):
+            # 削除は済んでいるが、差分同期には伝わらないため失敗として返す（再送した削除は 404 になる）
+            if statuses is None or statuses[position].code != 0:
+                results[i].update(status=500, error='tombstone write failed')
+
+    chunk = []
+    chunk_docs = set()
+    chunk_writes = 0
+    for item in planned:
+        paths = [doc_ref.path for _, doc_ref, _ in item[3]]
+        # バージョン更新の1件分を残してバッチを区切る
+        if chunk_writes + len(paths) > FIRESTORE_BATCH_LIMIT - 1 or chunk_docs.intersection(paths):
+            flush(chunk)
+            chunk, chunk_docs, chunk_writes = [], set(), 0
+        chunk.append(item)
+        chunk_docs.update(paths)
+        chunk_writes += len(paths)
+    flush(chunk)
+
+    succeeded = sum(1 for r in results if r['status'] == 200)
+    return {
+        'result': 'applied',
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'results': results
+    }
 
 @functions_framework.http
+@log_request
 def user_goals_handler(request):
     try:
+        db = get_db()
+
         # userId, goalId の取得（クエリ or JSONボディ）
         user_id = request.args.get('userId')
         goal_id = request.args.get('goalId')
@@ -19,70 +347,100 @@ def user_goals_handler(request):
         if not user_id:
             return ('userId must be provided', 400)
 
+        add_log_fields(user_id=user_id)
         collection_path = f'user-goals/{user_id}/goals'
+        tombstone_collection_path = f'user-goals/{user_id}/goal-tombstones'
+
+        # GETは条件付きリクエストに対応（変更がなければコレクションを読まずに304を返す）
+        cache_headers = {}
+        if request.method == 'GET':
+            etag = collection_etag(db, collection_path, request)
+            # 圧縮やエンコーダーでバイト列が変わるため弱い ETag にする
+            cache_headers = {'ETag': f'W/"{etag}"', 'Cache-Control': 'no-cache'}
+            if request.if_none_match.contains_weak(etag):
+                add_log_fields(not_modified=True)
+                return ('', 304, cache_headers)
 
         if request.method == 'POST':
             data = request.get_json(silent=True)
             if not data:
                 return ('No JSON payload provided', 400)
+            if not isinstance(data, dict):
+                return ('JSON payload must be an object', 400)
 
-            # Goalデータ例: title, detail, isCompleted, createdAt など
-            title = data.get('title')
-            detail = data.get('detail')
-            is_completed = data.get('isCompleted', False)
-            created_at = data.get('createdAt')
+            # 複数の作成・更新・削除をまとめて適用する
+            if 'operations' in data:
+                operations = data.get('operations')
+                if not isinstance(operations, list) or not operations:
+                    return ('operations must be a non-empty list', 400)
+                if len(operations) > MAX_BULK_OPERATIONS:
+                    return (f'operations must not exceed {MAX_BULK_OPERATIONS} items', 400)
+                result = apply_goal_operations(db, collection_path, tombstone_collection_path, operations)
+                add_log_fields(operations=len(operations), succeeded=result['succeeded'], failed=result['failed'])
+                return (json.dumps(result, ensure_ascii=False), 200, {'Content-Type': 'application/json'})
 
-            if not isinstance(title, str):
-                return ('title must be a string', 400)
+            try:
+                create_data = build_goal_create_data(data)
+            except ValueError as e:
+                return (str(e), 400)
+            try:
+                key = idempotency_key(request)
+            except ValueError as e:
+                return (str(e), 400)
+            fingerprint = request_fingerprint(data)
+            replay = cached_replay(collection_path, key, fingerprint)
+            if replay:
+                return replay
 
-            create_data = {
-                'title': title,
-                'detail': detail,
-                'isCompleted': is_completed,
-                'createdAt': created_at
-            }
-            doc_ref = db.collection(collection_path).add(create_data)
+            doc_ref = db.collection(collection_path).document()
             response = {
                 'result': 'created',
-                'goalId': doc_ref[1].id
+                'goalId': doc_ref.id
             }
+
+            def write(record):
+                batch = db.batch()
+                batch.set(doc_ref, create_data)
+                if record:
+                    # 同じキーが既にあればバッチ全体が AlreadyExists で失敗する
+                    batch.create(*record)
+                bump_collection_version(batch, db, collection_path)
+                batch.commit()
+
+            replay = write_idempotent(db, collection_path, key, fingerprint, response, write)
+            if replay:
+                return replay
+            add_log_fields(goal_id=doc_ref.id)
             return (json.dumps(response), 200, {'Content-Type': 'application/json'})
 
         elif request.method == 'PUT':
             data = request.get_json(silent=True)
             if not data:
                 return ('No JSON payload provided', 400)
+            if not isinstance(data, dict):
+                return ('JSON payload must be an object', 400)
 
             goal_id = goal_id or data.get('goalId')
-            title = data.get('title')
-            detail = data.get('detail')
-            is_completed = data.get('isCompleted')
-            created_at = data.get('createdAt')
-
             if not isinstance(goal_id, str):
                 return ('goalId must be provided as a string for update', 400)
-            if title is not None and not isinstance(title, str):
-                return ('title must be a string', 400)
+            try:
+                update_data = build_goal_update_data(data)
+            except ValueError as e:
+                return (str(e), 400)
 
             doc_ref = db.collection(collection_path).document(goal_id)
-            if not doc_ref.get().exists:
-                return ('Goal not found', 404)
-
-            update_data = {}
-            if title is not None:
-                update_data['title'] = title
-            if detail is not None:
-                update_data['detail'] = detail
-            if is_completed is not None:
-                update_data['isCompleted'] = is_completed
-            if created_at is not None:
-                update_data['createdAt'] = created_at
-
-            doc_ref.update(update_data)
+
+            batch = db.batch()
+            batch.update(doc_ref, update_data)
+            bump_collection_version(batch, db, collection_path)
+            error = commit_write(batch, 'Goal not found')
+            if error:
+                return error
             response = {
                 'result': 'updated',
                 'goalId': goal_id
             }
+            add_log_fields(goal_id=goal_id)
             return (json.dumps(response), 200, {'Content-Type': 'application/json'})
 
         elif request.method == 'DELETE':
@@ -90,30 +448,72 @@ def user_goals_handler(request):
             if not isinstance(goal_id, str):
                 return ('goalId must be provided as a string for delete', 400)
             doc_ref = db.collection(collection_path).document(goal_id)
-            if not doc_ref.get().exists:
-                return ('Goal not found', 404)
-            doc_ref.delete()
+            # 削除と同時に墓標を残し、差分同期で削除を伝えられるようにする
+            batch = db.batch()
+            batch.delete(doc_ref, option=db.write_option(exists=True))
+            batch.set(db.collection(tombstone_collection_path).document(goal_id), tombstone_data())
+            bump_collection_version(batch, db, collection_path)
+            error = commit_write(batch, 'Goal not found')
+            if error:
+                return error
             response = {
                 'result': 'deleted',
                 'goalId': goal_id
             }
+            add_log_fields(goal_id=goal_id)
             return (json.dumps(response), 200, {'Content-Type': 'application/json'})
 
+        elif request.method == 'GET' and request.args.get('since') is not None:
+            # 差分同期: since 以降の変更と削除だけを返す（since= で初回の全件同期）
+            try:
+                fields = parse_fields(request, GOAL_FIELDS + ('goalId',))
+                changes = query_changes(db, collection_path, tombstone_collection_path, request.args.get('since'),
+                                        'goalId', fields)
+            except ValueError as e:
+                return (str(e), 400)
+            add_log_fields(count=len(changes['changed']), deleted=len(changes['deleted']), reset=changes['reset'])
+            return json_response(request, changes, cache_headers)
+
+        elif request.method == 'GET' and any(request.args.get(p) is not None for p in PAGINATION_PARAMS):
+            # ページング付きGET: {"goals": [...], "nextCursor": "..."} を返す
+            try:
+                fields = parse_fields(request, GOAL_FIELDS + ('goalId',))
+                page = query_user_goals_page(db, collection_path, request.args, fields)
+            except ValueError as e:
+                return (str(e), 400)
+            add_log_fields(count=len(page['goals']), has_more=page['nextCursor'] is not None)
+            return json_response(request, page, cache_headers)
+
         elif request.method == 'GET':
-            docs = db.collection(collection_path).stream()
+            # 従来のGET: 全件を配列で返す（既存クライアント向け）
+            try:
+                fields = parse_fields(request, GOAL_FIELDS + ('goalId',))
+            except ValueError as e:
+                return (str(e), 400)
+            # 作成日時順（新しい順）の並び替えは JSON・NDJSON とも Firestore 側で行う
+            # （createdAt が null の目標も最後に並ぶ。createdAt フィールドを持たないドキュメントは含まれない）
+            from google.cloud import firestore
+            query = db.collection(collection_path).order_by('createdAt', direction=firestore.Query.DESCENDING)
+            query = select_fields(query, fields, 'goalId', required=('createdAt',))
+            if wants_ndjson(request):
+                # ストリーミング: 読んだ順にそのまま送る
+                return ndjson_response(query.stream(), 'goalId', fields, cache_headers)
             result = []
-            for doc in docs:
+            for doc in query.stream():
                 doc_dict = doc.to_dict()
                 doc_dict['goalId'] = doc.id
-                result.append(doc_dict)
-            
-            # 作成日時順にソート（新しい順）
-            result.sort(key=lambda x: x.get('createdAt', ''), reverse=True)
+                result.append(project_fields(doc_dict, fields, 'goalId'))
+            add_log_fields(count=len(result))
             
-            return (json.dumps(result, ensure_ascii=False), 200, {'Content-Type': 'application/json'})
+            return json_response(request, result, cache_headers)
 
         else:
             return ('Method Not Allowed', 405)
 
     except Exception as e:
-        return (json.dumps({'error': str(e)}), 500, {'Content-Type': 'application/json'}) 
\ No newline at end of file
+        logger.exception("❌ 関数実行エラー: %s", e)
+        return (json.dumps({'error': str(e)}), 500, {'Content-Type': 'application/json'}) 
+
+# import 完了までの時間を記録
+startup_report['import_ms'] = round((time.perf_counter() - _import_started) * 1000, 1)
+logger.info('startup', extra={'fields': dict(startup_report)})